@@ -17,6 +17,7 @@ import logging
 
 import json
 import html
+import uuid
 
 from data_formulator.agents.agent_concept_derive import ConceptDeriveAgent
 from data_formulator.agents.agent_py_concept_derive import PyConceptDeriveAgent
@@ -36,7 +37,11 @@ from data_formulator.agents.agent_interactive_explore import InteractiveExploreA
 from data_formulator.agents.agent_report_gen import ReportGenAgent
 from data_formulator.agents.client_utils import Client
 
+from data_formulator.agents.agent_utils import get_input_table_sample_rows
+
 from data_formulator.db_manager import db_manager
+from data_formulator.query_control import cancellable, get_request_id, stream_with_cancellation
+from data_formulator.table_refs import TableRefError, is_table_ref, resolve_input_tables
 from data_formulator.workflows.exploration_flow import run_exploration_flow_streaming
 
 # Get logger for this module (logging config done in app.py)
@@ -44,6 +49,16 @@ logger = logging.getLogger(__name__)
 
 agent_bp = Blueprint('agent', __name__, url_prefix='/api/agent')
 
+
+def resolve_agent_input_tables(input_tables, language="python"):
+    """Resolve input tables sent as references to session tables ({"name", "table_ref": {"table_name", "version"}})
+    instead of rows: python agents get them read from DuckDB as DataFrames, sql agents query them directly"""
+    if not any(is_table_ref(table) for table in input_tables):
+        return input_tables
+    with db_manager.connection(session['session_id']) as conn:
+        return resolve_input_tables(conn, input_tables, load_data=(language != "sql"))
+
+
 def get_client(model_config):
     """构造（或复用）LLM Client。
 
@@ -431,6 +446,7 @@ def sort_data_request():
     return response
 
 @agent_bp.route('/derive-data', methods=['GET', 'POST'])
+@cancellable
 def derive_data():
 
     if request.is_json:
@@ -440,7 +456,7 @@ def derive_data():
 
         client = get_client(content['model'])
 
-        # each table is a dict with {"name": xxx, "rows": [...]}
+        # each table is a dict with {"name": xxx, "rows": [...]} or {"name": xxx, "table_ref": {"table_name": xxx, "version": xxx}}
         input_tables = content["input_tables"]
         chart_type = content.get("chart_type", "")
         chart_encodings = content.get("chart_encodings", {})
@@ -456,10 +472,17 @@ def derive_data():
         else:
             prev_messages = []
 
+        try:
+            input_tables = resolve_agent_input_tables(input_tables, language)
+        except TableRefError as e:
+            response = flask.jsonify({ "token": token, "status": "error", "results": [], "message": str(e) })
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response
+
         logger.info("== input tables ===>")
         for table in input_tables:
             logger.info(f"===> Table: {table['name']} (first 5 rows)")
-            logger.info(table['rows'][:5])
+            logger.info(get_input_table_sample_rows(table, 5))
 
         logger.info("== user spec ===")
         logger.info(chart_type)
@@ -514,7 +537,7 @@ def explore_data_streaming():
             content = request.get_json()        
             token = content["token"]
 
-            # each table is a dict with {"name": xxx, "rows": [...]}
+            # each table is a dict with {"name": xxx, "rows": [...]} or {"name": xxx, "table_ref": {"table_name": xxx, "version": xxx}}
             input_tables = content["input_tables"]
             initial_plan = content["initial_plan"]  # The exploration question
             language = content.get("language", "python")  # whether to use sql or python, default to python
@@ -523,10 +546,16 @@ def explore_data_streaming():
             agent_exploration_rules = content.get("agent_exploration_rules", "")
             agent_coding_rules = content.get("agent_coding_rules", "")
 
+            try:
+                input_tables = resolve_agent_input_tables(input_tables, language)
+            except TableRefError as e:
+                yield json.dumps({ "token": token, "status": "error", "result": None, "error_message": str(e) }) + '\n'
+                return
+
             logger.info("== input tables ===>")
             for table in input_tables:
                 logger.info(f"===> Table: {table['name']} (first 5 rows)")
-                logger.info(table['rows'][:5])
+                logger.info(get_input_table_sample_rows(table, 5))
 
             logger.info("== exploration question ===")
             logger.info(initial_plan)
@@ -591,8 +620,9 @@ def explore_data_streaming():
             }
             yield json.dumps(error_data) + '\n'
 
+    # blank heartbeat lines notice disconnected clients (and cancel their queries) while a query runs
     response = Response(
-        stream_with_context(generate()),
+        stream_with_cancellation(stream_with_context(generate()), session.get('session_id'), get_request_id() or uuid.uuid4().hex),
         mimetype='application/json',
         headers={
             'Access-Control-Allow-Origin': '*',
@@ -604,6 +634,7 @@ def explore_data_streaming():
 
 
 @agent_bp.route('/refine-data', methods=['GET', 'POST'])
+@cancellable
 def refine_data():
 
     if request.is_json:
@@ -614,7 +645,7 @@ def refine_data():
 
         client = get_client(content['model'])
 
-        # each table is a dict with {"name": xxx, "rows": [...]}
+        # each table is a dict with {"name": xxx, "rows": [...]} or {"name": xxx, "table_ref": {"table_name": xxx, "version": xxx}}
         input_tables = content["input_tables"]
         dialog = content["dialog"]
 
@@ -628,10 +659,17 @@ def refine_data():
         
         language = content.get("language", "python") # whether to use sql or python, default to python
 
+        try:
+            input_tables = resolve_agent_input_tables(input_tables, language)
+        except TableRefError as e:
+            response = flask.jsonify({ "token": token, "status": "error", "results": [], "message": str(e) })
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response
+
         logger.info("== input tables ===>")
         for table in input_tables:
             logger.info(f"===> Table: {table['name']} (first 5 rows)")
-            logger.info(table['rows'][:5])
+            logger.info(get_input_table_sample_rows(table, 5))
         
         logger.info("== user spec ===>")
         logger.info(chart_type)
@@ -670,9 +708,14 @@ def request_code_expl():
         content = request.get_json()        
         client = get_client(content['model'])
 
-        # each table is a dict with {"name": xxx, "rows": [...]}
+        # each table is a dict with {"name": xxx, "rows": [...]} or {"name": xxx, "table_ref": {"table_name": xxx, "version": xxx}}
         input_tables = content["input_tables"]
         code = content["code"]
+
+        try:
+            input_tables = resolve_agent_input_tables(input_tables)
+        except TableRefError as e:
+            return jsonify({'error': str(e)}), 400
         
         code_expl_agent = CodeExplanationAgent(client=client)
         candidates = code_expl_agent.run(input_tables, code)
@@ -793,7 +836,7 @@ def get_recommendation_questions():
             yield 'data: ' + json.dumps({"type": "error", **error_data}) + '\n\n'
 
     response = Response(
-        stream_with_context(generate()),
+        stream_with_cancellation(stream_with_context(generate()), session.get('session_id'), get_request_id() or uuid.uuid4().hex),
         mimetype='text/event-stream',
         headers={
             'Access-Control-Allow-Origin': '*',
@@ -3,7 +3,7 @@
 
 import json
 
-from data_formulator.agents.agent_utils import extract_json_objects, generate_data_summary, extract_code_from_gpt_response
+from data_formulator.agents.agent_utils import extract_json_objects, generate_data_summary, extract_code_from_gpt_response, get_input_table_df
 import data_formulator.py_sandbox as py_sandbox
 import pandas as pd
 
@@ -268,7 +268,7 @@ class PythonDataTransformationAgent(object):
                 code_str = code_blocks[-1]
 
                 try:
-                    result = py_sandbox.run_transform_in_sandbox2020(code_str, [pd.DataFrame.from_records(t['rows']) for t in input_tables], self.exec_python_in_subprocess)
+                    result = py_sandbox.run_transform_in_sandbox2020(code_str, [get_input_table_df(t) for t in input_tables], self.exec_python_in_subprocess)
                     result['code'] = code_str
 
                     if result['status'] == 'ok':
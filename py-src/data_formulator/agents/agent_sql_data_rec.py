@@ -4,7 +4,7 @@
 import json
 
 from data_formulator.agents.agent_utils import extract_json_objects, extract_code_from_gpt_response
-from data_formulator.agents.agent_sql_data_transform import get_sql_table_statistics_str, sanitize_table_name
+from data_formulator.agents.agent_sql_data_transform import get_sql_table_statistics_str, sanitize_table_name, execute_view_preview
 
 import random
 import string
@@ -260,11 +260,8 @@ class SQLDataRecAgent(object):
                     self.conn.execute(create_query)
                     self.conn.commit()
 
-                    # Check how many rows are in the table
-                    row_count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-                    
-                    # Only limit to 5000 if there are more rows
-                    query_output = self.conn.execute(f"SELECT * FROM {table_name} LIMIT 5000").fetch_df()
+                    # evaluate the query once for both the row count and the first rows
+                    query_output, row_count = execute_view_preview(self.conn, table_name)
                 
                     result = {
                         "status": "ok",
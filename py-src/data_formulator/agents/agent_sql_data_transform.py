@@ -2,10 +2,16 @@
 # Licensed under the MIT License.
 
 import json
+import os
 import random
 import string
+import threading
+from collections import OrderedDict
 
 from data_formulator.agents.agent_utils import extract_json_objects, extract_code_from_gpt_response
+from data_formulator.table_profiler import profile_table, sample_distinct_values, NUMERIC_TYPES
+from data_formulator.query_control import STATEMENT_TIMEOUT, query_watchdog
+from data_formulator.table_versions import get_table_version_key
 import pandas as pd
 
 import logging 
@@ -158,6 +164,36 @@ def sanitize_table_name(table_name: str) -> str:
     sanitized_name = re.sub(r'[^a-zA-Z0-9_\.$]', '', sanitized_name)
     return sanitized_name
 
+
+# max number of rows of a query result returned to the client, the rest is fetched from the view on demand
+QUERY_RESULT_ROW_LIMIT = 5000
+
+
+def execute_view_preview(conn, view_name: str, row_limit: int = QUERY_RESULT_ROW_LIMIT, single_execution: bool = None):
+    """Run the query behind a view, returning (up to `row_limit` rows as a DataFrame, total row count).
+
+    In single execution mode (SQL_RESULT_SINGLE_EXECUTION, on by default) the count is a window aggregate
+    computed in the same evaluation as the rows, so an expensive generated query runs only once. Otherwise
+    a separate COUNT(*) is run, which can be cheaper for very large plain scans since DuckDB drops the work
+    counting doesn't need (e.g. ORDER BY).
+
+    The query is interrupted (raising QueryCancelled) after SQL_STATEMENT_TIMEOUT seconds or when
+    the request it runs for is cancelled.
+    """
+    if single_execution is None:
+        single_execution = os.getenv('SQL_RESULT_SINGLE_EXECUTION', 'true').lower() == 'true'
+
+    if not single_execution:
+        with query_watchdog.track(conn, timeout=STATEMENT_TIMEOUT or None):
+            row_count = conn.execute(f"SELECT COUNT(*) FROM {view_name}").fetchone()[0]
+            return conn.execute(f"SELECT * FROM {view_name} LIMIT {int(row_limit)}").fetch_df(), row_count
+
+    # the count is the last column, picked by position so it can't clash with the view's column names
+    with query_watchdog.track(conn, timeout=STATEMENT_TIMEOUT or None):
+        df = conn.execute(f"SELECT *, COUNT(*) OVER () FROM {view_name} LIMIT {int(row_limit)}").fetch_df()
+    row_count = int(df.iloc[0, -1]) if len(df) > 0 else 0
+    return df.iloc[:, :-1], row_count
+
 class SQLDataTransformationAgent(object):
 
     def __init__(self, client, conn, system_prompt=None, agent_coding_rules=""):
@@ -211,14 +247,8 @@ class SQLDataTransformationAgent(object):
                     self.conn.execute(create_query)
                     self.conn.commit()
 
-                    # Check how many rows are in the table
-                    row_count = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-                    
-                    # Only limit to 5000 if there are more rows
-                    if row_count > 5000:
-                        query_output = self.conn.execute(f"SELECT * FROM {table_name} LIMIT 5000").fetch_df()
-                    else:
-                        query_output = self.conn.execute(f"SELECT * FROM {table_name}").fetch_df()
+                    # evaluate the query once for both the row count and the first rows
+                    query_output, row_count = execute_view_preview(self.conn, table_name)
                 
                     result = {
                         "status": "ok",
@@ -352,15 +382,64 @@ class SQLDataTransformationAgent(object):
         return self.process_gpt_sql_response(response, messages)
         
 
+# Cache of table summaries shared by all agents, keyed by database file, table and the table's version
+# (see get_table_version_key) so that replaced or modified tables miss.
+_TABLE_STATS_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+_TABLE_STATS_CACHE_LOCK = threading.Lock()
+_TABLE_STATS_CACHE_MAX_SIZE = int(os.getenv('TABLE_STATS_CACHE_SIZE', '256'))
+
+
+def clear_table_statistics_cache():
+    """Drop all cached table summaries"""
+    with _TABLE_STATS_CACHE_LOCK:
+        _TABLE_STATS_CACHE.clear()
+
+
 def get_sql_table_statistics_str(conn, table_name: str, 
         row_sample_size: int = 5, # number of rows to be sampled in the sample data part
         field_sample_size: int = 7, # number of example values for each field to be sampled
-        max_val_chars: int = 140 # max number of characters to be shown for each example value
+        max_val_chars: int = 140, # max number of characters to be shown for each example value
+        use_cache: bool = True # reuse the summary computed for the same version of the table
     ) -> str:
     """Get a string representation of the table statistics"""
 
     table_name = sanitize_table_name(table_name)
 
+    cache_key = None
+    if use_cache and _TABLE_STATS_CACHE_MAX_SIZE > 0:
+        try:
+            version_key = get_table_version_key(conn, table_name)
+        except Exception as e:
+            logger.warning(f"Unable to get version of table {table_name}: {e}")
+            version_key = None
+        if version_key is not None:
+            cache_key = (table_name, version_key, row_sample_size, field_sample_size, max_val_chars)
+            with _TABLE_STATS_CACHE_LOCK:
+                if cache_key in _TABLE_STATS_CACHE:
+                    _TABLE_STATS_CACHE.move_to_end(cache_key)
+                    logger.debug(f"Using cached statistics for table {table_name}")
+                    return _TABLE_STATS_CACHE[cache_key]
+
+    table_summary_str = compute_sql_table_statistics_str(conn, table_name, row_sample_size, field_sample_size, max_val_chars)
+
+    if cache_key is not None:
+        with _TABLE_STATS_CACHE_LOCK:
+            _TABLE_STATS_CACHE[cache_key] = table_summary_str
+            while len(_TABLE_STATS_CACHE) > _TABLE_STATS_CACHE_MAX_SIZE:
+                _TABLE_STATS_CACHE.popitem(last=False)
+
+    return table_summary_str
+
+
+def compute_sql_table_statistics_str(conn, table_name: str, 
+        row_sample_size: int = 5,
+        field_sample_size: int = 7,
+        max_val_chars: int = 140
+    ) -> str:
+    """Compute the table statistics string by scanning the table (uncached)"""
+
+    table_name = sanitize_table_name(table_name)
+
     # Get column information
     columns = conn.execute(f"DESCRIBE {table_name}").fetchall()
     sample_data = conn.execute(f"SELECT * FROM {table_name} LIMIT {row_sample_size}").fetchall()
@@ -371,67 +450,16 @@ def get_sql_table_statistics_str(conn, table_name: str,
     for i, row in enumerate(sample_data):
         formatted_sample_data += f"{i}| " + " | ".join(str(val)[:max_val_chars]+ "..." if len(str(val)) > max_val_chars else str(val) for val in row) + " |\n"
     
-    col_metadata_list = []
-    for col in columns:
-        col_name = col[0]
-        col_type = col[1]
-        
-        # Properly quote column names to avoid SQL keywords issues
-        quoted_col_name = f'"{col_name}"'
-        
-        # Basic stats query
-        stats_query = f"""
-        SELECT 
-            COUNT(*) as count,
-            COUNT(DISTINCT {quoted_col_name}) as unique_count,
-            COUNT(*) - COUNT({quoted_col_name}) as null_count
-        FROM {table_name}
-        """
-        
-        # Add numeric stats if applicable
-        if col_type in ['INTEGER', 'DOUBLE', 'DECIMAL']:
-            stats_query = f"""
-            SELECT 
-                COUNT(*) as count,
-                COUNT(DISTINCT {quoted_col_name}) as unique_count,
-                COUNT(*) - COUNT({quoted_col_name}) as null_count,
-                MIN({quoted_col_name}) as min_value,
-                MAX({quoted_col_name}) as max_value,
-                AVG({quoted_col_name}) as avg_value
-            FROM {table_name}
-            """
-        
-        col_stats = conn.execute(stats_query).fetchone()
-        
-        # Create a dictionary with appropriate keys based on column type
-        if col_type in ['INTEGER', 'DOUBLE', 'DECIMAL']:
-            stats_dict = dict(zip(
-                ["count", "unique_count", "null_count", "min", "max", "avg"],
-                col_stats
-            ))
-        else:
-            stats_dict = dict(zip(
-                ["count", "unique_count", "null_count"],
-                col_stats
-            ))
-
-            # Combined query for top 4 and bottom 3 values using UNION ALL
-            query_for_sample_values = f"""
-            (SELECT DISTINCT {quoted_col_name}
-                FROM {table_name} 
-                WHERE {quoted_col_name} IS NOT NULL 
-                LIMIT {field_sample_size})
-            """
-            
-            sample_values = conn.execute(query_for_sample_values).fetchall()
-            
-            stats_dict['sample_values'] = [str(val)[:max_val_chars]+ "..." if len(str(val)) > max_val_chars else str(val) for val in sample_values]
-
-        col_metadata_list.append({
-            "column": col_name,
-            "type": col_type,
-            "statistics": stats_dict,
-        })
+    # all column statistics come from a single scan, sample values from one extra round trip
+    col_metadata_list = profile_table(conn, table_name, columns)
+    non_numeric_columns = [col[0] for col in columns if col[1] not in NUMERIC_TYPES]
+    sample_values = sample_distinct_values(conn, table_name, non_numeric_columns, field_sample_size)
+    for col_metadata in col_metadata_list:
+        if col_metadata['column'] in sample_values:
+            col_metadata['statistics']['sample_values'] = [
+                val[:max_val_chars] + "..." if len(val) > max_val_chars else val 
+                for val in sample_values[col_metadata['column']]
+            ]
 
     table_metadata = {
         "column_metadata": col_metadata_list,
@@ -215,19 +215,38 @@ def get_field_summary(field_name, df, field_sample_size, max_val_chars=100):
 
     return f"{field_name} -- type: {df[field_name].dtype}, values: {val_str}"
 
+def get_input_table_df(input_table):
+    """DataFrame of an agent input table: a copy of the one resolved from a table reference
+    (so executed code can't alter it between attempts), or built from the rows sent by the client"""
+    if input_table.get("df") is not None:
+        return input_table["df"].copy()
+    return pd.DataFrame.from_records(input_table["rows"])
+
+def get_input_table_sample_rows(input_table, n=5, conn=None):
+    """first n rows of an agent input table as json records, `conn` is used for tables that are
+    only referenced by name in the session database"""
+    if input_table.get("df") is not None:
+        return json.loads(input_table["df"].head(n).to_json(orient='records', date_format='iso'))
+    if "rows" in input_table:
+        return input_table["rows"][:n]
+    if conn is not None:
+        from data_formulator.agents.agent_sql_data_transform import sanitize_table_name
+        sample_df = conn.execute(f"SELECT * FROM {sanitize_table_name(input_table['name'])} LIMIT {int(n)}").fetchdf()
+        return json.loads(sample_df.to_json(orient='records', date_format='iso'))
+    return []
+
 def generate_data_summary(input_tables, include_data_samples=True, field_sample_size=7, max_val_chars=140):
     
     def assemble_table_summary(input_table, idx):
         table_id = f'table{idx+1}'
         name = string_to_py_varname(input_table["name"])
-        rows = input_table["rows"]
         description = input_table.get("attached_metadata", "")
         
-        df = pd.DataFrame(rows)
+        df = input_table["df"] if input_table.get("df") is not None else pd.DataFrame(input_table["rows"])
         fields_summary = '\n'.join(['\t*' + get_field_summary(fname, df, field_sample_size, max_val_chars)  for fname in list(df.columns.values)])
 
         fields_section = f'## fields\n{fields_summary}\n\n'
-        sample_section = f'## sample\n{pd.DataFrame(rows[:5]).to_string()}\n......\n\n' if include_data_samples else ''
+        sample_section = f'## sample\n{df.head(5).to_string()}\n......\n\n' if include_data_samples else ''
         description_section = f'## description\n{description}\n\n' if description else ''
 
         summary_str = f'''# {table_id} ({name})\n\n{description_section}{fields_section}{sample_section}'''
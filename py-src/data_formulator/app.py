@@ -36,13 +36,13 @@ import os
 from data_formulator.tables_routes import tables_bp
 from data_formulator.agent_routes import agent_bp
 from data_formulator.db_manager import db_manager
-from data_formulator.example_datasets_config import EXAMPLE_DATASETS
+from data_formulator.db_janitor import db_janitor
+from data_formulator.example_catalog import example_catalog
 
 import queue
 from typing import Dict, Any
 
 app = Flask(__name__, static_url_path='', static_folder=os.path.join(APP_ROOT, "dist"))
-app.secret_key = secrets.token_hex(16)  # Generate a random secret key for sessions
 app.json.sort_keys = False
 
 class CustomJSONEncoder(json.JSONEncoder):
@@ -60,6 +60,10 @@ load_dotenv(os.path.join(APP_ROOT, "..", "..", 'api-keys.env'))
 load_dotenv(os.path.join(APP_ROOT, 'api-keys.env'))
 load_dotenv(os.path.join(APP_ROOT, '.env'))
 
+# the secret key must be the same in all worker processes (e.g. under gunicorn) for their session
+# cookies to be valid everywhere, so it is shared through the session registry unless configured
+app.secret_key = os.getenv('FLASK_SECRET_KEY') or db_manager.shared_secret_key()
+
 # Add this line to store args at app level
 app.config['CLI_ARGS'] = {
     'exec_python_in_subprocess': os.environ.get('EXEC_PYTHON_IN_SUBPROCESS', 'false').lower() == 'true',
@@ -73,6 +77,10 @@ app.config['CLI_ARGS'] = {
 # Only register tables blueprint if database is not disabled
 if not app.config['CLI_ARGS']['disable_database']:
     app.register_blueprint(tables_bp)
+    # checkpoints, compacts and evicts session databases in the background
+    db_janitor.start()
+    # loads the example datasets into a read-only database shared by the sessions
+    example_catalog.start()
 app.register_blueprint(agent_bp)
 
 # Get logger for this module (logging config moved to run_app function)
@@ -100,7 +108,7 @@ def configure_logging():
 
 @app.route('/api/example-datasets')
 def get_sample_datasets():
-    return flask.jsonify(EXAMPLE_DATASETS)
+    return flask.jsonify(example_catalog.annotated_datasets())
 
 
 @app.route("/", defaults={"path": ""})
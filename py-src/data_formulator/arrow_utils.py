@@ -0,0 +1,48 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import io
+import json
+import logging
+from typing import Any, Dict, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+# schema metadata key that carries the json metadata of a response (row counts, paging, ...)
+ARROW_METADATA_KEY = b'data_formulator'
+
+
+def fetch_arrow_table(result) -> "pa.Table":
+    """Fetch a DuckDB query result as an Arrow table (works across DuckDB versions)"""
+    if hasattr(result, 'to_arrow_table'):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+def serialize_arrow_stream(table: "pa.Table", metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """Serialize an Arrow table in the Arrow IPC stream format, with optional json metadata
+    attached to the schema"""
+    if metadata is not None:
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[ARROW_METADATA_KEY] = json.dumps(metadata, default=str).encode('utf-8')
+        table = table.replace_schema_metadata(schema_metadata)
+
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def deserialize_arrow_stream(data: bytes) -> "pa.Table":
+    """Read an Arrow table from bytes in the Arrow IPC stream format"""
+    with pa.ipc.open_stream(data) as reader:
+        return reader.read_all()
@@ -1,20 +1,28 @@
 import json
 import logging
 import re
-from typing import Dict, Any, List, Optional
-import pandas as pd
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import duckdb
 
-from data_formulator.data_loader.external_data_loader import ExternalDataLoader, sanitize_table_name
+from data_formulator.data_loader.external_data_loader import (ExternalDataLoader, sanitize_table_name,
+                                                              INGEST_BATCH_SIZE, INGEST_ROW_CAP)
 from data_formulator.security import validate_sql_query
 
 try:
     from google.cloud import bigquery
     from google.oauth2 import service_account
+    import pyarrow as pa
     BIGQUERY_AVAILABLE = True
 except ImportError:
     BIGQUERY_AVAILABLE = False
 
+try:
+    # parallel Arrow reads of query results (Storage Read API), results are paged over REST without it
+    from google.cloud import bigquery_storage
+    BIGQUERY_STORAGE_AVAILABLE = True
+except ImportError:
+    BIGQUERY_STORAGE_AVAILABLE = False
+
 log = logging.getLogger(__name__)
 
 class BigQueryDataLoader(ExternalDataLoader):
@@ -26,7 +34,8 @@ class BigQueryDataLoader(ExternalDataLoader):
             {"name": "project_id", "type": "text", "required": True, "description": "Google Cloud Project ID", "default": ""},
             {"name": "dataset_id", "type": "text", "required": False, "description": "Dataset ID(s) - leave empty for all, or specify one (e.g., 'billing') or multiple separated by commas (e.g., 'billing,enterprise_collected,ga_api')", "default": ""},
             {"name": "credentials_path", "type": "text", "required": False, "description": "Path to service account JSON file (optional)", "default": ""},
-            {"name": "location", "type": "text", "required": False, "description": "BigQuery location (default: US)", "default": "US"}
+            {"name": "location", "type": "text", "required": False, "description": "BigQuery location (default: US)", "default": "US"},
+            {"name": "read_streams", "type": "text", "required": False, "description": "Maximum number of parallel Storage Read API streams (optional, default: chosen by BigQuery)", "default": ""}
         ]
 
     @staticmethod
@@ -54,12 +63,17 @@ Option 3 - Environment Variables
 Required Permissions:
     - BigQuery Data Viewer (for reading data)
     - BigQuery Job User (for running queries)
+    - BigQuery Read Session User (for fast imports with the Storage Read API)
+
+Imports read results with the BigQuery Storage Read API when google-cloud-bigquery-storage
+is installed (pip install google-cloud-bigquery-storage), and page through them otherwise.
 
 Parameters:
     - project_id: Your Google Cloud Project ID (required)
     - dataset_id: Specific dataset to browse (optional - leave empty to see all datasets)
     - location: BigQuery location/region (default: US)
     - credentials_path: Path to service account JSON file (optional)
+    - read_streams: Maximum number of parallel read streams (optional)
 
 Supported Operations:
     - Browse datasets and tables
@@ -80,6 +94,7 @@ Supported Operations:
         self.project_id = params.get("project_id")
         self.dataset_ids = [d.strip() for d in params.get("dataset_id", "").split(",") if d.strip()]  # Support multiple datasets
         self.location = params.get("location", "US")
+        self.read_streams = int(params.get("read_streams") or 0)
         
         # Initialize BigQuery client
         if params.get("credentials_path"):
@@ -91,11 +106,18 @@ Supported Operations:
             )
         else:
             # Use default credentials (ADC)
+            credentials = None
             self.client = bigquery.Client(
                 project=self.project_id, 
                 location=self.location
             )
 
+        self.bqstorage_client = None
+        if BIGQUERY_STORAGE_AVAILABLE:
+            self.bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+        else:
+            log.info("google-cloud-bigquery-storage is not installed, query results will be paged over REST")
+
     def list_tables(self, table_filter: str = None) -> List[Dict[str, Any]]:
         """List tables from BigQuery datasets"""
         results = []
@@ -170,42 +192,39 @@ Supported Operations:
         log.info(f"Returning {len(results)} tables")
         return results
 
-    def _convert_bigquery_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Convert BigQuery-specific dtypes to standard pandas dtypes"""
-
-        def safe_convert(x):
-            try:
-                if x is None or pd.isna(x):
-                    return None
-                if isinstance(x, (dict, list)):
-                    return json.dumps(x, default=str)
-                if hasattr(x, "__dict__"):
-                    return json.dumps(x.__dict__, default=str)
-                s = str(x)
-                if "[object Object]" in s:
-                    return json.dumps(x, default=str)
-                return s
-            except Exception:
-                return str(x) if x is not None else None
-
-        for col in df.columns:
-            # Convert db_dtypes.DateDtype to standard datetime
-            if hasattr(df[col].dtype, "name") and "dbdate" in str(df[col].dtype).lower():
-                df[col] = pd.to_datetime(df[col])
-            # Convert other db_dtypes if needed
-            elif str(df[col].dtype).startswith("db_dtypes"):
-                try:
-                    df[col] = df[col].astype(str)
-                except Exception as e:
-                   logging.error(f"Failed to convert column '{col}' to string: {e}")
-            # Handle nested objects/JSON columns
-            elif df[col].dtype == "object":
-                df[col] = df[col].apply(safe_convert)
-
-        return df
+    def _stream_query(self, query: str) -> Iterator:
+        """Run a query and yield its results as Arrow batches, read from parallel streams with the
+        Storage Read API when available (in pages of INGEST_BATCH_SIZE rows otherwise)."""
+        rows = self.client.query(query).result(page_size=INGEST_BATCH_SIZE)
+        batches = rows.to_arrow_iterable(bqstorage_client=self.bqstorage_client,
+                                         max_stream_count=self.read_streams or None)
+        for batch in batches:
+            yield self._convert_arrow_batch(batch)
 
-    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 1000000):
-            """Ingest data from BigQuery table into DuckDB with stable, de-duplicated column aliases."""
+    @staticmethod
+    def _convert_arrow_batch(batch) -> "pa.RecordBatch":
+        """Cast the columns DuckDB can't read from Arrow: extension types (e.g. JSON) to their
+        storage type and BIGNUMERIC (decimal256) to strings."""
+        columns = []
+        for column in batch.columns:
+            if isinstance(column.type, pa.ExtensionType):
+                column = column.storage
+            if pa.types.is_decimal256(column.type):
+                column = column.cast(pa.string())
+            columns.append(column)
+        return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+    def _nested_columns_to_json(self, table_name: str):
+        """Store the STRUCT, LIST and MAP columns of an ingested table as JSON strings"""
+        columns = self.duck_db_conn.execute(f"DESCRIBE {table_name}").fetchall()
+        for column_name, column_type, *_ in columns:
+            if column_type.startswith(('STRUCT', 'MAP')) or column_type.endswith(']'):
+                column = '"' + column_name.replace('"', '""') + '"'
+                self.duck_db_conn.execute(f"ALTER TABLE {table_name} ALTER {column} TYPE VARCHAR USING to_json({column})::VARCHAR")
+
+    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 1000000) -> Tuple[str, int]:
+            """Ingest data from BigQuery table into DuckDB with stable, de-duplicated column aliases,
+            returns the name of the created table and its row count."""
             if name_as is None:
                 name_as = table_name.split('.')[-1]
 
@@ -274,19 +293,10 @@ Supported Operations:
 
             query = f"SELECT {', '.join(select_parts)} FROM `{table_name}` LIMIT {size}"
 
-            df = self.client.query(query).to_dataframe()
-
-            # Safety net: drop exact duplicate names if something slipped through
-            if df.columns.duplicated().any():
-                dupes = df.columns[df.columns.duplicated()].tolist()
-                log.warning(f"Duplicate column names detected in DataFrame, dropping later ones: {dupes}")
-                df = df.loc[:, ~df.columns.duplicated()]
-
-
-            # Convert BigQuery-specific dtypes
-            df = self._convert_bigquery_dtypes(df)
-
-            self.ingest_df_to_duckdb(df, name_as)
+            name_as, row_count = self.ingest_batches_to_duckdb(self._stream_query(query), name_as, row_cap=size)
+            if row_count > 0:
+                self._nested_columns_to_json(name_as)
+            return name_as, row_count
 
     def view_query_sample(self, query: str) -> List[Dict[str, Any]]:
         """Execute query and return sample results as a list of dictionaries"""
@@ -301,24 +311,20 @@ Supported Operations:
         df = self.client.query(query).to_dataframe()
         return json.loads(df.to_json(orient="records"))
 
-    def ingest_data_from_query(self, query: str, name_as: str) -> pd.DataFrame:
-        """Execute custom query and ingest results into DuckDB"""
+    def ingest_data_from_query(self, query: str, name_as: str) -> Tuple[str, int]:
+        """Execute custom query and stream its results into DuckDB, returns the name of the created table and its row count."""
         name_as = sanitize_table_name(name_as)
         
         result, error_message = validate_sql_query(query)
         if not result:
             raise ValueError(error_message)
-        
-        # Execute query and get DataFrame
-        df = self.client.query(query).to_dataframe()
 
-        # Drop duplicate columns
-        df = df.loc[:, ~df.columns.duplicated()]
+        if INGEST_ROW_CAP:
+            # let BigQuery stop at the cap rather than reading (and dropping) the rest
+            # (the newline keeps a trailing -- comment in the query from swallowing the closing parenthesis)
+            query = f"SELECT * FROM ({query.strip().rstrip(';')}\n) LIMIT {INGEST_ROW_CAP}"
 
-        # Convert BigQuery-specific dtypes
-        df = self._convert_bigquery_dtypes(df)
-
-        # Use base class method to ingest DataFrame
-        self.ingest_df_to_duckdb(df, name_as)
-        
-        return df
+        name_as, row_count = self.ingest_batches_to_duckdb(self._stream_query(query), name_as, row_cap=INGEST_ROW_CAP)
+        if row_count > 0:
+            self._nested_columns_to_json(name_as)
+        return name_as, row_count
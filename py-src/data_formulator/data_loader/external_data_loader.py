@@ -1,12 +1,30 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 import pandas as pd
 import json
 import duckdb
+import logging
+import os
 import random
 import string
 import re
 
+from data_formulator.upload_ingest import report_progress
+
+try:
+    import pyarrow as pa
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# rows fetched from the source per batch by loaders that stream into duckdb
+INGEST_BATCH_SIZE = int(os.getenv('DATA_LOADER_BATCH_SIZE', '50000'))
+
+# max number of rows ingested from a custom query (0 for no cap)
+INGEST_ROW_CAP = int(os.getenv('DATA_LOADER_MAX_ROWS', '0'))
+
 def sanitize_table_name(name_as: str) -> str:
     if not name_as:
         raise ValueError("Table name cannot be empty")
@@ -41,8 +59,122 @@ def sanitize_table_name(name_as: str) -> str:
     
     return sanitized
 
+def _fit_value(value, column_type: "pa.DataType"):
+    """A value as it can be stored in a column of `column_type`: as is, as a string in string columns, else None"""
+    if value is None:
+        return None
+    if pa.types.is_string(column_type):
+        return str(value)
+    try:
+        pa.scalar(value, type=column_type)
+        return value
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError, ValueError):
+        return None
+
+
+def rows_to_arrow(rows: List, column_names: List[str], column_types: List[Optional["pa.DataType"]]) -> "pa.Table":
+    """Arrow table of a batch of rows (sequences of values) with the given column types, so that all
+    batches of a result share one schema. A None type is inferred from the values of the first batch
+    (strings if they have several types or none) and stored in `column_types` for the next batches.
+    Values that don't fit their column's type (e.g. MySQL zero dates) are converted to strings in string
+    columns and to NULL in the others."""
+    arrays = []
+    for i, column_type in enumerate(column_types):
+        values = [row[i] for row in rows]
+        if column_type is None:
+            try:
+                array = pa.array(values)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                array = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+            if pa.types.is_null(array.type):
+                array = array.cast(pa.string())
+            column_types[i] = array.type
+        else:
+            try:
+                array = pa.array(values, type=column_type)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+                array = pa.array([_fit_value(v, column_type) for v in values], type=column_type)
+                dropped = array.null_count - sum(v is None for v in values)
+                if dropped:
+                    logger.warning(f"{dropped} values of column '{column_names[i]}' don't fit its type {column_type}, stored as NULL")
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, names=column_names)
+
+
 class ExternalDataLoader(ABC):
-    
+
+    # id the ingestion progress is reported under (see upload_ingest.report_progress), set by the caller
+    progress_id: Optional[str] = None
+
+    def _unique_table_name(self, table_name: str) -> str:
+        base_name = table_name
+        counter = 1
+        while True:
+            # Check if a table or view (e.g. an uploaded dataset) has the name
+            exists = self.duck_db_conn.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT table_name AS name FROM duckdb_tables() WHERE database_name = current_database()
+                    UNION ALL
+                    SELECT view_name FROM duckdb_views() WHERE database_name = current_database()
+                ) WHERE name = ?""", [table_name]).fetchone()[0] > 0
+            if not exists:
+                break
+            # If exists, append counter to base name
+            table_name = f"{base_name}_{counter}"
+            counter += 1
+        return table_name
+
+    def ingest_batches_to_duckdb(self, batches: Iterable, table_name: str, row_cap: int = 0) -> Tuple[str, int]:
+        """Create a DuckDB table from a stream of batches (Arrow tables or DataFrames with the same columns),
+        appending them one at a time so that only one batch is held in memory.
+
+        The table is created from the first batch (which sets the column types), ingestion stops
+        after `row_cap` rows (0 for no cap) and closes the stream. Progress is reported under
+        `progress_id`. Returns the name of the created table (made unique) and its row count;
+        no table is created if the stream is empty, and the table is dropped if ingestion fails.
+        """
+        table_name = self._unique_table_name(table_name)
+        view_name = 'df_batch_' + ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+        rows_loaded = 0
+        created = False
+        report_progress(self.progress_id, stage='loading', rows_loaded=0)
+        try:
+            for batch in batches:
+                if row_cap and rows_loaded + len(batch) > row_cap:
+                    batch = batch.slice(0, row_cap - rows_loaded) if hasattr(batch, 'slice') else batch.iloc[:row_cap - rows_loaded]
+                if len(batch) == 0 and created:
+                    continue
+                self.duck_db_conn.register(view_name, batch)
+                try:
+                    if not created:
+                        self.duck_db_conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM {view_name}")
+                        created = True
+                    else:
+                        self.duck_db_conn.execute(f"INSERT INTO {table_name} SELECT * FROM {view_name}")
+                finally:
+                    self.duck_db_conn.unregister(view_name)
+                rows_loaded += len(batch)
+                report_progress(self.progress_id, stage='loading', rows_loaded=rows_loaded)
+                if row_cap and rows_loaded >= row_cap:
+                    logger.warning(f"Stopped ingesting into '{table_name}' at the cap of {row_cap} rows")
+                    break
+        except Exception:
+            # don't leave a half filled table behind
+            if created:
+                try:
+                    self.duck_db_conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+                except Exception as e:
+                    logger.warning(f"Could not drop the partially ingested table '{table_name}': {e}")
+            raise
+        finally:
+            if hasattr(batches, 'close'):
+                batches.close()
+
+        report_progress(self.progress_id, stage='done', rows_loaded=rows_loaded)
+        if created:
+            logger.info(f"Successfully created DuckDB table '{table_name}' with {rows_loaded} rows")
+        return table_name, rows_loaded
+
     def ingest_df_to_duckdb(self, df: pd.DataFrame, table_name: str):
         # Log DataFrame info before ingestion
         import logging
@@ -57,16 +189,7 @@ class ExternalDataLoader(ABC):
                 sample_values = df[col].dropna().head(3)
                 logger.info(f"Datetime column '{col}' sample values: {list(sample_values)}")
 
-        base_name = table_name
-        counter = 1
-        while True:
-            # Check if table exists
-            exists = self.duck_db_conn.execute(f"SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = '{table_name}'").fetchone()[0] > 0
-            if not exists:
-                break
-            # If exists, append counter to base name
-            table_name = f"{base_name}_{counter}"
-            counter += 1
+        table_name = self._unique_table_name(table_name)
     
         # Create table
         random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
@@ -105,6 +228,7 @@ class ExternalDataLoader(ABC):
 
     @abstractmethod
     def ingest_data(self, table_name: str, name_as: str = None, size: int = 1000000):
+        # streaming loaders return the (unique) name of the created table and its row count
         pass
 
     @abstractmethod
@@ -113,5 +237,6 @@ class ExternalDataLoader(ABC):
 
     @abstractmethod
     def ingest_data_from_query(self, query: str, name_as: str):
+        # streaming loaders return the (unique) name of the created table and its row count
         pass
 
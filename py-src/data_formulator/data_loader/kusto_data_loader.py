@@ -1,11 +1,13 @@
 import logging
+import math
 import sys
-from typing import Dict, Any, List
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import pandas as pd
 import json
 import duckdb
-import random
-import string
 from datetime import datetime
 
 from data_formulator.data_loader.external_data_loader import ExternalDataLoader, sanitize_table_name
@@ -29,7 +31,10 @@ class KustoDataLoader(ExternalDataLoader):
             {"name": "kusto_database", "type": "string", "required": True, "description": ""}, 
             {"name": "client_id", "type": "string", "required": False, "description": "only necessary for AppKey auth"}, 
             {"name": "client_secret", "type": "string", "required": False, "description": "only necessary for AppKey auth"}, 
-            {"name": "tenant_id", "type": "string", "required": False, "description": "only necessary for AppKey auth"}
+            {"name": "tenant_id", "type": "string", "required": False, "description": "only necessary for AppKey auth"},
+            {"name": "partition_column", "type": "string", "required": False, "description": "column to split large tables by when ingesting (default: the first datetime column, else the first column)"},
+            {"name": "partition_mode", "type": "string", "required": False, "description": "'time' (ranges of a datetime column) or 'hash' (hash of the column's values), default: time for datetime columns"},
+            {"name": "parallel_fetches", "type": "string", "required": False, "description": "number of partitions fetched concurrently (default 8)"}
         ]
         return params_list
     
@@ -74,6 +79,10 @@ Required Parameters:
         self.client_secret = params.get("client_secret", None)
         self.tenant_id = params.get("tenant_id", None)
 
+        self.partition_column = (params.get("partition_column") or "").strip() or None
+        self.partition_mode = (params.get("partition_mode") or "").strip().lower() or None
+        self.parallel_fetches = int(params.get("parallel_fetches") or 8)
+
         try:
             if self.client_id and self.client_secret and self.tenant_id:
                 # This function provides an interface to Kusto. It uses AAD application key authentication.
@@ -197,60 +206,83 @@ Required Parameters:
 
         return tables
     
-    def ingest_data(self, table_name: str, name_as: str = None, size: int = 5000000) -> pd.DataFrame:
+    def _partition_conditions(self, table_name: str, column: str, column_type: str, partitions: int) -> List[str]:
+        """KQL predicates splitting a table into `partitions` disjoint parts (together covering all rows),
+        by time ranges of a datetime column or by the hash of a column's values"""
+        mode = self.partition_mode or ('time' if column_type == 'datetime' else 'hash')
+        if partitions <= 1:
+            return ["true"]
+        if mode == 'time':
+            bounds = self.query(f"['{table_name}'] | summarize low=min(['{column}']), high=max(['{column}'])")
+            low, high = bounds['low'].iloc[0], bounds['high'].iloc[0]
+            if not pd.isna(low) and not pd.isna(high) and high > low:
+                low, high = pd.Timestamp(low), pd.Timestamp(high)
+                edges = [low + (high - low) * i / partitions for i in range(partitions)] + [high]
+                conditions = []
+                for i in range(partitions):
+                    upper = "<=" if i == partitions - 1 else "<"
+                    condition = f"['{column}'] >= datetime({edges[i].isoformat()}) and ['{column}'] {upper} datetime({edges[i + 1].isoformat()})"
+                    conditions.append(f"({condition}) or isnull(['{column}'])" if i == 0 else condition)
+                return conditions
+            logger.info(f"Column {column} has no time range to split, partitioning by hash")
+        # tostring() maps nulls to "" so that every row lands in exactly one partition
+        return [f"hash(tostring(['{column}']), {partitions}) == {i}" for i in range(partitions)]
+
+    def _fetch_partitions(self, queries: List[str]) -> Iterator[pd.DataFrame]:
+        """Run the partition queries on a thread pool (at most `parallel_fetches` at a time) and yield
+        their results in the order of the queries, so the appends to DuckDB are deterministic"""
+        workers = max(1, self.parallel_fetches)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kusto-partition") as pool:
+            remaining = iter(queries)
+            pending = deque(pool.submit(self.query, query) for query in islice(remaining, workers))
+            try:
+                while pending:
+                    df = pending.popleft().result()
+                    next_query = next(remaining, None)
+                    if next_query is not None:
+                        pending.append(pool.submit(self.query, next_query))
+                    yield df
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def ingest_data(self, table_name: str, name_as: str = None, size: int = 5000000) -> Tuple[str, int]:
+        """Ingest a table, split into partitions (see _partition_conditions) that are fetched concurrently
+        and appended to DuckDB in order. Partitions target ~64MB results, Kusto's default result size limit.
+        Returns the name of the created table and its row count."""
         if name_as is None:
             name_as = table_name
-        
-        # Create a subquery that applies random ordering once with a fixed seed
-        total_rows_ingested = 0
-        first_chunk = True
-        chunk_size = 100000
+        name_as = sanitize_table_name(name_as)
 
         size_estimate_query = f"['{table_name}'] | take {10000} | summarize Total=sum(estimate_data_size(*))"
-        size_estimate_result = self.query(size_estimate_query)
-        size_estimate = size_estimate_result['Total'].values[0]
-        print(f"size_estimate: {size_estimate}")
+        size_estimate = self.query(size_estimate_query)['Total'].values[0]
+        rows_per_partition = min(64 * 1024 * 1024 / max(size_estimate, 1) * 0.9 * 10000, 5000000)
+        total_rows = int(self.query(f"['{table_name}'] | count")['Count'].values[0])
+        partitions = max(1, math.ceil(min(size, total_rows) / rows_per_partition))
 
-        chunk_size = min(64 * 1024 * 1024 / size_estimate * 0.9 * 10000, 5000000)
-        print(f"estimated_chunk_size: {chunk_size}")
+        schema = json.loads(self.query(f".show table ['{table_name}'] schema as json")['Schema'].values[0])['OrderedColumns']
+        column_types = {c['Name']: c['CslType'] for c in schema}
+        column = self.partition_column or next((c['Name'] for c in schema if c['CslType'] == 'datetime'), schema[0]['Name'])
+        if column not in column_types:
+            raise ValueError(f"Partition column {column} is not a column of {table_name}")
 
-        while total_rows_ingested < size:
-            try:
-                query = f"['{table_name}'] | serialize | extend rn=row_number() | where rn >= {total_rows_ingested} and rn < {total_rows_ingested + chunk_size} | project-away rn"
-                chunk_df = self.query(query)
-            except Exception as e:
-                chunk_size = int(chunk_size * 0.8)
-                continue
-
-            print(f"total_rows_ingested: {total_rows_ingested}")
-            print(chunk_df.head())
-            
-            # Stop if no more data
-            if chunk_df.empty:
-                break
+        conditions = self._partition_conditions(table_name, column, column_types[column], partitions)
+        logger.info(f"Ingesting {min(size, total_rows)} of {total_rows} rows of {table_name} in {len(conditions)} partitions by {column}")
+        # a partial ingestion takes an equal share of the requested rows from each partition, so that about
+        # `size` rows are fetched in total and no partition result is larger than rows_per_partition
+        take = size if size >= total_rows else math.ceil(size / len(conditions))
+        queries = [f"set notruncation;\n['{table_name}'] | where {condition} | take {take}" for condition in conditions]
 
-             # Sanitize the table name for SQL compatibility
-            name_as = sanitize_table_name(name_as)
-            
-            # For first chunk, create new table; for subsequent chunks, append
-            if first_chunk:
-                self.ingest_df_to_duckdb(chunk_df, name_as)
-                first_chunk = False
-            else:
-                # Append to existing table
-                random_suffix = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
-                self.duck_db_conn.register(f'df_temp_{random_suffix}', chunk_df)
-                self.duck_db_conn.execute(f"INSERT INTO {name_as} SELECT * FROM df_temp_{random_suffix}")
-                self.duck_db_conn.execute(f"DROP VIEW df_temp_{random_suffix}")
-            
-            total_rows_ingested += len(chunk_df)
+        name_as, row_count = self.ingest_batches_to_duckdb(self._fetch_partitions(queries), name_as, row_cap=size)
+        logger.info(f"Ingested {row_count} rows from {table_name} into {name_as}")
+        return name_as, row_count
 
     def view_query_sample(self, query: str) -> List[Dict[str, Any]]:
         df = self.query(query).head(10)
         return json.loads(df.to_json(orient="records", date_format='iso'))
 
-    def ingest_data_from_query(self, query: str, name_as: str) -> pd.DataFrame:
+    def ingest_data_from_query(self, query: str, name_as: str) -> Tuple[str, int]:
         # Sanitize the table name for SQL compatibility
         name_as = sanitize_table_name(name_as)
         df = self.query(query)
-        self.ingest_df_to_duckdb(df, name_as)
\ No newline at end of file
+        return self.ingest_batches_to_duckdb([df], name_as)
\ No newline at end of file
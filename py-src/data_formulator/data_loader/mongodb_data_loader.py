@@ -1,17 +1,85 @@
 import json
+import re
 import string
 import random as rand
+from itertools import islice
 
 import pandas as pd
 import duckdb
 import pymongo
-from bson import ObjectId
+from bson import ObjectId, Decimal128, Regex, Code, Timestamp
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
 from datetime import datetime
 
-from data_formulator.data_loader.external_data_loader import ExternalDataLoader, sanitize_table_name
+from data_formulator.data_loader.external_data_loader import (ExternalDataLoader, sanitize_table_name, rows_to_arrow,
+                                                              INGEST_BATCH_SIZE, INGEST_ROW_CAP, PYARROW_AVAILABLE)
+from data_formulator.upload_ingest import report_progress
 
 from data_formulator.security import validate_sql_query
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+
+if PYARROW_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+
+class _StringDecoder(TypeDecoder):
+    """Decode a BSON type pyarrow can't convert as its string"""
+    def __init__(self, bson_type):
+        self._bson_type = bson_type
+
+    @property
+    def bson_type(self):
+        return self._bson_type
+
+    def transform_bson(self, value):
+        return str(value)
+
+
+class _Decimal128Decoder(TypeDecoder):
+    bson_type = Decimal128
+
+    def transform_bson(self, value):
+        return float(value.to_decimal())
+
+
+# documents are read with their special types already converted, so that batches convert to Arrow in one call
+DECODE_OPTIONS = CodecOptions(type_registry=TypeRegistry(
+    [_StringDecoder(bson_type) for bson_type in (ObjectId, Regex, Code, Timestamp)] + [_Decimal128Decoder()]))
+
+
+def _flatten_arrow_column(name: str, array, columns: Dict[str, Any], sep: str = '_'):
+    """
+    Add the columns of an Arrow array to `columns`, flattened the way _flatten_document flattens
+    documents but a column at a time: struct fields become `name_field` columns and list items
+    `name_1`, `name_2`, ... up to the longest list
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_struct(array.type):
+        for idx, field in enumerate(array.type):
+            field_name = f"{name}{sep}{field.name}" if name else field.name
+            _flatten_arrow_column(field_name, pc.struct_field(array, [idx]), columns, sep)
+    elif pa.types.is_list(array.type) or pa.types.is_large_list(array.type):
+        max_length = pc.max(pc.list_value_length(array)).as_py() or 0
+        if max_length == 0:
+            columns.setdefault(name, pa.nulls(len(array), pa.string()))
+            return
+        # missing lists as empty ones, so that each padded slice has an item for every document
+        array = pc.fill_null(array, pa.scalar([], type=array.type))
+        for idx in range(max_length):
+            item = pc.list_slice(array, idx, idx + 1, return_fixed_size_list=True).flatten()
+            _flatten_arrow_column(f"{name}{sep}{idx + 1}", item, columns, sep)
+    else:
+        if pa.types.is_null(array.type):
+            array = array.cast(pa.string())
+        elif pa.types.is_binary(array.type):
+            try:
+                array = array.cast(pa.string())
+            except pa.ArrowInvalid:
+                pass
+        # a field named like a flattened path (e.g. 'a_b' next to 'a.b'): the first one is kept
+        columns.setdefault(name, array)
 
 
 class MongoDBDataLoader(ExternalDataLoader):
@@ -25,7 +93,8 @@ class MongoDBDataLoader(ExternalDataLoader):
             {"name": "password", "type": "string", "required": False, "default": "", "description": ""},
             {"name": "database", "type": "string", "required": True, "default": "", "description": ""},
             {"name": "collection", "type": "string", "required": False, "default": "", "description": "If specified, only this collection will be accessed"},
-            {"name": "authSource", "type": "string", "required": False, "default": "", "description": "Authentication database (defaults to target database if empty)"}
+            {"name": "authSource", "type": "string", "required": False, "default": "", "description": "Authentication database (defaults to target database if empty)"},
+            {"name": "fields", "type": "string", "required": False, "default": "", "description": "Comma separated fields to import (e.g. name,address.city), all fields if empty"}
         ]
         return params_list
 
@@ -50,6 +119,7 @@ MongoDB Connection Instructions:
    - password: Your MongoDB password (leave empty if no auth)
    - database: Target database name to connect to
    - collection: (Optional) Specific collection to access, leave empty to list all collections
+   - fields: (Optional) Fields to read from the documents, projected on the server (e.g. name,address.city)
 
 4. Troubleshooting:
    - Verify MongoDB service is running: `mongod --version`
@@ -86,6 +156,13 @@ MongoDB Connection Instructions:
             self.database_name = database
             
             self.collection = self.db[collection] if collection else None
+
+            # server side projection of the documents read, None for whole documents
+            fields = [field.strip() for field in self.params.get("fields", "").split(",") if field.strip()]
+            self.projection = None
+            if fields:
+                self.projection = {field: 1 for field in fields}
+                self.projection.setdefault("_id", 0)
             
         except Exception as e:
             raise Exception(f"Failed to connect to MongoDB: {e}")
@@ -180,6 +257,77 @@ MongoDB Connection Instructions:
         
         df = pd.DataFrame(processed_docs)
         return df
+
+    def _documents_to_batch(self, documents: List[Dict[str, Any]]):
+        """
+        Flatten a batch of documents into columns (named like _flatten_document names them).
+        The batch is converted to Arrow in one call and flattened column-wise; a batch pyarrow can't
+        type (e.g. a field holding numbers and strings) is flattened document by document, with
+        such fields stored as strings.
+        """
+        if not PYARROW_AVAILABLE:
+            return self._process_documents(documents)
+        try:
+            documents_array = pa.array(documents)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            rows = [self._flatten_document(doc) for doc in documents]
+            columns = list(dict.fromkeys(key for row in rows for key in row))
+            return rows_to_arrow([[row.get(column) for column in columns] for row in rows], columns, [None] * len(columns))
+        columns = {}
+        _flatten_arrow_column('', documents_array, columns)
+        return pa.table(columns)
+
+    @staticmethod
+    def _concat_batches(batches: List):
+        """
+        Concatenate flattened batches, whose columns may differ: fields missing from a batch are
+        null in it and fields with different types in different batches are stored as strings
+        """
+        if not PYARROW_AVAILABLE:
+            return pd.concat(batches, ignore_index=True)
+        try:
+            return pa.concat_tables(batches, promote_options="permissive")
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            field_types = {}
+            for batch in batches:
+                for field in batch.schema:
+                    if not pa.types.is_null(field.type):
+                        field_types.setdefault(field.name, set()).add(field.type)
+            mixed = {name for name, types in field_types.items() if len(types) > 1}
+            batches = [pa.table({name: column.cast(pa.string()) if name in mixed else column
+                                 for name, column in zip(batch.column_names, batch.columns)}) for batch in batches]
+            return pa.concat_tables(batches, promote_options="permissive")
+
+    def _stream_collection(self, collection_name: str, size: int, batch_size: int = INGEST_BATCH_SIZE) -> Iterator:
+        """
+        Read up to `size` documents of a collection (projected to the `fields` param) with a batched
+        cursor and yield them as flattened batches of `batch_size` documents
+        """
+        collection = self.db.get_collection(collection_name, codec_options=DECODE_OPTIONS)
+        cursor = collection.find({}, self.projection).limit(size).batch_size(min(batch_size, size))
+        try:
+            while True:
+                documents = list(islice(cursor, batch_size))
+                if not documents:
+                    break
+                yield self._documents_to_batch(documents)
+        finally:
+            cursor.close()
+
+    def _read_collection(self, collection_name: str, size: int):
+        """
+        Read up to `size` documents of a collection as one flattened table, None if it is empty.
+        The batches are concatenated before loading since documents of later batches may have other fields.
+        """
+        batches = []
+        rows_read = 0
+        for batch in self._stream_collection(collection_name, size):
+            batches.append(batch)
+            rows_read += len(batch)
+            report_progress(self.progress_id, stage='reading', rows_loaded=rows_read)
+        if not batches:
+            return None
+        return self._concat_batches(batches)
         
     def list_tables(self, table_filter: str = None):
         """
@@ -204,11 +352,11 @@ MongoDB Connection Instructions:
                 full_table_name = f"{collection_name}"
                 collection = self.db[collection_name]
                 
-                # Get row count
-                row_count = collection.count_documents({})
+                # Get row count (from the collection metadata, counting would scan large collections)
+                row_count = collection.estimated_document_count()
                 
                 # Get sample data
-                sample_data = list(collection.find().limit(10))
+                sample_data = list(collection.find({}, self.projection).limit(10))
                 
                 if sample_data:
                     df = self._process_documents(sample_data)
@@ -240,9 +388,9 @@ MongoDB Connection Instructions:
         
         return results
     
-    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 100000):
+    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 100000) -> Tuple[str, int]:
         """
-        Import MongoDB collection data into DuckDB
+        Import MongoDB collection data into DuckDB, returns the name of the created table and its row count
         """
         # Extract collection name from full table name
         parts = table_name.split('.')
@@ -254,43 +402,28 @@ MongoDB Connection Instructions:
         if name_as is None:
             name_as = collection_name
 
-        # Get and process data from MongoDB (limit rows)
-        collection = self.db[collection_name]
-        data_cursor = collection.find().limit(size)
-        data_list = list(data_cursor)
-        if not data_list:
+        # Read and flatten the documents in batches (limit rows)
+        data = self._read_collection(collection_name, size)
+        if data is None:
             raise Exception(f"No data found in MongoDB collection '{collection_name}'.")
-        df = self._process_documents(data_list)
 
         name_as = sanitize_table_name(name_as)
 
-        self._load_dataframe_to_duckdb(df, name_as, size)
-        return
+        return self.ingest_batches_to_duckdb([data], name_as, row_cap=size)
 
     
     def view_query_sample(self, query: str) -> List[Dict[str, Any]]:
-
-        self._existed_collections_in_duckdb()
-        self._difference_collections()
-        self._preload_all_collections(self.collection.name if self.collection else "")
-
         result, error_message = validate_sql_query(query)
         if not result:
-            print(error_message)
             raise ValueError(error_message)
-        
-        result_query = json.loads(self.duck_db_conn.execute(query).df().head(10).to_json(orient="records"))
-
-        self._drop_all_loaded_tables()
-
-        for collection_name, df in self.existed_collections.items():
-            self._load_dataframe_to_duckdb(df, collection_name)
 
-        return result_query
+        sample = self._execute_on_collections(f"SELECT * FROM ({query.strip().rstrip(';')}\n) LIMIT 10")
+        df = sample.to_pandas() if PYARROW_AVAILABLE else sample
+        return json.loads(df.to_json(orient="records"))
     
-    def ingest_data_from_query(self, query: str, name_as: str) -> pd.DataFrame:
+    def ingest_data_from_query(self, query: str, name_as: str) -> Tuple[str, int]:
         """
-        Create a new table from query results
+        Create a new table from query results, returns the name of the created table and its row count
         """
         result, error_message = validate_sql_query(query)
         if not result:
@@ -298,20 +431,12 @@ MongoDB Connection Instructions:
         
         name_as = sanitize_table_name(name_as)
 
-        self._existed_collections_in_duckdb()
-        self._difference_collections()
-        self._preload_all_collections(self.collection.name if self.collection else "")
-        
-        query_result_df = self.duck_db_conn.execute(query).df()
-
-        self._drop_all_loaded_tables()
-
-        for collection_name, existing_df in self.existed_collections.items():
-            self._load_dataframe_to_duckdb(existing_df, collection_name)
-        
-        self._load_dataframe_to_duckdb(query_result_df, name_as)
+        if INGEST_ROW_CAP:
+            # (the newline keeps a trailing -- comment in the query from swallowing the closing parenthesis)
+            query = f"SELECT * FROM ({query.strip().rstrip(';')}\n) LIMIT {INGEST_ROW_CAP}"
 
-        return query_result_df
+        query_result = self._execute_on_collections(query)
+        return self.ingest_batches_to_duckdb([query_result], name_as, row_cap=INGEST_ROW_CAP)
     
     @staticmethod
     def _quote_identifier(name: str) -> str:
@@ -323,85 +448,46 @@ MongoDB Connection Instructions:
         escaped = name.replace('"', '""')
         return f'"{escaped}"'
 
-    def _existed_collections_in_duckdb(self):
+    def _query_collections(self, query: str) -> List[str]:
         """
-        Return the names and contents of tables already loaded into DuckDB
+        Collections a query reads: those whose (table) name appears in it
         """
-        self.existed_collections = {}
-        duckdb_tables = self.duck_db_conn.execute("SHOW TABLES").df()
-        for _, row in duckdb_tables.iterrows():
-            collection_name = row['name']
-            quoted_name = self._quote_identifier(collection_name)
-            df = self.duck_db_conn.execute(f"SELECT * FROM {quoted_name}").df()
-            self.existed_collections[collection_name] = df
-
-
-    def _difference_collections(self):
-        """
-        Return the difference between all collections and loaded collections
-        """
-        self.diff_collections = []
-        all_collections = set(self.db.list_collection_names())
-        loaded_collections = set(self.existed_collections)
-        diff_collections = all_collections - loaded_collections
-        self.diff_collections = list(diff_collections)
-        print(f'Difference collections: {self.diff_collections}')
-
-    def _drop_all_loaded_tables(self):
-        """
-        Drop all tables loaded into DuckDB
-        """
-        for table_name in self.loaded_tables.values():
-            try:
-                quoted_name = self._quote_identifier(table_name)
-                self.duck_db_conn.execute(f"DROP TABLE IF EXISTS main.{quoted_name}")
-                print(f"Dropped loaded table: {table_name}")
-            except Exception as e:
-                print(f"Warning: Failed to drop table '{table_name}': {e}")
-
-    def _preload_all_collections(self, specified_collection: str = "", size: int = 100000):
-        """
-        Preload all MongoDB collections into DuckDB memory
-        """
-        # Get the list of collections to load
-        if specified_collection:
-            collection_names = [specified_collection]
+        if self.collection is not None:
+            collection_names = [self.collection.name]
         else:
             collection_names = self.db.list_collection_names()
-        
-        # Record loaded tables
-        self.loaded_tables = {}
-        
+        referenced = []
         for collection_name in collection_names:
-            try:
-                collection = self.db[collection_name]
-                
-                # Get data
-                data_cursor = collection.find().limit(size)
-                data_list = list(data_cursor)
-                
-                if not data_list:
-                    print(f"Skipping empty collection: {collection_name}")
+            for name in {collection_name, sanitize_table_name(collection_name)}:
+                if re.search(rf'(?<![\w$]){re.escape(name)}(?![\w$])', query, re.IGNORECASE):
+                    referenced.append(collection_name)
+                    break
+        return referenced
+
+    def _execute_on_collections(self, query: str, size: int = 100000):
+        """
+        Run a query with only the collections it reads loaded (up to `size` documents each), as
+        temporary tables that shadow session tables of the same name and are dropped afterwards
+        """
+        loaded_tables = []
+        try:
+            for collection_name in self._query_collections(query):
+                data = self._read_collection(collection_name, size)
+                if data is None:
                     continue
-                
-                df = self._process_documents(data_list)
-                
-                # Generate table name
                 table_name = sanitize_table_name(collection_name)
-                
-                # Load into DuckDB
-                self._load_dataframe_to_duckdb(df, table_name)
-                
-                # Record mapping
-                self.loaded_tables[collection_name] = table_name
-                print(f"Preloaded collection '{collection_name}' as table '{table_name}' ({len(data_list)} rows)")
-                
-            except Exception as e:
-                print(f"Warning: Failed to preload collection '{collection_name}': {e}")
+                self._load_dataframe_to_duckdb(data, table_name, size, temporary=True)
+                loaded_tables.append(table_name)
+
+            result = self.duck_db_conn.execute(query)
+            return result.fetch_arrow_table() if PYARROW_AVAILABLE else result.df()
+        finally:
+            for table_name in loaded_tables:
+                self.duck_db_conn.execute(f"DROP TABLE IF EXISTS temp.{self._quote_identifier(table_name)}")
 
-    def _load_dataframe_to_duckdb(self, df: pd.DataFrame, table_name: str, size: int = 1000000):
+    def _load_dataframe_to_duckdb(self, df, table_name: str, size: int = 1000000, temporary: bool = False):
         """
-        Load DataFrame into DuckDB
+        Load DataFrame (or Arrow table) into DuckDB, as a temporary table if `temporary`
         """
         # Create table using a temporary view
         random_suffix = ''.join(rand.choices(string.ascii_letters + string.digits, k=6))
@@ -414,5 +500,6 @@ MongoDB Connection Instructions:
         quoted_temp_view = self._quote_identifier(temp_view_name)
         # Ensure size is an integer to prevent injection via size parameter
         safe_size = int(size)
-        self.duck_db_conn.execute(f"CREATE OR REPLACE TABLE main.{quoted_table_name} AS SELECT * FROM {quoted_temp_view} LIMIT {safe_size}")
-        self.duck_db_conn.execute(f"DROP VIEW {quoted_temp_view}")
\ No newline at end of file
+        target = f"TEMP TABLE {quoted_table_name}" if temporary else f"TABLE main.{quoted_table_name}"
+        self.duck_db_conn.execute(f"CREATE OR REPLACE {target} AS SELECT * FROM {quoted_temp_view} LIMIT {safe_size}")
+        self.duck_db_conn.execute(f"DROP VIEW {quoted_temp_view}")
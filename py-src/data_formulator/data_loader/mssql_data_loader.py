@@ -1,6 +1,10 @@
+import datetime
+import decimal
 import json
 import logging
-from typing import Dict, Any, Optional, List
+import queue
+import threading
+from typing import Dict, Any, Iterator, Optional, List, Tuple
 
 import duckdb
 import pandas as pd
@@ -11,12 +15,44 @@ try:
 except ImportError:
     PYODBC_AVAILABLE = False
 
-from data_formulator.data_loader.external_data_loader import ExternalDataLoader, sanitize_table_name
+from data_formulator.data_loader.external_data_loader import (ExternalDataLoader, sanitize_table_name, rows_to_arrow,
+                                                              INGEST_BATCH_SIZE, INGEST_ROW_CAP, PYARROW_AVAILABLE)
 from data_formulator.security import validate_sql_query
 
+if PYARROW_AVAILABLE:
+    import pyarrow as pa
+
 log = logging.getLogger(__name__)
 
 
+def _arrow_type(column_description: tuple) -> Optional["pa.DataType"]:
+    """Arrow type of a result column from its pyodbc cursor.description entry (whose type is a python class)"""
+    _, python_type, _, _, precision, scale, _ = column_description
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is decimal.Decimal and precision and precision <= 38:
+        return pa.decimal128(precision, scale or 0)
+    if python_type is str:
+        return pa.string()
+    if python_type is datetime.datetime:
+        return pa.timestamp('us')
+    if python_type is datetime.date:
+        return pa.date32()
+    if python_type is datetime.time:
+        return pa.time64('us')
+    if python_type in (bytes, bytearray):
+        return pa.binary()
+    return None
+
+
+def _quote_identifier(name: str) -> str:
+    return "[" + name.replace("]", "]]") + "]"
+
+
 class MSSQLDataLoader(ExternalDataLoader):
     @staticmethod
     def list_params() -> bool:
@@ -84,6 +120,20 @@ class MSSQLDataLoader(ExternalDataLoader):
                 "default": "30",
                 "description": "Connection timeout in seconds",
             },
+            {
+                "name": "partition_column",
+                "type": "string",
+                "required": False,
+                "default": "",
+                "description": "Indexed integer column to read tables by in parallel ranges (leave empty for a single reader)",
+            },
+            {
+                "name": "parallel_readers",
+                "type": "string",
+                "required": False,
+                "default": "4",
+                "description": "Number of parallel connections reading the ranges of the partition column",
+            },
         ]
         return params_list
 
@@ -238,6 +288,97 @@ SQL Server Connection Instructions:
             log.error(f"Failed to execute query: {e}")
             raise
 
+    def _stream_query(self, query: str, batch_size: int = INGEST_BATCH_SIZE) -> Iterator:
+        """Run a query on its own connection and yield its rows in batches of `batch_size` (fetchmany),
+        as Arrow tables (DataFrames without pyarrow), so the result is never held in memory at once"""
+        conn = pyodbc.connect(self.connection_string)
+        cursor = conn.cursor()
+        exhausted = False
+        try:
+            cursor.execute(query)
+            columns = [column_description[0] for column_description in cursor.description]
+            column_types = [_arrow_type(column_description) for column_description in cursor.description] if PYARROW_AVAILABLE else None
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    exhausted = True
+                    break
+                if PYARROW_AVAILABLE:
+                    yield rows_to_arrow(rows, columns, column_types)
+                else:
+                    yield pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+        finally:
+            if not exhausted:
+                try:
+                    cursor.cancel()
+                except Exception as e:
+                    log.warning(f"Failed to cancel query: {e}")
+            conn.close()
+
+    def _stream_partitioned(self, source: str, key_column: str, readers: int, batch_size: int = INGEST_BATCH_SIZE) -> Iterator:
+        """Read a table in `readers` ranges of an (indexed) integer key column, on parallel connections,
+        yielding the batches of all ranges as they arrive. Falls back to a single reader for other keys."""
+        key = _quote_identifier(key_column)
+        bounds = self._execute_query(f"SELECT MIN({key}) AS low, MAX({key}) AS high FROM {source}").iloc[0]
+        low, high = bounds["low"], bounds["high"]
+        if readers <= 1 or not pd.api.types.is_integer(low) or not pd.api.types.is_integer(high):
+            log.info(f"Reading {source} with a single reader (partition column {key_column} isn't an integer)")
+            yield from self._stream_query(f"SELECT * FROM {source}", batch_size)
+            return
+
+        low, high = int(low), int(high)
+        step = max(1, -(-(high - low + 1) // readers))
+        queries = []
+        for start in range(low, high + 1, step):
+            condition = f"{key} >= {start} AND {key} < {start + step}"
+            if start == low:
+                condition = f"({condition}) OR {key} IS NULL"
+            queries.append(f"SELECT * FROM {source} WHERE {condition}")
+
+        # bounded, so that readers wait for duckdb rather than piling batches up in memory
+        batches: queue.Queue = queue.Queue(maxsize=2 * len(queries))
+        stopped = threading.Event()
+        finished = object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def read(query: str):
+            try:
+                stream = self._stream_query(query, batch_size)
+                try:
+                    for batch in stream:
+                        put(batch)
+                        if stopped.is_set():
+                            break
+                finally:
+                    stream.close()
+                put(finished)
+            except Exception as e:
+                put(e)
+
+        threads = [threading.Thread(target=read, args=(query,), name="mssql-range-reader", daemon=True) for query in queries]
+        for thread in threads:
+            thread.start()
+        remaining = len(threads)
+        try:
+            while remaining:
+                item = batches.get()
+                if item is finished:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            # stop the other readers (e.g. on errors or when the row cap is reached)
+            stopped.set()
+
     def list_tables(self):
         """List all tables from SQL Server database"""
         try:
@@ -387,8 +528,8 @@ SQL Server Connection Instructions:
 
         return results
 
-    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 1000000):
-        """Ingest data from SQL Server table into DuckDB"""
+    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 1000000) -> Tuple[str, int]:
+        """Ingest data from SQL Server table into DuckDB, returns the name of the created table and its row count"""
         # Parse table name (assuming format: schema.table)
         if "." in table_name:
             schema, table = table_name.split(".", 1)
@@ -402,13 +543,19 @@ SQL Server Connection Instructions:
         name_as = sanitize_table_name(name_as)
 
         try:
-            # Query data from SQL Server with limit
-            query = f"SELECT TOP {size} * FROM [{schema}].[{table}]"
-            df = self._execute_query(query)
+            size = int(size)
+            source = f"{_quote_identifier(schema)}.{_quote_identifier(table)}"
+            partition_column = (self.params.get("partition_column") or "").strip()
+            if partition_column:
+                # ranges are read in parallel, the size is enforced as a row cap
+                batches = self._stream_partitioned(source, partition_column, int(self.params.get("parallel_readers") or 4))
+            else:
+                batches = self._stream_query(f"SELECT TOP {size} * FROM {source}")
 
-            # Use the base class method to ingest DataFrame into DuckDB
-            self.ingest_df_to_duckdb(df, name_as)
-            log.info(f"Successfully ingested {len(df)} rows from {schema}.{table} to {name_as}")
+            # Stream the batches into DuckDB as they are fetched
+            name_as, row_count = self.ingest_batches_to_duckdb(batches, name_as, row_cap=size)
+            log.info(f"Successfully ingested {row_count} rows from {schema}.{table} to {name_as}")
+            return name_as, row_count
         except Exception as e:
             log.error(f"Failed to ingest data from {table_name}: {e}")
             raise
@@ -440,18 +587,17 @@ SQL Server Connection Instructions:
             log.error(f"Failed to execute query sample: {e}")
             raise
 
-    def ingest_data_from_query(self, query: str, name_as: str) -> pd.DataFrame:
-        """Execute a custom query and ingest results into DuckDB"""
+    def ingest_data_from_query(self, query: str, name_as: str) -> Tuple[str, int]:
+        """Execute a custom query and stream its results into DuckDB, returns the name of the created table and its row count"""
         try:
             result, error_message = validate_sql_query(query)
             if not result:
                 raise ValueError(error_message)
             
-            df = self._execute_query(query)
-            # Use the base class's method to ingest the DataFrame
-            self.ingest_df_to_duckdb(df, sanitize_table_name(name_as))
-            log.info(f"Successfully ingested {len(df)} rows from custom query to {name_as}")
-            return df
+            name_as, row_count = self.ingest_batches_to_duckdb(self._stream_query(query), sanitize_table_name(name_as),
+                                                               row_cap=INGEST_ROW_CAP)
+            log.info(f"Successfully ingested {row_count} rows from custom query to {name_as}")
+            return name_as, row_count
         except Exception as e:
             log.error(f"Failed to execute and ingest custom query: {e}")
             raise
@@ -4,19 +4,49 @@ import logging
 import pandas as pd
 import duckdb
 
-from data_formulator.data_loader.external_data_loader import ExternalDataLoader, sanitize_table_name
+from data_formulator.data_loader.external_data_loader import (ExternalDataLoader, sanitize_table_name, rows_to_arrow,
+                                                              INGEST_BATCH_SIZE, INGEST_ROW_CAP, PYARROW_AVAILABLE)
 
 from data_formulator.security import validate_sql_query
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Iterator, Optional, List, Tuple
 
 try:
     import pymysql
+    import pymysql.cursors
+    from pymysql.constants import FIELD_TYPE
     PYMYSQL_AVAILABLE = True
 except ImportError:
     PYMYSQL_AVAILABLE = False
 
+if PYARROW_AVAILABLE:
+    import pyarrow as pa
+
 logger = logging.getLogger(__name__)
 
+# seconds the server waits for us to read the next rows of a streamed query (while batches are written to duckdb)
+STREAM_NET_WRITE_TIMEOUT = 600
+
+
+def _arrow_type(field_description: tuple) -> Optional["pa.DataType"]:
+    """Arrow type of a MySQL result column (cursor.description entry), None to infer it from the values"""
+    _, type_code, _, length, _, scale, _ = field_description
+    if type_code in (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24, FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR):
+        return pa.int64()
+    if type_code in (FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE):
+        return pa.float64()
+    if type_code in (FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL) and length and length <= 38:
+        return pa.decimal128(length, scale or 0)
+    if type_code in (FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE):
+        return pa.date32()
+    if type_code in (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP):
+        return pa.timestamp('us')
+    if type_code in (FIELD_TYPE.VARCHAR, FIELD_TYPE.VAR_STRING, FIELD_TYPE.STRING, FIELD_TYPE.ENUM, FIELD_TYPE.SET, FIELD_TYPE.JSON):
+        return pa.string()
+    # TIME (timedelta), BIT and BLOB / TEXT columns (bytes or str depending on the collation)
+    return None
+
+
+
 
 class MySQLDataLoader(ExternalDataLoader):
 
@@ -112,6 +142,8 @@ MySQL Connection Instructions:
             query: SQL query string. Use %s for parameterized queries.
             params: Optional tuple of parameters for parameterized queries.
         """
+        if not self.mysql_conn.open:
+            self._reconnect_if_needed()
         try:
             with self.mysql_conn.cursor() as cursor:
                 cursor.execute(query, params)
@@ -127,6 +159,37 @@ MySQL Connection Instructions:
             self._reconnect_if_needed()
             raise
 
+    def _stream_query(self, query: str, params: tuple = None, batch_size: int = INGEST_BATCH_SIZE) -> Iterator:
+        """Run a query with an unbuffered server side cursor and yield its rows in batches of `batch_size`
+        (Arrow tables, or DataFrames without pyarrow), so the result is never held in memory at once"""
+        if not self.mysql_conn.open:
+            self._reconnect_if_needed()
+        cursor = self.mysql_conn.cursor(pymysql.cursors.SSCursor)
+        exhausted = False
+        try:
+            cursor.execute(f"SET SESSION net_write_timeout = {STREAM_NET_WRITE_TIMEOUT}")
+            cursor.execute(query, params)
+            columns = [field_description[0] for field_description in cursor.description]
+            # zero dates, which pymysql returns as strings, are stored as NULL in their date column
+            column_types = [_arrow_type(field_description) for field_description in cursor.description] if PYARROW_AVAILABLE else None
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    exhausted = True
+                    break
+                if PYARROW_AVAILABLE:
+                    yield rows_to_arrow(rows, columns, column_types)
+                else:
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+        finally:
+            if exhausted:
+                cursor.close()
+            else:
+                # closing an unbuffered cursor reads the rest of the result, drop the connection instead
+                # (it is reopened by the next query)
+                logger.info("MySQL query stopped before its end, closing the connection")
+                self.mysql_conn.close()
+
     def _reconnect_if_needed(self):
         """Attempt to reconnect to MySQL if the connection was lost."""
         try:
@@ -220,8 +283,8 @@ MySQL Connection Instructions:
             
         return results
 
-    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 1000000):
-        """Fetch data from MySQL and ingest into DuckDB."""
+    def ingest_data(self, table_name: str, name_as: Optional[str] = None, size: int = 1000000) -> Tuple[str, int]:
+        """Fetch data from MySQL and ingest into DuckDB, returns the name of the created table and its row count."""
         if name_as is None:
             name_as = table_name.split('.')[-1]
 
@@ -245,16 +308,14 @@ MySQL Connection Instructions:
             sanitized_table_name = sanitize_table_name(table_name)
             query = f"SELECT * FROM `{sanitized_table_name}` LIMIT {sanitized_size}"
 
-        # Fetch data from MySQL
-        df = self._execute_query(query)
+        # Stream the rows from MySQL into DuckDB in batches
+        name_as, row_count = self.ingest_batches_to_duckdb(self._stream_query(query), name_as)
         
-        if df.empty:
+        if row_count == 0:
             logger.warning(f"No data fetched from table {table_name}")
-            return
-        
-        # Ingest into DuckDB using the base class method
-        self.ingest_df_to_duckdb(df, name_as)
-        logger.info(f"Successfully ingested {len(df)} rows from {table_name} into DuckDB table {name_as}")
+        else:
+            logger.info(f"Successfully ingested {row_count} rows from {table_name} into DuckDB table {name_as}")
+        return name_as, row_count
 
     def view_query_sample(self, query: str) -> List[Dict[str, Any]]:
         result, error_message = validate_sql_query(query)
@@ -265,18 +326,19 @@ MySQL Connection Instructions:
         df = self._execute_query(query)
         return json.loads(df.head(10).to_json(orient="records", date_format='iso'))
 
-    def ingest_data_from_query(self, query: str, name_as: str) -> pd.DataFrame:
-        """Execute custom query and ingest results into DuckDB."""
+    def ingest_data_from_query(self, query: str, name_as: str) -> Tuple[str, int]:
+        """Execute custom query and stream its results into DuckDB, returns the name of the created table and its row count."""
         result, error_message = validate_sql_query(query)
         if not result:
             raise ValueError(error_message)
-        
-        # Execute query via native MySQL connection
-        df = self._execute_query(query)
-        
-        # Ingest into DuckDB using the base class method
-        self.ingest_df_to_duckdb(df, sanitize_table_name(name_as))
-        return df
+
+        if INGEST_ROW_CAP:
+            # let the server stop at the cap rather than reading (and dropping) the rest
+            # (the newline keeps a trailing -- comment in the query from swallowing the closing parenthesis)
+            query = f"SELECT * FROM ({query.strip().rstrip(';')}\n) AS df_query LIMIT {INGEST_ROW_CAP}"
+
+        # Stream the results via native MySQL connection
+        return self.ingest_batches_to_duckdb(self._stream_query(query), sanitize_table_name(name_as), row_cap=INGEST_ROW_CAP)
 
     def close(self):
         """Explicitly close the MySQL connection."""
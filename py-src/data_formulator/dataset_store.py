@@ -0,0 +1,145 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from data_formulator.db_manager import DuckDBManager, db_manager, quote_path
+from data_formulator.upload_ingest import CSV_TYPE_CANDIDATES
+
+logger = logging.getLogger(__name__)
+
+# part of every dataset key: change it when uploads are converted differently, so old files aren't reused
+DATASET_FORMAT_VERSION = f"1:{CSV_TYPE_CANDIDATES}"
+
+_DATASET_FILE_PATTERN = re.compile(r"([0-9a-f]{64})\.parquet")
+
+
+class DatasetStore:
+    """Content addressed store of uploaded datasets, shared by all sessions and worker processes.
+
+    Each distinct upload (by the hash of its content and format) is converted once to a zstd
+    parquet file named after its key; the tables of the sessions that upload it are read-only
+    views over that file. The session registry counts which session tables reference each
+    dataset, files without references are removed by the janitor after `orphan_ttl` seconds.
+    """
+    def __init__(self, manager: DuckDBManager, store_dir: Optional[str] = None, enabled: bool = True,
+                 orphan_ttl: float = 3600):
+        self.manager = manager
+        self.store_dir = store_dir
+        self.enabled = enabled
+        self.orphan_ttl = orphan_ttl
+        self._stats = {"hits": 0, "misses": 0, "removed": 0}
+
+    def is_enabled(self) -> bool:
+        return self.enabled and not self.manager.is_disabled()
+
+    def get_store_dir(self) -> str:
+        store_dir = self.store_dir or os.path.join(self.manager.get_db_dir(), "datasets")
+        os.makedirs(store_dir, exist_ok=True)
+        return store_dir
+
+    def dataset_key(self, content_digest: str, file_format: str) -> str:
+        """Key of a dataset from the sha256 digest of its content and the format it is parsed as"""
+        return hashlib.sha256(f"{DATASET_FORMAT_VERSION}:{file_format}:{content_digest}".encode('utf-8')).hexdigest()
+
+    def dataset_path(self, dataset_key: str) -> str:
+        return os.path.join(self.get_store_dir(), f"{dataset_key}.parquet")
+
+    def get_or_create(self, dataset_key: str, write: Callable[[str], None]) -> str:
+        """Path of a stored dataset, calling `write(path)` to create its parquet file if it isn't stored yet"""
+        path = self.dataset_path(dataset_key)
+        if os.path.exists(path):
+            # a recent modification time keeps the janitor from removing it before it is referenced
+            os.utime(path)
+            self._stats["hits"] += 1
+            return path
+
+        self._stats["misses"] += 1
+        # concurrent uploads of the same data write their own file, the last rename wins
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
+
+    def create_view(self, conn, session_id: str, table_name: str, dataset_key: str):
+        """Expose a stored dataset as a (read-only) view of a session's database"""
+        path = self.dataset_path(dataset_key)
+        conn.execute(f"CREATE VIEW {table_name} AS SELECT * FROM read_parquet({quote_path(path)})")
+        self.manager.get_registry().add_dataset_ref(session_id, table_name, dataset_key)
+
+    def release(self, session_id: str, table_name: Optional[str] = None):
+        """A session table (all of the session's tables if None) no longer references its dataset"""
+        self.manager.get_registry().remove_dataset_refs(session_id, table_name)
+
+    def adopt_views(self, session_id: str, views: List[tuple]):
+        """Replace a session's dataset references with those of the (view name, sql) `views` of the
+        database it switches to, e.g. an uploaded db file exported from this server"""
+        self.release(session_id)
+        for view_name, view_sql in views:
+            if self.is_dataset_view(view_sql):
+                self.manager.get_registry().add_dataset_ref(session_id, view_name, self.referenced_keys(view_sql)[0])
+
+    def is_dataset_view(self, view_sql: Optional[str]) -> bool:
+        """Whether a view's sql is that of a stored dataset"""
+        return bool(view_sql) and self.get_store_dir() in view_sql and len(self.referenced_keys(view_sql)) > 0
+
+    def referenced_keys(self, sql: str) -> List[str]:
+        """Keys of the stored datasets a sql statement reads"""
+        return _DATASET_FILE_PATTERN.findall(sql)
+
+    def collect_garbage(self) -> int:
+        """Remove the dataset files no session table references (and leftovers of failed writes)
+        that weren't used for `orphan_ttl` seconds. Returns the number of files removed."""
+        if not self.is_enabled():
+            return 0
+        store_dir = self.get_store_dir()
+        ref_counts = self.manager.get_registry().dataset_ref_counts()
+        now = time.time()
+        removed = 0
+        for file_name in os.listdir(store_dir):
+            path = os.path.join(store_dir, file_name)
+            match = _DATASET_FILE_PATTERN.fullmatch(file_name)
+            if match and ref_counts.get(match.group(1), 0) > 0:
+                continue
+            if not file_name.endswith(('.parquet', '.tmp')):
+                continue
+            try:
+                if now - os.path.getmtime(path) > self.orphan_ttl:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        self._stats["removed"] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.is_enabled():
+            return {"enabled": False}
+        store_dir = self.get_store_dir()
+        files = [f for f in os.listdir(store_dir) if _DATASET_FILE_PATTERN.fullmatch(f)]
+        ref_counts = self.manager.get_registry().dataset_ref_counts()
+        return {
+            "enabled": True,
+            "datasets": len(files),
+            "size_mb": round(sum(os.path.getsize(os.path.join(store_dir, f)) for f in files) / (1024 * 1024), 3),
+            "references": sum(ref_counts.values()),
+            **self._stats,
+        }
+
+
+dataset_store = DatasetStore(
+    db_manager,
+    store_dir=os.getenv('DATASET_STORE_DIR') or None,
+    enabled=os.getenv('DATASET_DEDUP', 'true').lower() == 'true',
+    orphan_ttl=float(os.getenv('DATASET_ORPHAN_TTL', '3600'))
+)
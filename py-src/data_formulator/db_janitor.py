@@ -0,0 +1,270 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import duckdb
+
+from data_formulator.dataset_store import DatasetStore, dataset_store
+from data_formulator.db_manager import DuckDBManager, db_manager, quote_path
+from data_formulator.example_catalog import example_catalog
+from data_formulator.session_registry import InterProcessLock
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# seconds to wait for another worker process to release a session before skipping it for this run
+SESSION_LOCK_TIMEOUT = 1.0
+
+
+class StorageQuotaExceeded(Exception):
+    """A session's database is over its disk quota, new tables are rejected until data is removed"""
+
+
+def _file_size(path: str) -> int:
+    """size of a db file together with its write-ahead log"""
+    size = 0
+    for file_path in (path, path + ".wal"):
+        if os.path.exists(file_path):
+            size += os.path.getsize(file_path)
+    return size
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            size += os.path.getsize(os.path.join(root, file_name))
+    return size
+
+
+class SessionDBJanitor:
+    """Background maintenance of the session db files.
+
+    Every `interval_seconds` it:
+      * checkpoints sessions idle for `idle_seconds` that changed since their last maintenance, and
+        rewrites their file when more than `compact_free_ratio` of its blocks are free (e.g. after dropping tables)
+      * evicts sessions not used for `abandoned_seconds`, archiving them as zstd compressed parquet
+        in the manager's archive dir (restored on their next request) or deleting them if there is none
+      * evicts the least recently used idle sessions while all session files exceed `global_quota_mb`
+      * removes the stored datasets (see DatasetStore) no session references anymore
+
+    Sessions over `session_quota_mb` can't create new tables (see check_session_quota). Quotas and
+    timeouts of 0 are disabled. With several worker processes, only one of them runs the janitor at a time.
+    """
+    def __init__(self, manager: DuckDBManager, interval_seconds: float = 300,
+                 session_quota_mb: float = 0, global_quota_mb: float = 0,
+                 idle_seconds: float = 600, abandoned_seconds: float = 0, compact_free_ratio: float = 0.5,
+                 store: Optional[DatasetStore] = None):
+        self.manager = manager
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self.session_quota_mb = session_quota_mb
+        self.global_quota_mb = global_quota_mb
+        self.idle_seconds = idle_seconds
+        self.abandoned_seconds = abandoned_seconds
+        self.compact_free_ratio = compact_free_ratio
+
+        # modification time of each session file after its last maintenance
+        self._maintained_mtime: Dict[str, float] = {}
+        self._stats = {"runs": 0, "checkpoints": 0, "compactions": 0, "evictions": 0, "archived": 0, "skipped_in_use": 0}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._process_lock: Optional[InterProcessLock] = None
+
+    def start(self):
+        """Start the background thread (once)"""
+        if self.interval_seconds <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="session-db-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Session db janitor run failed: {e}")
+
+    def run_once(self):
+        """One maintenance pass over all session files"""
+        if self.manager.is_disabled():
+            return
+        if self._process_lock is None:
+            self._process_lock = InterProcessLock(os.path.join(self.manager.get_db_dir(), "df_janitor.lock"))
+        with self._run_lock:
+            # another worker process is running the janitor
+            if not self._process_lock.acquire(timeout=0):
+                return
+            try:
+                self._stats["runs"] += 1
+                now = time.time()
+                for session_id, db_file in self.manager.session_files().items():
+                    idle_seconds = now - self.manager.last_access(session_id, db_file)
+                    if not os.path.exists(db_file):
+                        if idle_seconds > self.idle_seconds:
+                            self.manager.forget_session(session_id)
+                            self._maintained_mtime.pop(session_id, None)
+                        continue
+                    # a request of this process still runs on it (e.g. a long agent query): maintaining
+                    # the file would wait for it or replace the file under it, retry on the next pass
+                    if self.manager.session_in_use(session_id):
+                        self._stats["skipped_in_use"] += 1
+                        continue
+                    try:
+                        if self.abandoned_seconds and idle_seconds > self.abandoned_seconds:
+                            self.evict_session(session_id, db_file)
+                        elif idle_seconds > self.idle_seconds and self._maintained_mtime.get(session_id) != os.path.getmtime(db_file):
+                            self.maintain_session(session_id, db_file)
+                    except Exception as e:
+                        logger.warning(f"Maintenance of session {session_id} failed: {e}")
+                self._enforce_global_quota()
+                if self.store is not None:
+                    try:
+                        self.store.collect_garbage()
+                    except Exception as e:
+                        logger.warning(f"Removing unreferenced datasets failed: {e}")
+            finally:
+                self._process_lock.release()
+
+    def maintain_session(self, session_id: str, db_file: str):
+        """Checkpoint the session db, and rewrite it if most of its blocks are free"""
+        with self.manager.exclusive_session(session_id, timeout=SESSION_LOCK_TIMEOUT):
+            conn = duckdb.connect(database=db_file)
+            try:
+                conn.execute("FORCE CHECKPOINT")
+                conn.execute("VACUUM")
+                _, _, _, total_blocks, _, free_blocks = conn.execute("PRAGMA database_size").fetchone()[:6]
+                database_name = conn.execute("SELECT current_database()").fetchone()[0]
+                should_compact = total_blocks > 0 and free_blocks / total_blocks > self.compact_free_ratio
+                if should_compact:
+                    compact_file = db_file + ".compact"
+                    if os.path.exists(compact_file):
+                        os.remove(compact_file)
+                    conn.execute(f"ATTACH {quote_path(compact_file)} AS __df_compact")
+                    conn.execute(f'COPY FROM DATABASE "{database_name}" TO __df_compact')
+                    conn.execute("DETACH __df_compact")
+            finally:
+                conn.close()
+            self._stats["checkpoints"] += 1
+
+            if should_compact:
+                size_before = _file_size(db_file)
+                os.replace(compact_file, db_file)
+                if os.path.exists(db_file + ".wal"):
+                    os.remove(db_file + ".wal")
+                self._stats["compactions"] += 1
+                logger.info(f"Compacted session {session_id}: {size_before / MB:.1f}MB -> {_file_size(db_file) / MB:.1f}MB")
+            self._maintained_mtime[session_id] = os.path.getmtime(db_file)
+
+    def evict_session(self, session_id: str, db_file: str):
+        """Remove a session's db file, archiving its tables first when an archive dir is configured"""
+        archive_dir = self.manager.get_archive_dir()
+        with self.manager.exclusive_session(session_id, timeout=SESSION_LOCK_TIMEOUT):
+            if archive_dir:
+                archive_path = os.path.join(archive_dir, session_id)
+                shutil.rmtree(archive_path, ignore_errors=True)
+                os.makedirs(archive_dir, exist_ok=True)
+                conn = duckdb.connect(database=db_file)
+                try:
+                    # the example catalog may be gone when the session is restored (the views of stored
+                    # datasets keep their references and are restored as views)
+                    self.manager.materialize_views(conn, example_catalog.is_catalog_view)
+                    conn.execute(f"EXPORT DATABASE {quote_path(archive_path)} (FORMAT PARQUET, COMPRESSION ZSTD)")
+                finally:
+                    conn.close()
+                self._stats["archived"] += 1
+            for file_path in (db_file, db_file + ".wal"):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            # the views of an archived session still read its stored datasets once restored
+            self.manager.forget_session(session_id, keep_dataset_refs=bool(archive_dir))
+        self._maintained_mtime.pop(session_id, None)
+        self._stats["evictions"] += 1
+        logger.info(f"Evicted session {session_id}" + (" to its parquet archive" if archive_dir else ""))
+
+    def _enforce_global_quota(self):
+        if not self.global_quota_mb:
+            return
+        now = time.time()
+        sessions = []
+        total_size = 0
+        for session_id, db_file in self.manager.session_files().items():
+            if os.path.exists(db_file):
+                size = _file_size(db_file)
+                total_size += size
+                sessions.append((self.manager.last_access(session_id, db_file), session_id, db_file, size))
+
+        # least recently used first, sessions in use are never evicted
+        for last_access, session_id, db_file, size in sorted(sessions):
+            if total_size <= self.global_quota_mb * MB:
+                break
+            if now - last_access <= self.idle_seconds or self.manager.session_in_use(session_id):
+                continue
+            try:
+                self.evict_session(session_id, db_file)
+                total_size -= size
+            except Exception as e:
+                logger.warning(f"Eviction of session {session_id} failed: {e}")
+        if total_size > self.global_quota_mb * MB:
+            logger.warning(f"Session databases use {total_size / MB:.0f}MB, over the {self.global_quota_mb}MB quota")
+
+    def session_usage_mb(self, session_id: str) -> float:
+        return _file_size(self.manager.get_db_file(session_id)) / MB
+
+    def check_session_quota(self, session_id: str):
+        """Raise StorageQuotaExceeded if the session can't store more data"""
+        if not self.session_quota_mb:
+            return
+        usage_mb = self.session_usage_mb(session_id)
+        if usage_mb > self.session_quota_mb:
+            raise StorageQuotaExceeded(
+                f"The session database uses {usage_mb:.0f}MB, over its {self.session_quota_mb:.0f}MB quota. "
+                "Delete some tables before adding new ones.")
+
+    def disk_usage(self) -> Dict[str, Any]:
+        """Disk usage of all session files and archives"""
+        now = time.time()
+        sessions = {}
+        for session_id, db_file in self.manager.session_files().items():
+            if not os.path.exists(db_file):
+                continue
+            size_mb = _file_size(db_file) / MB
+            sessions[session_id] = {
+                "db_file": db_file,
+                "size_mb": round(size_mb, 3),
+                "idle_seconds": round(now - self.manager.last_access(session_id, db_file)),
+                "over_quota": bool(self.session_quota_mb) and size_mb > self.session_quota_mb,
+            }
+        archive_dir = self.manager.get_archive_dir()
+        return {
+            "sessions": sessions,
+            "total_mb": round(sum(s["size_mb"] for s in sessions.values()), 3),
+            "archive_mb": round(_dir_size(archive_dir) / MB, 3) if archive_dir and os.path.isdir(archive_dir) else 0,
+            "datasets": self.store.stats() if self.store is not None else None,
+            "session_quota_mb": self.session_quota_mb,
+            "global_quota_mb": self.global_quota_mb,
+            "stats": dict(self._stats),
+        }
+
+
+db_janitor = SessionDBJanitor(
+    db_manager,
+    interval_seconds=float(os.getenv('DB_JANITOR_INTERVAL', '300')),
+    session_quota_mb=float(os.getenv('DB_SESSION_QUOTA_MB', '0')),
+    global_quota_mb=float(os.getenv('DB_GLOBAL_QUOTA_MB', '0')),
+    idle_seconds=float(os.getenv('DB_JANITOR_IDLE_SECONDS', '600')),
+    abandoned_seconds=float(os.getenv('DB_ABANDONED_SESSION_TTL', '0')),
+    store=dataset_store
+)
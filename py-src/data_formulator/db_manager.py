@@ -3,21 +3,134 @@
 
 import duckdb
 import pandas as pd
-from typing import Dict
+from typing import Callable, Dict, Any, List, Optional
+from collections import OrderedDict
 import tempfile
 import os
+import secrets
+import shutil
+import time
+import threading
+import weakref
 from contextlib import contextmanager
 from dotenv import load_dotenv
 import logging
 
+from data_formulator.session_registry import InterProcessLock, SessionLockTimeout, SessionRegistry, private_dir
+
 logger = logging.getLogger(__name__)
 
+
+def quote_path(path: str) -> str:
+    """Quote a file path as a sql string literal, for statements that don't take parameters (ATTACH, EXPORT, ...)"""
+    return "'" + path.replace("'", "''") + "'"
+
+
+def physical_memory_mb() -> int:
+    """Physical memory of the host in MB (0 if it can't be determined)"""
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024))
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+
+class PooledConnection:
+    """A long-lived DuckDB connection kept open for a session.
+
+    Requests never use the pooled connection directly; they get their own cursor
+    (a lightweight child connection sharing the same database instance), which is
+    safe to use from a separate Flask worker thread.
+
+    While it is open the process holds the db file's inter-process lock, since DuckDB
+    lets a single process open a database file for writing.
+    """
+    def __init__(self, session_id: str, db_file: str, conn: duckdb.DuckDBPyConnection, file_lock: InterProcessLock):
+        self.session_id = session_id
+        self.db_file = db_file
+        self.conn = conn
+        self.file_lock = file_lock
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # threads / memory_limit_mb / temp_directory currently set on the database
+        self.allocation: Optional[Dict[str, Any]] = None
+        # aliases of the shared read-only databases attached to it
+        self.attached: set = set()
+        # cursors handed out to requests, weakly referenced so that finished requests drop out
+        self.cursors = weakref.WeakSet()
+
+    def in_use(self) -> bool:
+        return len(self.cursors) > 0
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            self.file_lock.release()
+
+
 class DuckDBManager:
-    def __init__(self, local_db_dir: str, disabled: bool = False):
-        # Store session db file paths
-        self._db_files: Dict[str, str] = {}
+    """Session db files and their pooled connections.
+
+    The session -> db file mapping lives in a sqlite registry shared by all worker processes
+    (e.g. gunicorn workers on one host), and a process keeps a session's db file open only
+    while it holds the file's inter-process lock. A process needing a session opened by another
+    one files a handoff request and waits; the holder releases the session as soon as no request
+    uses it (see _handoff_loop).
+
+    A session's database is thus open in one process at a time: requests of a session served
+    concurrently by different processes take turns, each reopening the db file (and waiting up
+    to the lock timeout for the other process's requests to finish). Deployments with several
+    worker processes should route a session's requests to the same process (session affinity),
+    or serve them with threads of a single process.
+
+    While the database is disabled nothing is written to disk: the registry is kept in memory.
+    """
+    def __init__(self, local_db_dir: str, disabled: bool = False,
+                 max_pool_size: int = 32, idle_ttl_seconds: float = 600, archive_dir: str = None,
+                 registry_path: str = None, lock_timeout_seconds: float = 30,
+                 threads_budget: int = 0, memory_budget_mb: int = 0, min_session_memory_mb: int = 256,
+                 active_session_window: float = 60, spill_dir: str = None):
         self._local_db_dir: str = local_db_dir
         self._disabled: bool = disabled
+        # evicted sessions are archived here as parquet and restored on their next request
+        self._archive_dir: str = archive_dir
+
+        self._registry_path: str = registry_path
+        self._registry: Optional[SessionRegistry] = None
+        self._lock_timeout_seconds: float = lock_timeout_seconds
+        self._file_locks: Dict[str, InterProcessLock] = {}
+        # serializes opening (and maintaining) the db file of a session within the process
+        self._session_locks: Dict[str, threading.Lock] = {}
+        # last access times written to the registry, which is only updated every few seconds
+        self._touched: Dict[str, float] = {}
+
+        # Pool of open connections keyed by session id, in LRU order (oldest first)
+        self._pool: "OrderedDict[str, PooledConnection]" = OrderedDict()
+        self._pool_lock = threading.RLock()
+        self._max_pool_size: int = max(1, max_pool_size)
+        self._idle_ttl_seconds: float = idle_ttl_seconds
+        self._pool_metrics: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "handoffs": 0}
+        # connections dropped from the pool while requests still used them, closed once they are done
+        self._draining: list = []
+        self._handoff_thread: Optional[threading.Thread] = None
+
+        # sessions whose db file is being maintained (compacted, archived), requests wait for them
+        self._maintenance: set = set()
+        self._maintenance_done = threading.Condition(self._pool_lock)
+
+        # resource governor: the host's threads and memory are split evenly among the sessions
+        # active in the last `active_session_window` seconds (in all worker processes), instead of
+        # each session database defaulting to all cores and 80% of the memory
+        self._threads_budget: int = threads_budget or os.cpu_count() or 1
+        self._memory_budget_mb: int = memory_budget_mb or int(physical_memory_mb() * 0.8)
+        self._min_session_memory_mb: int = min_session_memory_mb
+        self._active_session_window: float = active_session_window
+        # larger than memory operators spill to <spill_dir>/<session_id> (next to the db file by default)
+        self._spill_dir: str = spill_dir
+        self._active_sessions: tuple = (0.0, 1)
+
+        # shared read-only databases (alias -> file) attached to every session database, e.g. the example datasets catalog
+        self._read_only_databases: Dict[str, str] = {}
 
     def is_disabled(self) -> bool:
         """Check if the database manager is disabled"""
@@ -25,7 +138,10 @@ class DuckDBManager:
 
     @contextmanager
     def connection(self, session_id: str):
-        """Get a DuckDB connection as a context manager that will be closed when exiting the context"""
+        """Get a DuckDB connection as a context manager that will be closed when exiting the context.
+
+        Only the per-request cursor is closed, the pooled session connection stays open.
+        """
         conn = None
         try:
             conn = self.get_connection(session_id)
@@ -33,33 +149,459 @@ class DuckDBManager:
         finally:
             if conn:
                 conn.close()
-    
+                self._discard_cursor(conn)
+
+    def get_db_dir(self) -> str:
+        """Directory of the session db files"""
+        db_dir = self._local_db_dir if self._local_db_dir else tempfile.gettempdir()
+        if not os.path.exists(db_dir):
+            db_dir = tempfile.gettempdir()
+        return db_dir
+
+    def get_archive_dir(self) -> str:
+        return self._archive_dir
+
+    def get_registry(self) -> SessionRegistry:
+        if self._registry is None:
+            with self._pool_lock:
+                if self._registry is None:
+                    if self._disabled:
+                        # private to the process, there are no session db files to share
+                        self._registry = SessionRegistry(":memory:")
+                    else:
+                        # it holds the flask secret key, keep it out of reach of the other users of the db dir
+                        self._registry = SessionRegistry(self._registry_path or os.path.join(private_dir(self.get_db_dir()), "df_sessions.sqlite"))
+        return self._registry
+
+    def get_db_file(self, session_id: str) -> str:
+        """Get or create the db file path for a session"""
+        db_file = self.get_registry().get_db_file(session_id)
+        if db_file is None:
+            db_file = self.get_registry().register(session_id, os.path.join(self.get_db_dir(), f"df_{session_id}.duckdb"))
+            logger.debug(f"=== Creating new db file: {db_file}")
+        else:
+            logger.debug(f"=== Using existing db file: {db_file}")
+        return db_file
+
+    def lookup_db_file(self, session_id: str) -> Optional[str]:
+        """The db file registered for a session, None if it has none yet"""
+        return self.get_registry().get_db_file(session_id)
+
+    def set_db_file(self, session_id: str, db_file: str):
+        """Point a session to another db file (e.g. an uploaded one), in all worker processes"""
+        self.close_session(session_id)
+        self.get_registry().set_db_file(session_id, db_file)
+
+    def shared_secret_key(self) -> str:
+        """Flask secret key shared by the worker processes, so session cookies are valid in all of them
+        (a key of this process only while the database is disabled, it isn't persisted then)"""
+        if self._disabled:
+            return secrets.token_hex(16)
+        try:
+            return self.get_registry().shared_secret_key()
+        except Exception as e:
+            logger.warning(f"Could not read the shared secret key, sessions won't work across processes: {e}")
+            return secrets.token_hex(16)
+
     def get_connection(self, session_id: str) -> duckdb.DuckDBPyConnection:
-        """Internal method to get or create a DuckDB connection for a session"""
+        """Get a DuckDB connection for a session.
+
+        The returned object is a cursor on the session's pooled connection; callers
+        should close it when done (closing it does not close the pooled connection).
+        """
         if self._disabled:
             return duckdb.connect(database=":memory:")
-            
-        # Get or create the db file path for this session
-        if session_id not in self._db_files or self._db_files[session_id] is None:
-            db_dir = self._local_db_dir if self._local_db_dir else tempfile.gettempdir()
-            if not os.path.exists(db_dir):
-                db_dir = tempfile.gettempdir()
-            db_file = os.path.join(db_dir, f"df_{session_id}.duckdb")
-            logger.debug(f"=== Creating new db file: {db_file}")
-            self._db_files[session_id] = db_file
-        else:
-            logger.debug(f"=== Using existing db file: {self._db_files[session_id]}")
-            db_file = self._db_files[session_id]
-            
-        # Create a fresh connection to the database file
+
+        while True:
+            db_file = self.get_db_file(session_id)
+            self._touch(session_id)
+            with self._pool_lock:
+                while session_id in self._maintenance:
+                    self._maintenance_done.wait()
+                self._evict_idle()
+                self._reap_draining()
+                cursor = self._pooled_cursor(session_id, db_file)
+                if cursor is not None:
+                    return cursor
+
+            with self._session_lock(session_id):
+                with self._pool_lock:
+                    if session_id in self._maintenance:
+                        continue
+                    # another thread may have opened it while we waited
+                    cursor = self._pooled_cursor(session_id, db_file)
+                    if cursor is not None:
+                        return cursor
+                    self._pool_metrics["misses"] += 1
+                    if session_id in self._pool:
+                        # the session was pointed to a different db file (e.g. uploaded db)
+                        self._release(session_id)
+
+                file_lock = self._acquire_file_lock(session_id, db_file, self._lock_timeout_seconds)
+                try:
+                    if not os.path.exists(db_file):
+                        self._restore_archive(session_id, db_file)
+                    entry = PooledConnection(session_id, db_file, duckdb.connect(database=db_file), file_lock)
+                except Exception:
+                    file_lock.release()
+                    raise
+
+                with self._pool_lock:
+                    self._pool[session_id] = entry
+                    while len(self._pool) > self._max_pool_size:
+                        oldest_session_id = next(iter(self._pool))
+                        self._release(oldest_session_id)
+                        self._pool_metrics["evictions"] += 1
+                    self._start_handoff_thread()
+                    return self._new_cursor(entry)
+
+    def _pooled_cursor(self, session_id: str, db_file: str) -> Optional[duckdb.DuckDBPyConnection]:
+        """A cursor on the session's pooled connection, None if it isn't open (call with the pool lock held)"""
+        entry = self._pool.get(session_id)
+        if entry is None or entry.db_file != db_file:
+            return None
+        self._pool_metrics["hits"] += 1
+        self._pool.move_to_end(session_id)
+        return self._new_cursor(entry)
+
+    def _new_cursor(self, entry: PooledConnection) -> duckdb.DuckDBPyConnection:
+        entry.last_used = time.monotonic()
+        try:
+            self._apply_allocation(entry)
+        except Exception as e:
+            logger.warning(f"Could not apply the resource allocation of session {entry.session_id}: {e}")
+        if len(entry.attached) < len(self._read_only_databases):
+            entry.attached.update(self._attach_read_only_databases(entry.conn, exclude=entry.attached))
+        cursor = entry.conn.cursor()
+        entry.cursors.add(cursor)
+        return cursor
+
+    def _discard_cursor(self, cursor: duckdb.DuckDBPyConnection):
+        """Stop counting a closed cursor as a use of its session's connection"""
+        with self._pool_lock:
+            for entry in list(self._pool.values()) + self._draining:
+                entry.cursors.discard(cursor)
+            # exclusive_session waits for the session's requests to finish
+            self._maintenance_done.notify_all()
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        with self._pool_lock:
+            return self._session_locks.setdefault(session_id, threading.Lock())
+
+    def _acquire_file_lock(self, session_id: str, db_file: str, timeout: float) -> InterProcessLock:
+        """Take the inter-process lock of a db file, asking the process holding it to hand it over"""
+        with self._pool_lock:
+            file_lock = self._file_locks.get(db_file)
+            if file_lock is None:
+                file_lock = self._file_locks[db_file] = InterProcessLock(db_file + ".lock")
+        registry = self.get_registry()
+        try:
+            acquired = file_lock.acquire(timeout, on_wait=lambda: registry.request_handoff(session_id))
+        finally:
+            registry.clear_handoff(session_id)
+        if not acquired:
+            raise SessionLockTimeout(
+                f"The session database is busy in another worker process (waited {timeout:.0f}s), please try again")
+        return file_lock
+
+    def active_session_count(self) -> int:
+        """Number of sessions used in the last active_session_window seconds, in any worker process
+        (refreshed at most every second)"""
+        checked_at, count = self._active_sessions
+        if time.monotonic() - checked_at > 1:
+            count = self.get_registry().count_active(time.time() - self._active_session_window)
+            self._active_sessions = (time.monotonic(), count)
+        return max(1, count)
+
+    def session_allocation(self, session_id: str) -> Dict[str, Any]:
+        """Share of the threads and memory budget a session gets with the current number of active sessions"""
+        active_sessions = self.active_session_count()
+        allocation = {
+            "threads": max(1, self._threads_budget // active_sessions),
+            "memory_limit_mb": None,
+            "temp_directory": os.path.join(self._spill_dir, session_id) if self._spill_dir else None,
+        }
+        if self._memory_budget_mb:
+            allocation["memory_limit_mb"] = max(self._min_session_memory_mb, self._memory_budget_mb // active_sessions)
+        return allocation
+
+    def _apply_allocation(self, entry: PooledConnection):
+        """Update the settings of a session's database when its share of the budget changed (the
+        settings apply to the session's whole database instance, i.e. all its cursors).
+
+        Allocations are rebalanced lazily: a session picks up its new share on its next request."""
+        allocation = self.session_allocation(entry.session_id)
+        if allocation == entry.allocation:
+            return
+        entry.conn.execute(f"SET threads = {int(allocation['threads'])}")
+        if allocation["memory_limit_mb"]:
+            entry.conn.execute(f"SET memory_limit = '{int(allocation['memory_limit_mb'])}MB'")
+        temp_directory = allocation["temp_directory"]
+        # the temp directory can't be switched once spilled to, it is the same for the session's lifetime anyway
+        if temp_directory and entry.allocation is None and \
+                entry.conn.execute("SELECT current_setting('temp_directory')").fetchone()[0] != temp_directory:
+            entry.conn.execute(f"SET temp_directory = {quote_path(temp_directory)}")
+        entry.allocation = allocation
+
+    def resource_allocation(self) -> Dict[str, Any]:
+        """The resource budget and the current allocation of the sessions open in this process"""
+        with self._pool_lock:
+            sessions = {session_id: entry.allocation for session_id, entry in self._pool.items() if entry.allocation}
+        return {
+            "threads_budget": self._threads_budget,
+            "memory_budget_mb": self._memory_budget_mb,
+            "min_session_memory_mb": self._min_session_memory_mb,
+            "active_sessions": self.active_session_count(),
+            "active_session_window": self._active_session_window,
+            "sessions": sessions,
+        }
+
+    def _touch(self, session_id: str):
+        now = time.time()
+        if now - self._touched.get(session_id, 0) > 10:
+            self._touched[session_id] = now
+            self.get_registry().touch(session_id, now)
+
+    def session_in_use(self, session_id: str) -> bool:
+        """Whether requests of this process are using the session's database"""
+        with self._pool_lock:
+            entry = self._pool.get(session_id)
+            if entry is not None and entry.in_use():
+                return True
+            return any(entry.session_id == session_id and entry.in_use() for entry in self._draining)
+
+    def close_session(self, session_id: str):
+        """Close the pooled connection of a session, e.g. before its db file is removed or replaced.
+
+        A connection still used by a request is closed once the request is done (see _reap_draining),
+        use exclusive_session to wait for them."""
+        with self._pool_lock:
+            self._release(session_id)
+
+    @contextmanager
+    def exclusive_session(self, session_id: str, timeout: float = None):
+        """Close a session's connection and hold its requests back, in this and the other worker
+        processes, while its db file is maintained (checkpointed, compacted, archived or replaced).
+
+        The requests of this process that already use the session are waited for first: the file
+        lock is counted per process, so taking it doesn't wait for them, and closing the connection
+        under them would break their queries.
+
+        Raises SessionLockTimeout if the session's requests don't finish, or another process doesn't
+        release the db file, within `timeout` seconds (the lock timeout by default)."""
+        deadline = time.monotonic() + (self._lock_timeout_seconds if timeout is None else timeout)
+        with self._pool_lock:
+            while session_id in self._maintenance:
+                self._maintenance_done.wait()
+            self._maintenance.add(session_id)
+        try:
+            with self._pool_lock:
+                while self.session_in_use(session_id):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SessionLockTimeout("The session database is busy with other requests, please try again")
+                    # cursors dropped without being closed don't notify, poll for them too
+                    self._maintenance_done.wait(min(remaining, 0.25))
+            with self._session_lock(session_id):
+                self.close_session(session_id)
+                file_lock = self._acquire_file_lock(session_id, self.get_db_file(session_id),
+                                                    max(0.0, deadline - time.monotonic()))
+                try:
+                    yield
+                finally:
+                    file_lock.release()
+        finally:
+            with self._pool_lock:
+                self._maintenance.discard(session_id)
+                self._maintenance_done.notify_all()
+
+    def session_files(self) -> Dict[str, str]:
+        """Db files of all sessions: the registered ones plus df_<session_id>.duckdb files in the db dir
+        (e.g. left by a previous run of the app)"""
+        files = {}
+        db_dir = self.get_db_dir()
+        for file_name in os.listdir(db_dir):
+            if file_name.startswith("df_") and file_name.endswith(".duckdb"):
+                files[file_name[len("df_"):-len(".duckdb")]] = os.path.join(db_dir, file_name)
+        files.update(self.get_registry().sessions())
+        return files
+
+    def last_access(self, session_id: str, db_file: str = None) -> float:
+        """Wall clock time of the session's last request in any worker process (the db file's
+        modification time for files the registry doesn't know)"""
+        last_access = self.get_registry().last_access(session_id)
+        if last_access is not None:
+            return last_access
+        db_file = db_file or self.get_db_file(session_id)
+        return os.path.getmtime(db_file) if os.path.exists(db_file) else 0
+
+    def forget_session(self, session_id: str, keep_dataset_refs: bool = False):
+        """Drop what the manager remembers about a session whose db file is gone (its references
+        to stored datasets are kept with `keep_dataset_refs`, for sessions that will be restored)"""
+        self.close_session(session_id)
+        self.get_registry().remove(session_id, keep_dataset_refs=keep_dataset_refs)
+        with self._pool_lock:
+            self._touched.pop(session_id, None)
+
+    def session_of_db_file(self, db_file: str) -> Optional[str]:
+        """Session whose database, open in this process, is the file `db_file` (None if there is none)"""
+        db_file = os.path.abspath(db_file)
+        with self._pool_lock:
+            for entry in self._pool.values():
+                if os.path.abspath(entry.db_file) == db_file:
+                    return entry.session_id
+        return None
+
+    def attach_read_only(self, alias: str, db_file: str):
+        """Attach a shared database file, read-only, to every session database under `alias`
+        (connections already open attach it with their next request)"""
+        self._read_only_databases[alias] = db_file
+
+    def _attach_read_only_databases(self, conn: duckdb.DuckDBPyConnection, exclude: set = frozenset()) -> set:
+        """Attach the shared read-only databases to a connection, returns the aliases attached"""
+        attached = set()
+        for alias, db_file in list(self._read_only_databases.items()):
+            if alias in exclude or not os.path.exists(db_file):
+                continue
+            try:
+                conn.execute(f'ATTACH IF NOT EXISTS {quote_path(db_file)} AS "{alias}" (READ_ONLY)')
+                attached.add(alias)
+            except Exception as e:
+                logger.warning(f"Could not attach the read-only database {alias}: {e}")
+        return attached
+
+    def materialize_views(self, conn: duckdb.DuckDBPyConnection, is_stored_view: Callable[[str], bool]) -> List[str]:
+        """Replace the views of a database that expose data stored outside of it (those whose sql
+        `is_stored_view`) by tables holding their rows, before the database leaves the server
+        (download, archive). Returns the names of the views replaced."""
+        self._attach_read_only_databases(conn)
+        views = conn.execute(
+            "SELECT view_name, sql FROM duckdb_views() WHERE NOT internal AND database_name = current_database() AND schema_name = current_schema()"
+        ).fetchall()
+        materialized = []
+        for view_name, view_sql in views:
+            if not is_stored_view(view_sql):
+                continue
+            conn.execute(f'CREATE TABLE "__df_materialized" AS SELECT * FROM "{view_name}"')
+            conn.execute(f'DROP VIEW "{view_name}"')
+            conn.execute(f'ALTER TABLE "__df_materialized" RENAME TO "{view_name}"')
+            materialized.append(view_name)
+        return materialized
+
+    def _restore_archive(self, session_id: str, db_file: str):
+        """Import the parquet archive of an evicted session back into its db file"""
+        if not self._archive_dir:
+            return
+        archive_path = os.path.join(self._archive_dir, session_id)
+        if not os.path.isdir(archive_path):
+            return
+        logger.info(f"Restoring session {session_id} from {archive_path}")
         conn = duckdb.connect(database=db_file)
+        try:
+            # views of the archive may read the shared databases
+            self._attach_read_only_databases(conn)
+            conn.execute(f"IMPORT DATABASE {quote_path(archive_path)}")
+        finally:
+            conn.close()
+        shutil.rmtree(archive_path, ignore_errors=True)
+
+    def close_all(self):
+        """Close all pooled connections"""
+        with self._pool_lock:
+            for session_id in list(self._pool.keys()) + [entry.session_id for entry in self._draining]:
+                self.close_session(session_id)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Report the connection pool usage (size and hit/miss/eviction counters)"""
+        with self._pool_lock:
+            lookups = self._pool_metrics["hits"] + self._pool_metrics["misses"]
+            return {
+                "size": len(self._pool),
+                "draining": len(self._draining),
+                "max_size": self._max_pool_size,
+                "idle_ttl_seconds": self._idle_ttl_seconds,
+                **self._pool_metrics,
+                "hit_rate": self._pool_metrics["hits"] / lookups if lookups > 0 else 0.0,
+            }
+
+    def _evict_idle(self):
+        """Drop connections that have not been used for longer than the idle ttl"""
+        if self._idle_ttl_seconds is None or self._idle_ttl_seconds <= 0:
+            return
+        now = time.monotonic()
+        # entries are kept in LRU order, so we can stop at the first recently used one
+        while self._pool:
+            session_id, entry = next(iter(self._pool.items()))
+            if now - entry.last_used < self._idle_ttl_seconds:
+                break
+            self._release(session_id)
+            self._pool_metrics["evictions"] += 1
+
+    def _release(self, session_id: str):
+        """Remove a connection from the pool.
+
+        Cursors handed out earlier may still be running a query on another thread,
+        so a connection in use is only closed (and its db file unlocked) once they
+        are done, see _reap_draining.
+        """
+        entry = self._pool.pop(session_id, None)
+        if entry is not None:
+            logger.debug(f"=== Releasing pooled connection for session {session_id}")
+            self._draining.append(entry)
+            self._reap_draining()
+
+    def _reap_draining(self):
+        """Close the released connections no request uses anymore (call with the pool lock held)"""
+        still_used = []
+        for entry in self._draining:
+            if entry.in_use():
+                still_used.append(entry)
+                continue
+            try:
+                entry.close()
+            except Exception as e:
+                logger.warning(f"Error closing connection for session {entry.session_id}: {e}")
+        self._draining = still_used
+
+    def _start_handoff_thread(self):
+        if self._handoff_thread is None or not self._handoff_thread.is_alive():
+            self._handoff_thread = threading.Thread(target=self._handoff_loop, name="session-db-handoff", daemon=True)
+            self._handoff_thread.start()
+
+    def _handoff_loop(self, interval: float = 0.25):
+        """Release the sessions other worker processes are waiting for, as soon as no request uses them"""
+        while True:
+            time.sleep(interval)
+            try:
+                with self._pool_lock:
+                    self._reap_draining()
+                    if not self._pool:
+                        continue
+                requested = self.get_registry().handoff_requests(max_age=self._lock_timeout_seconds)
+                with self._pool_lock:
+                    for session_id in requested:
+                        entry = self._pool.get(session_id)
+                        if entry is not None and not entry.in_use():
+                            self._release(session_id)
+                            self._pool_metrics["handoffs"] += 1
+            except Exception as e:
+                logger.warning(f"Session handoff check failed: {e}")
 
-        return conn
 
 env = load_dotenv()
 
 # Initialize the DB manager
 db_manager = DuckDBManager(
     local_db_dir=os.getenv('LOCAL_DB_DIR'),
-    disabled=os.getenv('DISABLE_DATABASE', 'false').lower() == 'true'
-)
\ No newline at end of file
+    disabled=os.getenv('DISABLE_DATABASE', 'false').lower() == 'true',
+    max_pool_size=int(os.getenv('DB_POOL_MAX_SIZE', '32')),
+    idle_ttl_seconds=float(os.getenv('DB_POOL_IDLE_TTL', '600')),
+    archive_dir=os.getenv('DB_ARCHIVE_DIR') or None,
+    registry_path=os.getenv('DB_SESSION_REGISTRY') or None,
+    lock_timeout_seconds=float(os.getenv('DB_LOCK_TIMEOUT', '30')),
+    threads_budget=int(os.getenv('DB_THREADS_BUDGET', '0')),
+    memory_budget_mb=int(os.getenv('DB_MEMORY_BUDGET_MB', '0')),
+    min_session_memory_mb=int(os.getenv('DB_MIN_SESSION_MEMORY_MB', '256')),
+    active_session_window=float(os.getenv('DB_ACTIVE_SESSION_WINDOW', '60')),
+    spill_dir=os.getenv('DB_SPILL_DIR') or None
+)
@@ -0,0 +1,204 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import os
+import re
+import threading
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+import duckdb
+
+from data_formulator.db_manager import DuckDBManager, db_manager, quote_path
+from data_formulator.example_datasets_config import EXAMPLE_DATASETS
+from data_formulator.session_registry import InterProcessLock
+from data_formulator.upload_ingest import CSV_TYPE_CANDIDATES
+
+logger = logging.getLogger(__name__)
+
+# alias the catalog is attached under in every session database
+CATALOG_ALIAS = "df_examples"
+
+DOWNLOAD_TIMEOUT = 30
+
+# seconds to wait for another worker process building the catalog
+BUILD_LOCK_TIMEOUT = 600
+
+
+def catalog_table_name(url: str) -> str:
+    """Table name of an example dataset file, from its url (like the client names them)"""
+    base_name = url.split("/")[-1].split(".")[0].lower()
+    base_name = re.sub(r"[^a-z0-9_]", "_", base_name)
+    return base_name if base_name[:1].isalpha() else f"table_{base_name}"
+
+
+class ExampleCatalog:
+    """Read-only DuckDB database with the tables of EXAMPLE_DATASETS, attached to every session
+    database as `df_examples` so sessions can load an example as a view rather than a copy.
+
+    The source files are kept in `cache_dir`: missing ones are downloaded when the catalog is
+    built (at startup, in the background) unless `offline`, in which case only the files already
+    in the cache dir (e.g. copied there at deploy time) are loaded. The catalog is rebuilt
+    whenever a file was added to the cache since its last build.
+    """
+    def __init__(self, manager: DuckDBManager, datasets: List[Dict[str, Any]], cache_dir: Optional[str] = None,
+                 enabled: bool = True, offline: bool = False):
+        self.manager = manager
+        self.datasets = datasets
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.offline = offline
+        self._tables = self._assign_table_names(datasets)
+        self._available: set = set()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _assign_table_names(datasets: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """url -> {table_name, format}, names are made unique in the order of the config"""
+        tables = {}
+        used_names = set()
+        for dataset in datasets:
+            for table in dataset['tables']:
+                if table['url'] in tables:
+                    continue
+                table_name = base_name = catalog_table_name(table['url'])
+                counter = 1
+                while table_name in used_names:
+                    table_name = f"{base_name}_{counter}"
+                    counter += 1
+                used_names.add(table_name)
+                tables[table['url']] = {"table_name": table_name, "format": table['format']}
+        return tables
+
+    def is_enabled(self) -> bool:
+        return self.enabled and not self.manager.is_disabled()
+
+    def get_cache_dir(self) -> str:
+        cache_dir = self.cache_dir or os.path.join(self.manager.get_db_dir(), "example_datasets")
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
+
+    def catalog_path(self) -> str:
+        return os.path.join(self.get_cache_dir(), "catalog.duckdb")
+
+    def start(self):
+        """Build the catalog in a background thread (once) and attach it to the session databases"""
+        if not self.is_enabled() or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._build_and_attach, name="example-catalog", daemon=True)
+        self._thread.start()
+
+    def _build_and_attach(self):
+        try:
+            self.build()
+        except Exception as e:
+            logger.error(f"Building the example datasets catalog failed: {e}")
+        if os.path.exists(self.catalog_path()):
+            self.manager.attach_read_only(CATALOG_ALIAS, self.catalog_path())
+
+    def build(self):
+        """Download the missing source files (unless offline) and rebuild the catalog if they changed"""
+        cache_dir = self.get_cache_dir()
+        lock = InterProcessLock(os.path.join(cache_dir, "catalog.lock"))
+        # other worker processes build it at the same time, the first one does the work
+        if not lock.acquire(timeout=BUILD_LOCK_TIMEOUT):
+            logger.warning("Timed out waiting for another process to build the example datasets catalog")
+            return
+        try:
+            source_files = {}
+            for url, table in self._tables.items():
+                path = os.path.join(cache_dir, f"{table['table_name']}.{table['format']}")
+                if not os.path.exists(path) and not self.offline:
+                    try:
+                        self._download(url, path)
+                    except Exception as e:
+                        logger.warning(f"Could not download example dataset {url}: {e}")
+                if os.path.exists(path):
+                    source_files[table['table_name']] = (path, table['format'])
+
+            catalog_path = self.catalog_path()
+            if os.path.exists(catalog_path):
+                catalog_mtime = os.path.getmtime(catalog_path)
+                if all(os.path.getmtime(path) <= catalog_mtime for path, _ in source_files.values()) \
+                        and set(source_files) <= self._catalog_tables(catalog_path):
+                    self._available = set(source_files)
+                    return
+
+            temp_path = catalog_path + ".tmp"
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            conn = duckdb.connect(database=temp_path)
+            loaded = set()
+            try:
+                for table_name, (path, file_format) in source_files.items():
+                    try:
+                        if file_format == 'json':
+                            conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM read_json(?, format = 'array')", [path])
+                        else:
+                            conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM read_csv(?, delim = ?, auto_type_candidates = {CSV_TYPE_CANDIDATES})",
+                                         [path, '\t' if file_format == 'tsv' else ','])
+                        loaded.add(table_name)
+                    except Exception as e:
+                        logger.warning(f"Could not load example dataset {path}: {e}")
+                conn.execute("CHECKPOINT")
+            finally:
+                conn.close()
+            os.replace(temp_path, catalog_path)
+            self._available = loaded
+            logger.info(f"Built the example datasets catalog with {len(loaded)} tables")
+        finally:
+            lock.release()
+
+    def _download(self, url: str, path: str):
+        temp_path = path + ".download"
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(temp_path, 'wb') as out:
+            while True:
+                chunk = response.read(1024 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _catalog_tables(catalog_path: str) -> set:
+        try:
+            conn = duckdb.connect(database=catalog_path, read_only=True)
+        except Exception:
+            return set()
+        try:
+            return {row[0] for row in conn.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+        finally:
+            conn.close()
+
+    def has_table(self, catalog_table: Optional[str]) -> bool:
+        return catalog_table in self._available
+
+    def table_for_url(self, url: str) -> Optional[str]:
+        """Catalog table holding the data of an example dataset file, None if it isn't in the catalog"""
+        table = self._tables.get(url)
+        if table is None or table['table_name'] not in self._available:
+            return None
+        return table['table_name']
+
+    def annotated_datasets(self) -> List[Dict[str, Any]]:
+        """EXAMPLE_DATASETS with the catalog table of each table (None when not loaded)"""
+        return [{**dataset, 'tables': [{**table, 'catalog_table': self.table_for_url(table['url'])} for table in dataset['tables']]}
+                for dataset in self.datasets]
+
+    def create_view(self, conn, table_name: str, catalog_table: str):
+        """Expose a catalog table as a view of a session's database"""
+        conn.execute(f'CREATE VIEW {table_name} AS SELECT * FROM "{CATALOG_ALIAS}".main.{catalog_table}')
+
+    def is_catalog_view(self, view_sql: Optional[str]) -> bool:
+        """Whether a view's sql is that of an example dataset (see create_view)"""
+        return bool(view_sql) and re.search(rf'^CREATE VIEW \S+ AS SELECT \* FROM "?{CATALOG_ALIAS}"?\.main\.\w+;?$', view_sql.strip()) is not None
+
+
+example_catalog = ExampleCatalog(
+    db_manager,
+    EXAMPLE_DATASETS,
+    cache_dir=os.getenv('EXAMPLE_DATASETS_CACHE_DIR') or None,
+    enabled=os.getenv('EXAMPLE_DATASETS_CATALOG', 'true').lower() == 'true',
+    offline=os.getenv('EXAMPLE_DATASETS_OFFLINE', 'false').lower() == 'true'
+)
@@ -3,17 +3,37 @@
 
 from multiprocessing import Process, Pipe
 from sys import addaudithook
+import atexit
+import itertools
+import logging
+import os
+import queue
+import signal
+import threading
+import time
 import traceback
+import uuid
 import warnings
 import pandas as pd
 
-def subprocess_execute(code, allowed_objects, conn):
-    """run the code in a subprocess with some sort of safety measure
-    code: script to execute
-    allowed_objects: objects exposed to the target code
-    conn: children connection
-    """
-    warnings.filterwarnings('ignore')
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from multiprocessing import resource_tracker, shared_memory
+import ctypes
+from data_formulator.arrow_utils import PYARROW_AVAILABLE
+if PYARROW_AVAILABLE:
+    import pyarrow as pa
+    import pyarrow.ipc
+
+logger = logging.getLogger(__name__)
+
+
+def install_audit_hook():
+    """block file writes and subprocess/shutil calls in the current (sandbox) process, 
+    audit hooks can't be removed, so this should only be called in a child process"""
 
     def block_mischief(event,arg):
         if type(event) != str: raise
@@ -31,30 +51,509 @@ def subprocess_execute(code, allowed_objects, conn):
     addaudithook(block_mischief)
     del(block_mischief)  ## No way to remove or circumwent audit hooks from python. No access to this function. 
 
+
+def subprocess_execute(code, allowed_objects, conn, cpu_time_limit=None, memory_limit_mb=None):
+    """run the code in a subprocess with some sort of safety measure
+    code: script to execute
+    allowed_objects: objects exposed to the target code
+    conn: children connection
+    cpu_time_limit / memory_limit_mb: resource limits of the execution (None for no limit)
+    """
+    warnings.filterwarnings('ignore')
+    install_resource_exceeded_handler()
+    install_audit_hook()
+
     extended_allowed_objects = { **allowed_objects, 'conn': conn }  # automatically add the communication pipe to objects accessible from the sandbox
+    apply_resource_limits(cpu_time_limit, memory_limit_mb)
     try:
         exec(code, extended_allowed_objects)
+        result = {'status': 'ok', 'allowed_objects': {key: extended_allowed_objects[key] for key in allowed_objects}}
+    except ResourceExceeded as err:
+        result = resource_exceeded_result(err.resource_name, cpu_time_limit)
+    except MemoryError:
+        result = resource_exceeded_result('memory', memory_limit_mb)
     except Exception as err:
-        error_message = f"Error: {type(err).__name__} - {str(err)}"
-        conn.send({'status': 'error', 'error_message': error_message})
+        result = {'status': 'error', 'error_message': f"Error: {type(err).__name__} - {str(err)}"}
+    finally:
+        clear_resource_limits()
+
+    conn.send(result)
+    conn.close()
+
+
+class ResourceExceeded(BaseException):
+    """raised in the sandboxed code when it runs over a resource limit; derives from BaseException
+    so that generated code catching Exception doesn't swallow it"""
+    def __init__(self, resource_name='wall_time'):
+        super().__init__(resource_name)
+        self.resource_name = resource_name
+
+
+def resource_exceeded_result(resource_name, limit=None):
+    """structured error of an execution stopped for exceeding a limit, its message is what
+    the agents send back to the model when repairing the code"""
+    if resource_name == 'wall_time':
+        description = f"time limit of {limit:g} seconds" if limit else "time limit"
+    elif resource_name == 'cpu_time':
+        description = f"CPU time limit of {limit:g} seconds" if limit else "CPU time limit"
+    else:
+        description = f"memory limit of {limit:g} MB" if limit else "available memory"
+    return {
+        'status': 'error',
+        'error_type': 'resource_exceeded',
+        'resource': resource_name,
+        'error_message': f"Error: ResourceExceeded - the code exceeded the {description}. "
+                         "Use vectorized pandas operations and avoid cross joins, row-by-row python loops "
+                         "or other very large intermediate results."
+    }
+
+
+def _read_statm_mb(pid='self'):
+    """(virtual size, resident size) of a process in MB, None where /proc is not available"""
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            vm_pages, rss_pages = f.read().split()[:2]
+        page_mb = os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+    return int(vm_pages) * page_mb, int(rss_pages) * page_mb
+
+
+def _raise_cpu_time_exceeded(signum, frame):
+    raise ResourceExceeded('cpu_time')
+
+
+def install_resource_exceeded_handler():
+    """(sandbox process) turn the SIGXCPU sent once RLIMIT_CPU is reached into ResourceExceeded"""
+    if hasattr(signal, 'SIGXCPU'):
+        signal.signal(signal.SIGXCPU, _raise_cpu_time_exceeded)
+
+
+def _set_soft_limit(limit_type, soft):
+    _, hard = resource.getrlimit(limit_type)
+    if hard != resource.RLIM_INFINITY:
+        soft = hard if soft == resource.RLIM_INFINITY else min(soft, hard)
+    resource.setrlimit(limit_type, (soft, hard))
+
+
+def apply_resource_limits(cpu_time_limit, memory_limit_mb):
+    """(sandbox process) limit the next execution to `cpu_time_limit` more CPU seconds and
+    `memory_limit_mb` more address space than the process currently uses; a persistent
+    worker calls this before every task, so limits are relative to its current usage"""
+    if resource is None:
+        return
+    try:
+        if cpu_time_limit:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            _set_soft_limit(resource.RLIMIT_CPU, int(usage.ru_utime + usage.ru_stime + cpu_time_limit) + 1)
+        statm = _read_statm_mb() if memory_limit_mb else None
+        if statm is not None:
+            _set_soft_limit(resource.RLIMIT_AS, int((statm[0] + memory_limit_mb) * 1024 * 1024))
+    except (ValueError, OSError) as err:
+        logger.debug(f"Could not set sandbox resource limits: {err}")
+
+
+def clear_resource_limits():
+    """(sandbox process) lift the limits set by apply_resource_limits"""
+    if resource is None:
+        return
+    for limit_type in (resource.RLIMIT_CPU, resource.RLIMIT_AS):
+        try:
+            _set_soft_limit(limit_type, resource.RLIM_INFINITY)
+        except (ValueError, OSError):
+            pass
+
+
+def wait_for_result(conn, pid, timeout=None, memory_limit_mb=None, poll_interval=0.25):
+    """(parent process) wait for a sandbox process to send its result, watching its wall time and
+    resident memory growth meanwhile.
+
+    Returns (result, killed): when a limit is exceeded the result is the resource error and
+    `killed` is True, the caller must then terminate the process.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    baseline = _read_statm_mb(pid) if memory_limit_mb else None
+    while True:
+        wait = poll_interval if deadline is None else max(0, min(poll_interval, deadline - time.monotonic()))
+        if conn.poll(wait):
+            return conn.recv(), False
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.warning(f"Sandbox execution exceeded {timeout}s, killing process {pid}")
+            return resource_exceeded_result('wall_time', timeout), True
+        if baseline is not None:
+            statm = _read_statm_mb(pid)
+            if statm is not None and statm[1] - baseline[1] > memory_limit_mb:
+                logger.warning(f"Sandbox execution exceeded {memory_limit_mb}MB, killing process {pid}")
+                return resource_exceeded_result('memory', memory_limit_mb), True
+
+
+def run_with_deadline(fn, timeout):
+    """run fn() in the current thread, interrupting it with ResourceExceeded('wall_time') if it is still
+    running after `timeout` seconds. The exception is raised between bytecodes, so a single long
+    running C call (e.g. one pandas operation) finishes before it is interrupted"""
+    if not timeout:
+        return fn()
+
+    thread_id = threading.get_ident()
+    state_lock = threading.Lock()
+    state = {'done': False}
+
+    def interrupt():
+        with state_lock:
+            if not state['done']:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(ResourceExceeded))
+
+    timer = threading.Timer(timeout, interrupt)
+    timer.daemon = True
+    timer.start()
+    try:
+        return fn()
+    finally:
+        # under the lock, so the exception can't be injected after we returned
+        with state_lock:
+            state['done'] = True
+        timer.cancel()
+
+
+def sandbox_limits_from_env():
+    """resource limits of sandboxed executions: wall time, CPU time and memory growth"""
+    return {
+        'timeout': float(os.getenv('SANDBOX_TASK_TIMEOUT', '120')),
+        'cpu_time_limit': float(os.getenv('SANDBOX_CPU_TIME_LIMIT', '60')),
+        'memory_limit_mb': float(os.getenv('SANDBOX_MEMORY_LIMIT_MB', '2048')),
+    }
+
+
+class SharedTable:
+    """reference to a DataFrame serialized as an Arrow IPC stream in a shared memory segment,
+    sent through the pipe instead of the pickled DataFrame"""
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+def _untrack_shared_memory(shm):
+    """(worker side) stop the resource tracker from unlinking a segment the worker created for the
+    parent, which unlinks it. The tracker process is shared with the parent, so segments the parent
+    created (inputs) must not be untracked here: the parent's unlink would no longer find them."""
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def dataframe_to_shared_memory(df, name=None):
+    """write a DataFrame into a new shared memory segment (named `name`, or a random name),
+    returns (SharedTable, SharedMemory)"""
+    table = pa.Table.from_pandas(df)
+    mock_sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock_sink, table.schema) as writer:
+        writer.write_table(table)
+    size = max(mock_sink.size(), 1)
+
+    shm = shared_memory.SharedMemory(create=True, size=size, name=name)
+    try:
+        buffer = pa.py_buffer(shm.buf)
+        with pa.ipc.new_stream(pa.FixedSizeBufferWriter(buffer), table.schema) as writer:
+            writer.write_table(table)
+        del buffer
+    except Exception:
+        shm.close()
+        shm.unlink()
+        raise
+    return SharedTable(shm.name, size), shm
+
+
+def dataframe_from_shared_memory(shared_table, unlink=False):
+    """read a DataFrame back from a shared memory segment without copying the arrow buffers,
+    the mapping stays open for as long as the DataFrame references it. The segment is left to
+    the process that created it unless `unlink`."""
+    shm = shared_memory.SharedMemory(name=shared_table.name)
+    address_view = ctypes.c_char.from_buffer(shm.buf)
+    address = ctypes.addressof(address_view)
+    del address_view
+    if unlink:
+        shm.unlink()  # the name goes away now, the memory once the last reference is dropped
+
+    # the buffer keeps `shm` alive, which closes the mapping when garbage collected
+    buffer = pa.foreign_buffer(address, shared_table.size, base=shm)
+    with pa.ipc.open_stream(buffer) as reader:
+        return reader.read_all().to_pandas()
+
+
+def unlink_shared_segments(prefix, skip=()):
+    """(parent process) remove the segments `<prefix>0`, `<prefix>1`, ... a worker created for its outputs
+    (except the names in `skip`, already unlinked when read), e.g. when it was killed before the parent read them"""
+    index = 0
+    while True:
+        name = f"{prefix}{index}"
+        index += 1
+        if name in skip:
+            continue
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return  # the worker creates them in order, none after the first missing one
+        shm.close()
+        shm.unlink()
+
+
+def _map_dataframes(value, fn):
+    """apply fn to a DataFrame value, or to the DataFrames in a list/tuple value"""
+    if isinstance(value, pd.DataFrame):
+        return fn(value)
+    if isinstance(value, (list, tuple)) and any(isinstance(v, pd.DataFrame) for v in value):
+        return type(value)(fn(v) if isinstance(v, pd.DataFrame) else v for v in value)
+    return value
+
+
+def _map_shared_tables(value, fn):
+    """apply fn to a SharedTable value, or to the SharedTables in a list/tuple value"""
+    if isinstance(value, SharedTable):
+        return fn(value)
+    if isinstance(value, (list, tuple)) and any(isinstance(v, SharedTable) for v in value):
+        return type(value)(fn(v) if isinstance(v, SharedTable) else v for v in value)
+    return value
+
+
+def pool_worker_main(conn):
+    """entry point of a pre-started sandbox worker: pre-imports pandas and installs the audit hook
+    before it is needed, then executes the one task it receives from the pipe (None to exit).
+    A worker never runs a second task: code can patch modules, builtins or classes of the process,
+    which would otherwise leak into the next (possibly another user's) execution."""
+    warnings.filterwarnings('ignore')
+    import json, numpy  # pre-warm the modules generated code usually imports
+    install_resource_exceeded_handler()
+    install_audit_hook()
+
+    try:
+        task = conn.recv()
+    except EOFError:
+        return
+    if task is None:
         conn.close()
-        return {key: extended_allowed_objects[key] for key in allowed_objects}
+        return
 
-    conn.send({'status': 'ok', 'allowed_objects': {key: extended_allowed_objects[key] for key in allowed_objects}})
+    code, allowed_objects, output_prefix, cpu_time_limit, memory_limit_mb = task
+    try:
+        allowed_objects = {key: _map_shared_tables(value, dataframe_from_shared_memory) for key, value in allowed_objects.items()}
+        sandbox_globals = { **allowed_objects }
+        apply_resource_limits(cpu_time_limit, memory_limit_mb)
+        try:
+            exec(code, sandbox_globals)
+        finally:
+            clear_resource_limits()
+        result = {'status': 'ok', 'allowed_objects': {key: sandbox_globals[key] for key in allowed_objects}}
+    except ResourceExceeded as err:
+        result = resource_exceeded_result(err.resource_name, cpu_time_limit)
+    except MemoryError:
+        result = resource_exceeded_result('memory', memory_limit_mb)
+    except Exception as err:
+        result = {'status': 'error', 'error_message': f"Error: {type(err).__name__} - {str(err)}"}
+    sandbox_globals = None
+
+    if output_prefix is not None and result['status'] == 'ok':
+        output_names = (f"{output_prefix}{index}" for index in itertools.count())
+        share_output = lambda df: _share_output_dataframe(df, next(output_names))
+        result['allowed_objects'] = {key: _map_dataframes(value, share_output) for key, value in result['allowed_objects'].items()}
+
+    try:
+        conn.send(result)
+    except Exception as err:
+        conn.send({'status': 'error', 'error_message': f"Error: {type(err).__name__} - {str(err)}"})
     conn.close()
 
 
+def _share_output_dataframe(df, name):
+    """(worker side) hand a result DataFrame over through shared memory, in a segment named by the
+    parent (see unlink_shared_segments), which unlinks it"""
+    try:
+        shared_table, shm = dataframe_to_shared_memory(df, name)
+    except Exception:
+        return df  # not representable in arrow (e.g. mixed type columns), pickle it instead
+    shm.close()
+    _untrack_shared_memory(shm)
+    return shared_table
+
+
+class SandboxWorker:
+    """a pre-started worker process with its pipe"""
+    def __init__(self):
+        # workers forked before the resource tracker is started would start their own, which unlinks
+        # the parent's input segments when the worker exits; with the parent's tracker running they share it
+        resource_tracker.ensure_running()
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=pool_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join(1)
+
+    def shutdown(self):
+        try:
+            self.conn.send(None)
+            self.process.join(1)
+        except Exception:
+            pass
+        self.kill()
+
+
+class SandboxWorkerPool:
+    """pool of pre-started sandbox processes, so executions don't wait for process spawn + imports.
+
+    Each worker runs a single task and is then replaced by a fresh one (started while the pool
+    serves other tasks), so no state of an execution survives into the next. Workers are killed
+    when a task runs longer than `task_timeout` or its resident memory grows by more than
+    `memory_limit_mb`; each task is also limited to `cpu_time_limit` CPU seconds and
+    `memory_limit_mb` more address space inside the worker.
+    """
+    def __init__(self, size=2, task_timeout=120, use_shared_memory=True, cpu_time_limit=60, memory_limit_mb=2048):
+        self.size = max(1, size)
+        # pass DataFrames both ways as Arrow IPC buffers in shared memory instead of pickling them
+        self.use_shared_memory = use_shared_memory and PYARROW_AVAILABLE
+        self.task_timeout = task_timeout
+        self.cpu_time_limit = cpu_time_limit
+        self.memory_limit_mb = memory_limit_mb
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def _ensure_started(self):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._idle.put(SandboxWorker())
+                self._started = True
+
+    def _replace(self, worker):
+        """dispose of a worker that ran a task and add a fresh one to the pool"""
+        worker.kill()
+        if not self._closed:
+            self._idle.put(SandboxWorker())
+
+    def run(self, code, allowed_objects, timeout=None):
+        """execute code in a pooled worker, returns the same result dict as subprocess_execute"""
+        self._ensure_started()
+        timeout = self.task_timeout if timeout is None else timeout
+
+        worker = self._idle.get()
+        if not worker.is_alive():
+            worker.kill()
+            worker = SandboxWorker()
+
+        input_segments = []
+        if self.use_shared_memory:
+            def share_input_dataframe(df):
+                try:
+                    shared_table, shm = dataframe_to_shared_memory(df)
+                except Exception:
+                    return df
+                input_segments.append(shm)
+                return shared_table
+            allowed_objects = {key: _map_dataframes(value, share_input_dataframe) for key, value in allowed_objects.items()}
+
+        # output segments get names chosen here, so that the ones of a killed worker can be removed
+        output_prefix = f"dfsb_{uuid.uuid4().hex[:12]}_" if self.use_shared_memory else None
+        outputs_read = set()
+        def read_output_dataframe(shared_table):
+            outputs_read.add(shared_table.name)
+            return dataframe_from_shared_memory(shared_table, unlink=True)
+
+        try:
+            worker.conn.send((code, allowed_objects, output_prefix, self.cpu_time_limit, self.memory_limit_mb))
+            result, _ = wait_for_result(worker.conn, worker.process.pid, timeout, self.memory_limit_mb)
+            if result['status'] == 'ok':
+                result['allowed_objects'] = {
+                    key: _map_shared_tables(value, read_output_dataframe)
+                    for key, value in result['allowed_objects'].items()
+                }
+        except (EOFError, OSError) as err:
+            result = {'status': 'error', 'error_message': f"Error: {type(err).__name__} - the sandbox process exited unexpectedly"}
+        except Exception as err:
+            result = {'status': 'error', 'error_message': f"Error: {type(err).__name__} - {str(err)}"}
+        finally:
+            for shm in input_segments:
+                shm.close()
+                shm.unlink()
+
+        self._replace(worker)
+        if output_prefix is not None:
+            unlink_shared_segments(output_prefix, outputs_read)
+        return result
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().shutdown()
+            except queue.Empty:
+                break
+
+
+_sandbox_pool = None
+_sandbox_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool():
+    """get the process-wide sandbox pool (None if disabled with SANDBOX_POOL_SIZE=0)"""
+    global _sandbox_pool
+    with _sandbox_pool_lock:
+        if _sandbox_pool is None:
+            size = int(os.getenv('SANDBOX_POOL_SIZE', '2'))
+            if size <= 0:
+                return None
+            limits = sandbox_limits_from_env()
+            _sandbox_pool = SandboxWorkerPool(
+                size=size,
+                task_timeout=limits['timeout'],
+                use_shared_memory=os.getenv('SANDBOX_SHARED_MEMORY', 'true').lower() == 'true',
+                cpu_time_limit=limits['cpu_time_limit'],
+                memory_limit_mb=limits['memory_limit_mb']
+            )
+            atexit.register(_sandbox_pool.shutdown)
+        return _sandbox_pool
+
+
 def run_in_subprocess(code, allowed_objects):
+    """run the code in a pooled sandbox process (or a fresh one if the pool is disabled)"""
+    pool = get_sandbox_pool()
+    if pool is not None:
+        return pool.run(code, allowed_objects)
+    return run_in_fresh_subprocess(code, allowed_objects)
+
+
+def run_in_fresh_subprocess(code, allowed_objects):
+    limits = sandbox_limits_from_env()
     sandbox_locals = { **allowed_objects }
     parent_conn, child_conn = Pipe()
-    p = Process(target=subprocess_execute, args=(code, sandbox_locals, child_conn))
+    p = Process(target=subprocess_execute, args=(code, sandbox_locals, child_conn, limits['cpu_time_limit'], limits['memory_limit_mb']))
     p.start()
+    child_conn.close()
 
     ## NOTE: The sandbox is probably safe against file writing, as well as against access into the main process.
     ## Yet the objects returned from it as results could have been manipulated. Asserting the output objects to be 
     ## of expected data types is an extra safety measure. But be careful whenever your main program flow is 
     ## controlled by the returned objects' attributes, e.g. file paths could change. 
-    result = parent_conn.recv()
+    try:
+        result, killed = wait_for_result(parent_conn, p.pid, limits['timeout'], limits['memory_limit_mb'])
+    except (EOFError, OSError) as err:
+        result, killed = {'status': 'error', 'error_message': f"Error: {type(err).__name__} - the sandbox process exited unexpectedly"}, True
+    if killed and p.is_alive():
+        p.kill()
     p.join()
     return result
 
@@ -64,6 +563,8 @@ def run_in_main_process(code, allowed_objects):
         faster than subprocess, but may crash the main process if the code is malicious
     code: script to execute
     allowed_objects: objects exposed to the target code
+
+    Only the wall time limit (SANDBOX_TASK_TIMEOUT) applies here, CPU and memory limits need a sandbox process.
     """
     warnings.filterwarnings('ignore')
 
@@ -103,8 +604,13 @@ def run_in_main_process(code, allowed_objects):
         **allowed_objects
     }
 
+    timeout = sandbox_limits_from_env()['timeout']
     try:
-        exec(code, restricted_globals)
+        run_with_deadline(lambda: exec(code, restricted_globals), timeout)
+    except ResourceExceeded:
+        return resource_exceeded_result('wall_time', timeout)
+    except MemoryError:
+        return resource_exceeded_result('memory')
     except Exception as err:
         error_message = f"Error: {type(err).__name__} - {str(err)}"
         return {'status': 'error', 'error_message': error_message}
@@ -140,7 +646,8 @@ output_df = transform_data(*df_list)
     else:
         return {
             'status': 'error',
-            'content': result['error_message']
+            'content': result['error_message'],
+            'error_type': result.get('error_type')
         }
 
 
@@ -168,4 +675,4 @@ new_column = derive_new_column(df)
         result_df[output_field_name] = result['allowed_objects']['new_column']
         return { 'status': 'ok', 'content': result_df }
     else:
-        return { 'status': 'error', 'content': result['error_message'] }
\ No newline at end of file
+        return { 'status': 'error', 'content': result['error_message'], 'error_type': result.get('error_type') }
\ No newline at end of file
@@ -0,0 +1,272 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import contextvars
+import functools
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import duckdb
+from flask import has_request_context, request, session
+
+from data_formulator.db_manager import db_manager
+
+logger = logging.getLogger(__name__)
+
+# seconds a table request or an agent's sql statement may run before it is interrupted (0 for no limit)
+STATEMENT_TIMEOUT = float(os.getenv('SQL_STATEMENT_TIMEOUT', '60'))
+
+# seconds of silence after which streaming responses write a heartbeat, to notice disconnected clients
+STREAM_HEARTBEAT_INTERVAL = 5.0
+
+# (session id, request id) the statements run on behalf of, set for the duration of a request
+_request_scope: contextvars.ContextVar = contextvars.ContextVar('query_request_scope', default=(None, None))
+
+
+class QueryCancelled(Exception):
+    """A query was interrupted, because its request was cancelled or it ran past its deadline"""
+
+
+class _RunningQuery:
+    def __init__(self, conn, session_id: Optional[str], request_id: Optional[str], timeout: Optional[float]):
+        self.conn = conn
+        self.session_id = session_id
+        self.request_id = request_id
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        # why the query was interrupted, None while it wasn't
+        self.reason: Optional[str] = None
+
+
+def get_request_id() -> Optional[str]:
+    """Id the client gave to the current request (X-Request-Id header or request_id argument), used to cancel it"""
+    if not has_request_context():
+        return None
+    request_id = request.headers.get('X-Request-Id') or request.args.get('request_id')
+    if not request_id and request.is_json:
+        request_id = (request.get_json(silent=True) or {}).get('request_id')
+    return str(request_id) if request_id else None
+
+
+class QueryWatchdog:
+    """Interrupts DuckDB statements that run past their deadline or whose request was cancelled.
+
+    Statements are tracked per cursor (`track`); a background thread calls `interrupt()` on the
+    cursor when its deadline passes, or when its request is cancelled in any worker process
+    (cancellations go through the session registry).
+    """
+    def __init__(self, poll_interval: float = 0.1, cancel_poll_interval: float = 0.5):
+        self.poll_interval = poll_interval
+        self.cancel_poll_interval = cancel_poll_interval
+        self._queries: List[_RunningQuery] = []
+        self._lock = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"timeouts": 0, "cancellations": 0}
+
+    @contextmanager
+    def request_scope(self, session_id: Optional[str], request_id: Optional[str]):
+        """Statements tracked in this scope (and this thread) belong to the given request"""
+        token = _request_scope.set((session_id, request_id))
+        try:
+            yield
+        finally:
+            _request_scope.reset(token)
+
+    @contextmanager
+    def track(self, conn, timeout: Optional[float] = None, session_id: Optional[str] = None, request_id: Optional[str] = None):
+        """Track the statements run on `conn` in this context: they are interrupted after `timeout`
+        seconds (None for no deadline) or when the request is cancelled, raising QueryCancelled.
+
+        The session and request default to the current request scope."""
+        scope_session_id, scope_request_id = _request_scope.get()
+        session_id = session_id or scope_session_id
+        request_id = request_id or scope_request_id
+        if request_id and self.is_cancelled(session_id, request_id):
+            raise QueryCancelled("The request was cancelled")
+
+        entry = _RunningQuery(conn, session_id, request_id, timeout)
+        with self._lock:
+            self._queries.append(entry)
+            self._start()
+            self._lock.notify_all()
+        try:
+            yield entry
+        except duckdb.InterruptException as e:
+            reason = self._interrupt_reason(conn)
+            if reason:
+                raise QueryCancelled(reason) from e
+            raise
+        finally:
+            with self._lock:
+                self._queries.remove(entry)
+
+    def cancel(self, session_id: str, request_id: str) -> int:
+        """Cancel a request: interrupt its running statements in this process, and record it for the
+        other processes and the statements it starts later. Returns the number of statements interrupted here."""
+        try:
+            db_manager.get_registry().cancel_request(session_id, request_id)
+        except Exception as e:
+            logger.warning(f"Could not record the cancellation of request {request_id}: {e}")
+        return self._interrupt_request(session_id, request_id)
+
+    def is_cancelled(self, session_id: Optional[str], request_id: str) -> bool:
+        try:
+            return db_manager.get_registry().is_request_cancelled(session_id or "", request_id)
+        except Exception:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"running": len(self._queries), **self._stats}
+
+    def _interrupt_request(self, session_id: str, request_id: str) -> int:
+        interrupted = 0
+        with self._lock:
+            for entry in self._queries:
+                if entry.request_id == request_id and entry.session_id == session_id and entry.reason is None:
+                    self._interrupt(entry, "The query was cancelled")
+                    self._stats["cancellations"] += 1
+                    interrupted += 1
+        return interrupted
+
+    def _interrupt(self, entry: _RunningQuery, reason: str):
+        entry.reason = reason
+        try:
+            entry.conn.interrupt()
+        except Exception as e:
+            logger.warning(f"Could not interrupt a query: {e}")
+
+    def _interrupt_reason(self, conn) -> Optional[str]:
+        with self._lock:
+            for entry in self._queries:
+                if entry.conn is conn and entry.reason:
+                    return entry.reason
+        return None
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="query-watchdog", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        last_cancel_check = time.time()
+        while True:
+            with self._lock:
+                while not self._queries:
+                    self._lock.wait()
+                now = time.monotonic()
+                for entry in self._queries:
+                    if entry.deadline is not None and entry.reason is None and now >= entry.deadline:
+                        self._interrupt(entry, f"The query exceeded its {entry.timeout:.0f}s time limit and was stopped")
+                        self._stats["timeouts"] += 1
+                    elif entry.reason is not None:
+                        # keep interrupting, the request may run further statements on the connection
+                        self._interrupt(entry, entry.reason)
+                requests = {(entry.session_id, entry.request_id) for entry in self._queries if entry.request_id and entry.reason is None}
+                self._lock.wait(self.poll_interval)
+
+            # cancellations received by other worker processes
+            if requests and time.time() - last_cancel_check >= self.cancel_poll_interval:
+                since, last_cancel_check = last_cancel_check - self.cancel_poll_interval, time.time()
+                try:
+                    cancelled = db_manager.get_registry().cancelled_requests(since)
+                except Exception as e:
+                    logger.warning(f"Could not check for cancelled requests: {e}")
+                    continue
+                for session_id, request_id in requests & cancelled:
+                    self._interrupt_request(session_id, request_id)
+
+
+query_watchdog = QueryWatchdog()
+
+
+@contextmanager
+def guarded_connection(session_id: str, timeout: Optional[float] = STATEMENT_TIMEOUT):
+    """Connection of a session whose statements in this context are interrupted after `timeout`
+    seconds (None or 0 for no limit) or when the current request is cancelled"""
+    request_id = get_request_id()
+    with db_manager.connection(session_id) as conn:
+        with query_watchdog.request_scope(session_id, request_id), \
+                query_watchdog.track(conn, timeout=timeout or None, session_id=session_id, request_id=request_id):
+            yield conn
+
+
+class _StreamError:
+    """An exception raised by a streamed generator, passed on to the response thread"""
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def cancellable(view):
+    """Decorator of flask views whose statements (tracked with query_watchdog.track) should be
+    cancellable through the request's id. Streaming views use stream_with_cancellation instead."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with query_watchdog.request_scope(session.get('session_id'), get_request_id()):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def stream_with_cancellation(generator: Iterator, session_id: Optional[str], request_id: Optional[str],
+                             heartbeat: Optional[str] = "\n", heartbeat_interval: float = STREAM_HEARTBEAT_INTERVAL) -> Iterator:
+    """Run a streaming response's generator in a worker thread and pass its items on, writing
+    `heartbeat` after `heartbeat_interval` seconds of silence (e.g. while a query runs).
+
+    When the client disconnects, the server fails to write and closes this generator; the
+    request's statements are then cancelled and the worker thread stops at the next item.
+    """
+    items: queue.Queue = queue.Queue(maxsize=1)
+    stopped = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def pump():
+        with query_watchdog.request_scope(session_id, request_id):
+            try:
+                for item in generator:
+                    if not put(item):
+                        break
+                else:
+                    put(finished)
+            except BaseException as e:
+                put(_StreamError(e))
+            finally:
+                if hasattr(generator, 'close'):
+                    generator.close()
+
+    thread = threading.Thread(target=pump, name="stream-pump", daemon=True)
+    thread.start()
+    completed = False
+    try:
+        while True:
+            try:
+                item = items.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                if heartbeat is not None:
+                    yield heartbeat
+                continue
+            if item is finished:
+                completed = True
+                return
+            if isinstance(item, _StreamError):
+                completed = True
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        if not completed and session_id and request_id:
+            logger.info(f"Client disconnected, cancelling request {request_id}")
+            query_watchdog.cancel(session_id, request_id)
@@ -0,0 +1,124 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from data_formulator.db_manager import db_manager
+
+logger = logging.getLogger(__name__)
+
+# version counters of a session that aren't tables: bumped when the whole session changes
+# (db file uploaded or reset, data loader ingests), and on any change (what views depend on)
+SESSION_VERSION = "__session__"
+ANY_TABLE_VERSION = "__any__"
+
+
+def normalize_query(query: str) -> str:
+    """Query text with whitespace collapsed, so queries assembled with different spacing share entries"""
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class ResultCache:
+    """LRU cache of serialized query results (response bodies), bounded in entries and bytes.
+
+    Entries are keyed by the normalized query text, its parameters and the version counters
+    of the table it reads. Counters live in the session registry, so a change made through
+    any worker process is seen by all of them: create, delete and ingest bump the table's
+    counter (bump_table), uploads and resets of the db file the session's (invalidate_session).
+    Results of views are keyed on the counter of all the session's tables, since a view
+    reads other tables.
+    """
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (value, size); keys start with (session id, name of the version counter, ...)
+        self._entries: "OrderedDict[tuple, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def is_enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def version_counters(self, session_id: str, table_name: str, is_view: bool) -> tuple:
+        """(name of the counter, its version, the session's version) a table's data depends on;
+        a view's is the counter of all the session's tables, since it reads other tables"""
+        return self.table_version_counters(session_id, {table_name: is_view})[table_name]
+
+    def table_version_counters(self, session_id: str, tables: Dict[str, bool]) -> Dict[str, tuple]:
+        """version_counters of several tables (name -> is view), with one registry query"""
+        counters = {table_name: ANY_TABLE_VERSION if is_view else table_name for table_name, is_view in tables.items()}
+        versions = db_manager.get_registry().table_versions(session_id, list({*counters.values(), SESSION_VERSION}))
+        return {table_name: (counter, versions[counter], versions[SESSION_VERSION]) for table_name, counter in counters.items()}
+
+    def make_key(self, session_id: str, table_name: str, is_view: bool, query: str, params=(), *extra) -> tuple:
+        """Cache key of a query on a table, with the table's current version counters"""
+        counter, version, session_version = self.version_counters(session_id, table_name, is_view)
+        return (session_id, counter, table_name, version, session_version,
+                normalize_query(query), tuple(params), *extra)
+
+    def get(self, key: tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: tuple, value: Any, size: int):
+        """Store a result of `size` bytes, evicting the least recently used ones to stay in bounds"""
+        if not self.is_enabled() or size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def bump_table(self, session_id: str, table_name: str):
+        """A table was created, replaced, deleted or had rows added: bump its counter (and the one views depend on)"""
+        db_manager.get_registry().bump_table_versions(session_id, [table_name, ANY_TABLE_VERSION])
+        self._drop(session_id, {table_name, ANY_TABLE_VERSION})
+
+    def invalidate_session(self, session_id: str):
+        """All tables of a session may have changed"""
+        db_manager.get_registry().bump_table_versions(session_id, [SESSION_VERSION, ANY_TABLE_VERSION])
+        self._drop(session_id)
+
+    def _drop(self, session_id: str, counters: Optional[set] = None):
+        """Free the entries made stale by a version bump (they would only age out of the LRU otherwise)"""
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[0] == session_id and (counters is None or key[1] in counters)]
+            for key in stale_keys:
+                self._bytes -= self._entries.pop(key)[1]
+            self._stats["invalidations"] += len(stale_keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups > 0 else 0.0,
+            }
+
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1024')),
+    max_bytes=int(float(os.getenv('RESULT_CACHE_MAX_MB', '64')) * 1024 * 1024)
+)
@@ -0,0 +1,251 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # windows: locks only coordinate the threads of one process, run a single worker there
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def private_dir(parent: str) -> str:
+    """A directory under `parent` only the current user can access (e.g. for files with secrets
+    when `parent` is the shared temp directory), created if needed"""
+    if not hasattr(os, 'getuid'):
+        # windows: the temp directory is already per user
+        return parent
+    path = os.path.join(parent, f"df_private_{os.getuid()}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    # another user may have created it first
+    if os.lstat(path).st_uid != os.getuid() or not os.path.isdir(path) or os.path.islink(path):
+        raise PermissionError(f"{path} is not a directory of the current user")
+    os.chmod(path, 0o700)
+    return path
+
+
+class SessionLockTimeout(Exception):
+    """The session database stayed locked by another worker process for too long"""
+
+
+class InterProcessLock:
+    """Exclusive lock on a file, shared by all worker processes of the app (flock).
+
+    Within a process it is counted rather than owned by a thread: the first acquire takes
+    the file lock and the last release frees it, since the threads of a process share the
+    same DuckDB database instance anyway.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float, on_wait: Optional[Callable[[], None]] = None, poll_interval: float = 0.05) -> bool:
+        """Take the lock, waiting up to `timeout` seconds for other processes to release it.
+        `on_wait` is called once if the lock is held by another process. Returns False on timeout."""
+        with self._lock:
+            if self._count > 0:
+                self._count += 1
+                return True
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            deadline = time.monotonic() + timeout
+            waited = False
+            while FCNTL_AVAILABLE:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        os.close(fd)
+                        return False
+                    if not waited and on_wait is not None:
+                        on_wait()
+                    waited = True
+                    time.sleep(poll_interval)
+            self._fd = fd
+            self._count = 1
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._count == 0:
+                return
+            self._count -= 1
+            if self._count == 0:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+
+    def is_held(self) -> bool:
+        return self._count > 0
+
+
+class SessionRegistry:
+    """Session id -> db file mapping shared by the worker processes of the app, stored in sqlite.
+
+    Besides the db files it keeps each session's last access time (for the janitor), the
+    sessions other processes are waiting to open (handoff requests) and the flask secret key,
+    which must be the same in all workers for their session cookies to be accepted everywhere.
+    The sqlite file is only readable by the current user since it holds that key.
+
+    With the path ":memory:" the registry is private to the process and nothing is written to disk.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+        # an in-memory database is only visible to its connection, which all threads share then
+        self._memory_conn: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self.path == ":memory:":
+            with self._init_lock:
+                if self._memory_conn is None:
+                    self._memory_conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+                    self._create_tables(self._memory_conn)
+            return self._memory_conn
+        conn = getattr(self._local, 'conn', None)
+        # sqlite connections must not be shared with forked worker processes
+        if conn is None or self._local.pid != os.getpid():
+            if not self._initialized:
+                # sqlite creates the -wal and -shm files with the permissions of the database file
+                os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+                os.chmod(self.path, 0o600)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    self._create_tables(conn)
+                    self._initialized = True
+        return conn
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, db_file TEXT NOT NULL, last_access REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS handoff_requests (session_id TEXT PRIMARY KEY, pid INTEGER, requested_at REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS table_versions (session_id TEXT, table_name TEXT, version INTEGER, "
+                     "PRIMARY KEY (session_id, table_name))")
+        conn.execute("CREATE TABLE IF NOT EXISTS dataset_refs (session_id TEXT, table_name TEXT, dataset_key TEXT, "
+                     "PRIMARY KEY (session_id, table_name))")
+        conn.execute("CREATE TABLE IF NOT EXISTS cancelled_requests (session_id TEXT, request_id TEXT, cancelled_at REAL, "
+                     "PRIMARY KEY (session_id, request_id))")
+
+    def get_db_file(self, session_id: str) -> Optional[str]:
+        row = self._conn().execute("SELECT db_file FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_db_file(self, session_id: str, db_file: str):
+        self._conn().execute(
+            "INSERT INTO sessions (session_id, db_file, last_access) VALUES (?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET db_file = excluded.db_file",
+            (session_id, db_file, time.time()))
+
+    def register(self, session_id: str, db_file: str) -> str:
+        """Register `db_file` for the session unless another process registered one first, returns the session's db file"""
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO sessions (session_id, db_file) VALUES (?, ?)", (session_id, db_file))
+        return self.get_db_file(session_id)
+
+    def remove(self, session_id: str, keep_dataset_refs: bool = False):
+        """Forget a session; `keep_dataset_refs` keeps its references to stored datasets (e.g. it was archived)"""
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        if not keep_dataset_refs:
+            conn.execute("DELETE FROM dataset_refs WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM table_versions WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM handoff_requests WHERE session_id = ?", (session_id,))
+
+    def sessions(self) -> Dict[str, str]:
+        return dict(self._conn().execute("SELECT session_id, db_file FROM sessions").fetchall())
+
+    def touch(self, session_id: str, timestamp: float):
+        self._conn().execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (timestamp, session_id))
+
+    def count_active(self, since: float) -> int:
+        """Number of sessions accessed after `since`"""
+        return self._conn().execute("SELECT COUNT(*) FROM sessions WHERE last_access > ?", (since,)).fetchone()[0]
+
+    def last_access(self, session_id: str) -> Optional[float]:
+        row = self._conn().execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def request_handoff(self, session_id: str):
+        """Ask the process holding the session's db file to release it once idle"""
+        self._conn().execute("INSERT OR REPLACE INTO handoff_requests VALUES (?, ?, ?)", (session_id, os.getpid(), time.time()))
+
+    def clear_handoff(self, session_id: str):
+        self._conn().execute("DELETE FROM handoff_requests WHERE session_id = ? AND pid = ?", (session_id, os.getpid()))
+
+    def handoff_requests(self, max_age: float) -> Set[str]:
+        """Sessions other processes are waiting for (requests older than `max_age` seconds were given up)"""
+        rows = self._conn().execute("SELECT session_id FROM handoff_requests WHERE pid != ? AND requested_at > ?",
+                                    (os.getpid(), time.time() - max_age)).fetchall()
+        return {row[0] for row in rows}
+
+    def bump_table_versions(self, session_id: str, table_names: List[str]):
+        """Increment the version counters of tables of a session"""
+        self._conn().executemany(
+            "INSERT INTO table_versions VALUES (?, ?, 1) ON CONFLICT (session_id, table_name) DO UPDATE SET version = version + 1",
+            [(session_id, table_name) for table_name in table_names])
+
+    def table_versions(self, session_id: str, table_names: List[str]) -> Dict[str, int]:
+        """Version counters of tables of a session (0 for tables never bumped)"""
+        placeholders = ", ".join("?" for _ in table_names)
+        rows = self._conn().execute(
+            f"SELECT table_name, version FROM table_versions WHERE session_id = ? AND table_name IN ({placeholders})",
+            (session_id, *table_names)).fetchall()
+        versions = {table_name: 0 for table_name in table_names}
+        versions.update(dict(rows))
+        return versions
+
+    def add_dataset_ref(self, session_id: str, table_name: str, dataset_key: str):
+        """Record that a table of a session is a view of a stored dataset"""
+        self._conn().execute("INSERT OR REPLACE INTO dataset_refs VALUES (?, ?, ?)", (session_id, table_name, dataset_key))
+
+    def remove_dataset_refs(self, session_id: str, table_name: Optional[str] = None):
+        """Drop the dataset reference of a table of a session (of all its tables if `table_name` is None)"""
+        if table_name is None:
+            self._conn().execute("DELETE FROM dataset_refs WHERE session_id = ?", (session_id,))
+        else:
+            self._conn().execute("DELETE FROM dataset_refs WHERE session_id = ? AND table_name = ?", (session_id, table_name))
+
+    def dataset_ref_counts(self) -> Dict[str, int]:
+        """Number of session tables referencing each stored dataset"""
+        return dict(self._conn().execute("SELECT dataset_key, COUNT(*) FROM dataset_refs GROUP BY dataset_key").fetchall())
+
+    def cancel_request(self, session_id: str, request_id: str, ttl: float = 3600):
+        """Record that a request was cancelled, for the process running it (records older than `ttl` seconds are pruned)"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM cancelled_requests WHERE cancelled_at < ?", (now - ttl,))
+        conn.execute("INSERT OR REPLACE INTO cancelled_requests VALUES (?, ?, ?)", (session_id, request_id, now))
+
+    def is_request_cancelled(self, session_id: str, request_id: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM cancelled_requests WHERE session_id = ? AND request_id = ?",
+                                    (session_id, request_id)).fetchone() is not None
+
+    def cancelled_requests(self, since: float) -> Set[tuple]:
+        """(session id, request id) of the requests cancelled after `since`"""
+        return set(self._conn().execute("SELECT session_id, request_id FROM cancelled_requests WHERE cancelled_at >= ?",
+                                        (since,)).fetchall())
+
+    def shared_secret_key(self) -> str:
+        """A secret key created by the first process and shared by all of them"""
+        conn = self._conn()
+        conn.execute("INSERT OR IGNORE INTO settings VALUES ('secret_key', ?)", (secrets.token_hex(16),))
+        return conn.execute("SELECT value FROM settings WHERE key = 'secret_key'").fetchone()[0]
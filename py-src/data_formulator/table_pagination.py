@@ -0,0 +1,134 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import base64
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from data_formulator.arrow_utils import PYARROW_AVAILABLE, fetch_arrow_table
+from data_formulator.table_profiler import quote_identifier, estimate_row_count
+
+logger = logging.getLogger(__name__)
+
+# views of a stored dataset (see DatasetStore.create_view) and of an example dataset (see ExampleCatalog.create_view)
+_PARQUET_VIEW_PATTERN = re.compile(r"^CREATE VIEW \S+ AS SELECT \* FROM read_parquet\(('(?:[^']|'')*')\);?$")
+_TABLE_VIEW_PATTERN = re.compile(r'^CREATE VIEW \S+ AS SELECT \* FROM ("?\w+"?\.main\.\w+);?$')
+
+
+class InvalidCursorError(ValueError):
+    """The cursor is malformed or was issued for another table or sort order"""
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    """Opaque, url safe cursor string"""
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise InvalidCursorError("Invalid pagination cursor")
+    if not isinstance(payload, dict):
+        raise InvalidCursorError("Invalid pagination cursor")
+    return payload
+
+
+def _key_value(value):
+    """keys are sent back as strings and cast to the column type, so any type round trips through json"""
+    return None if value is None else str(value)
+
+
+def _ordinal_scan(conn, table_name: str, column_names=()) -> Optional[Tuple[str, str, str]]:
+    """(scan, ordinal column, select list) reading a table in storage order with a filterable row
+    ordinal: the rowid of tables, and of the table behind an example dataset view, or the row number
+    in the parquet file of a stored dataset view. None for other views.
+    """
+    if estimate_row_count(conn, table_name) is not None:
+        return table_name, "rowid", "*"
+    row = conn.execute(
+        "SELECT sql FROM duckdb_views() WHERE view_name = ? AND database_name = current_database() AND schema_name = current_schema()",
+        [table_name]
+    ).fetchone()
+    view_sql = row[0].strip() if row and row[0] else ""
+    match = _PARQUET_VIEW_PATTERN.match(view_sql)
+    if match and "file_row_number" not in column_names:
+        return f"read_parquet({match.group(1)}, file_row_number = true)", "file_row_number", "* EXCLUDE (file_row_number)"
+    match = _TABLE_VIEW_PATTERN.match(view_sql)
+    if match:
+        return match.group(1), "rowid", "*"
+    return None
+
+
+def fetch_page(conn, table_name: str, columns: List[Tuple[str, str]], page_size: int,
+               cursor: Optional[str] = None, sort_by: Optional[List[str]] = None):
+    """Fetch the page of a table following `cursor` (the first page if empty) with keyset pagination,
+    so the cost of a page doesn't grow with its depth.
+
+    Pages are keyed on the `sort_by` columns when given (they should identify rows uniquely and be
+    non null, otherwise rows tied at a page boundary may be skipped), else on the row ordinal of
+    tables and dataset views (see _ordinal_scan); other views without a sort key fall back to offsets.
+
+    Args:
+        columns: (name, type) of the table columns, for the key values to be cast back to their type
+    Returns:
+        (page rows as an arrow table or a DataFrame if pyarrow is missing, next cursor or None)
+    """
+    column_types = {name: col_type for name, col_type in columns}
+    sort_by = [field for field in (sort_by or []) if field in column_types]
+    scan = None
+    if sort_by:
+        mode = 'key'
+    else:
+        scan = _ordinal_scan(conn, table_name, column_types)
+        mode = 'rowid' if scan is not None else 'offset'
+
+    position = None
+    if cursor:
+        payload = decode_cursor(cursor)
+        if payload.get('t') != table_name or payload.get('m') != mode or payload.get('s', []) != sort_by:
+            raise InvalidCursorError("The pagination cursor was issued for another table or sort order")
+        position = payload.get('p')
+
+    params = []
+    if mode == 'key':
+        order_by = ", ".join(quote_identifier(field) for field in sort_by)
+        where_clause = ""
+        if position is not None:
+            placeholders = ", ".join(f"CAST(? AS {column_types[field]})" for field in sort_by)
+            where_clause = f"WHERE ({order_by}) > ({placeholders})"
+            params = list(position)
+        query = f"SELECT * FROM {table_name} {where_clause} ORDER BY {order_by} LIMIT {int(page_size) + 1}"
+    elif mode == 'rowid':
+        # ordinal filters are pushed into the scan, skipping row groups before the cursor
+        source, ordinal, select_list = scan
+        where_clause = f"WHERE {ordinal} > ?" if position is not None else ""
+        params = [int(position)] if position is not None else []
+        query = f"SELECT {ordinal} AS __df_rowid, {select_list} FROM {source} {where_clause} ORDER BY {ordinal} LIMIT {int(page_size) + 1}"
+    else:
+        query = f"SELECT * FROM {table_name} LIMIT {int(page_size) + 1} OFFSET {int(position or 0)}"
+
+    result = conn.execute(query, params)
+    page = fetch_arrow_table(result) if PYARROW_AVAILABLE else result.fetchdf()
+
+    has_more = len(page) > page_size
+    page = page.slice(0, page_size) if PYARROW_AVAILABLE else page.iloc[:page_size]
+
+    next_position = None
+    if has_more:
+        if mode == 'key':
+            last_row = page.slice(len(page) - 1, 1).to_pylist()[0] if PYARROW_AVAILABLE else page.iloc[-1].to_dict()
+            next_position = [_key_value(last_row[field]) for field in sort_by]
+        elif mode == 'rowid':
+            next_position = int(page.column('__df_rowid')[-1].as_py()) if PYARROW_AVAILABLE else int(page['__df_rowid'].iloc[-1])
+        else:
+            next_position = int(position or 0) + page_size
+
+    if mode == 'rowid':
+        page = page.drop_columns(['__df_rowid']) if PYARROW_AVAILABLE else page.drop(columns=['__df_rowid'])
+
+    next_cursor = encode_cursor({'t': table_name, 'm': mode, 's': sort_by, 'p': next_position}) if has_more else None
+    return page, next_cursor
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# column types that get min/max/avg statistics
+NUMERIC_TYPES = ['INTEGER', 'DOUBLE', 'DECIMAL']
+
+# above this many rows, distinct counts are approximated (HyperLogLog) unless asked otherwise
+APPROX_DISTINCT_ROW_THRESHOLD = 1_000_000
+
+
+def quote_identifier(name: str) -> str:
+    """Quote a column name to be used in DuckDB queries"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def estimate_row_count(conn, table_name: str) -> Optional[int]:
+    """Row count estimate from the catalog (no scan), None for views or unknown tables"""
+    row = conn.execute(
+        "SELECT estimated_size FROM duckdb_tables() WHERE table_name = ? AND database_name = current_database() AND schema_name = current_schema()",
+        [table_name]
+    ).fetchone()
+    return row[0] if row else None
+
+
+def profile_table(conn, table_name: str, columns: Optional[List[tuple]] = None,
+                  approximate_distinct: Optional[bool] = None) -> List[Dict[str, Any]]:
+    """Compute count, distinct count, null count (and min/max/avg for numeric columns) of all
+    columns of a table with a single aggregate query.
+
+    Args:
+        conn: duckdb connection
+        table_name: table or view to profile (already sanitized)
+        columns: result of DESCRIBE on the table, queried if not provided
+        approximate_distinct: use approx_count_distinct instead of COUNT(DISTINCT); when None it is
+            enabled for tables larger than APPROX_DISTINCT_ROW_THRESHOLD rows
+
+    Returns:
+        list of {"column", "type", "statistics"} dicts in column order
+    """
+    if columns is None:
+        columns = conn.execute(f"DESCRIBE {table_name}").fetchall()
+
+    if approximate_distinct is None:
+        try:
+            estimated_rows = estimate_row_count(conn, table_name)
+        except Exception:
+            estimated_rows = None
+        approximate_distinct = estimated_rows is not None and estimated_rows > APPROX_DISTINCT_ROW_THRESHOLD
+
+    select_parts = ["COUNT(*)"]
+    for col in columns:
+        quoted_col_name = quote_identifier(col[0])
+        if approximate_distinct:
+            select_parts.append(f"approx_count_distinct({quoted_col_name})")
+        else:
+            select_parts.append(f"COUNT(DISTINCT {quoted_col_name})")
+        select_parts.append(f"COUNT({quoted_col_name})")
+        if col[1] in NUMERIC_TYPES:
+            select_parts.append(f"MIN({quoted_col_name})")
+            select_parts.append(f"MAX({quoted_col_name})")
+            select_parts.append(f"AVG({quoted_col_name})")
+
+    values = list(conn.execute(f"SELECT {', '.join(select_parts)} FROM {table_name}").fetchone())
+
+    count = values.pop(0)
+    profile = []
+    for col in columns:
+        col_name, col_type = col[0], col[1]
+        unique_count = values.pop(0)
+        non_null_count = values.pop(0)
+        stats_dict = {
+            "count": count,
+            "unique_count": unique_count,
+            "null_count": count - non_null_count,
+        }
+        if col_type in NUMERIC_TYPES:
+            stats_dict["min"] = values.pop(0)
+            stats_dict["max"] = values.pop(0)
+            stats_dict["avg"] = values.pop(0)
+        profile.append({
+            "column": col_name,
+            "type": col_type,
+            "statistics": stats_dict
+        })
+    return profile
+
+
+def sample_distinct_values(conn, table_name: str, column_names: List[str], sample_size: int) -> Dict[str, List[Any]]:
+    """Get up to `sample_size` distinct non-null values of each column in one round trip"""
+    if not column_names:
+        return {}
+    subqueries = []
+    for i, col_name in enumerate(column_names):
+        quoted_col_name = quote_identifier(col_name)
+        subqueries.append(f"""
+            (SELECT {i} as col_index, CAST(val AS VARCHAR) as val FROM (
+                SELECT DISTINCT {quoted_col_name} as val
+                FROM {table_name}
+                WHERE {quoted_col_name} IS NOT NULL
+                LIMIT {int(sample_size)}))""")
+    rows = conn.execute(" UNION ALL ".join(subqueries)).fetchall()
+
+    samples = {col_name: [] for col_name in column_names}
+    for col_index, val in rows:
+        samples[column_names[col_index]].append(val)
+    return samples
@@ -0,0 +1,87 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+from data_formulator.agents.agent_sql_data_transform import sanitize_table_name
+from data_formulator.table_versions import get_table_version_key, get_table_version_keys
+from data_formulator.arrow_utils import PYARROW_AVAILABLE, fetch_arrow_table
+
+logger = logging.getLogger(__name__)
+
+
+class TableRefError(ValueError):
+    """A table reference can't be resolved (unknown table or outdated version)"""
+
+
+def is_table_ref(input_table: Dict[str, Any]) -> bool:
+    """Whether an agent input table is a reference to a session table rather than inline rows,
+    i.e. {"name": ..., "table_ref": {"table_name": ..., "version": ...}, "attached_metadata": ...}"""
+    return isinstance(input_table.get('table_ref'), dict)
+
+
+def get_table_version(conn, table_name: str) -> Optional[str]:
+    """Short token identifying the current version of a table, it changes whenever the table is
+    recreated, altered, its row count changes or a route modifies it (None if it can't be determined)"""
+    version_key = get_table_version_key(conn, table_name)
+    if version_key is None:
+        return None
+    return _version_token(version_key)
+
+
+def get_table_versions(conn, table_names: List[str]) -> Dict[str, Optional[str]]:
+    """get_table_version of several tables at once (one catalog and one registry query)"""
+    version_keys = get_table_version_keys(conn, table_names)
+    return {table_name: _version_token(version_keys[table_name]) if table_name in version_keys else None
+            for table_name in table_names}
+
+
+def _version_token(version_key: tuple) -> str:
+    return hashlib.sha1(repr(version_key).encode('utf-8')).hexdigest()[:16]
+
+
+def read_table_df(conn, table_name: str):
+    """Read a whole table into a DataFrame, through Arrow when available"""
+    result = conn.execute(f"SELECT * FROM {table_name}")
+    if PYARROW_AVAILABLE:
+        return fetch_arrow_table(result).to_pandas()
+    return result.fetchdf()
+
+
+def resolve_input_tables(conn, input_tables: List[Dict[str, Any]], load_data: bool = True) -> List[Dict[str, Any]]:
+    """Resolve the table references among the input tables of an agent request.
+
+    Tables sent with their rows are returned unchanged. Referenced tables are checked against
+    the session database (and against the version the client saw, if given); with `load_data`
+    they are read into a DataFrame stored under "df" (python agents), otherwise only their
+    name is set (sql agents query the session database themselves).
+    """
+    resolved = []
+    for input_table in input_tables:
+        if not is_table_ref(input_table):
+            resolved.append(input_table)
+            continue
+
+        table_ref = input_table['table_ref']
+        table_name = sanitize_table_name(table_ref.get('table_name') or input_table.get('name', ''))
+        try:
+            conn.execute(f"DESCRIBE {table_name}")
+        except Exception:
+            raise TableRefError(f"Table '{table_name}' does not exist in the session database")
+
+        expected_version = table_ref.get('version')
+        if expected_version:
+            current_version = get_table_version(conn, table_name)
+            if current_version is not None and current_version != expected_version:
+                raise TableRefError(f"Table '{table_name}' has changed since it was loaded, please refresh it and try again")
+
+        resolved_table = {key: value for key, value in input_table.items() if key != 'table_ref'}
+        if load_data:
+            resolved_table.setdefault('name', table_name)
+            resolved_table['df'] = read_table_df(conn, table_name)
+        else:
+            resolved_table['name'] = table_name
+        resolved.append(resolved_table)
+    return resolved
@@ -0,0 +1,148 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from data_formulator.table_versions import get_table_version_key
+from data_formulator.table_profiler import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLE_SEED = 2**31 - 1
+
+# random samples of larger tables are first narrowed down by block (system) sampling, keeping
+# about BLOCK_SAMPLE_OVERSAMPLING times the requested rows, before the reservoir sample
+BLOCK_SAMPLE_ROW_THRESHOLD = 100_000_000
+BLOCK_SAMPLE_OVERSAMPLING = 50
+
+_METADATA_CACHE_MAX_SIZE = 1024
+_metadata_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+_metadata_cache_lock = threading.Lock()
+
+
+def get_data_version_key(conn, table_name: str) -> Optional[tuple]:
+    """Key identifying the data behind a table or view: its own version plus the version of all tables
+    in the database, since a view's result changes with the tables it reads (None if not cacheable)"""
+    version_key = get_table_version_key(conn, table_name)
+    if version_key is None:
+        return None
+    tables_signature = conn.execute(
+        "SELECT list((table_oid, estimated_size) ORDER BY table_oid) FROM duckdb_tables() WHERE database_name = current_database()"
+    ).fetchone()[0]
+    return (version_key, str(tables_signature))
+
+
+def _cached(cache_key, compute):
+    if cache_key is None:
+        return compute()
+    with _metadata_cache_lock:
+        if cache_key in _metadata_cache:
+            _metadata_cache.move_to_end(cache_key)
+            return _metadata_cache[cache_key]
+    value = compute()
+    with _metadata_cache_lock:
+        _metadata_cache[cache_key] = value
+        while len(_metadata_cache) > _METADATA_CACHE_MAX_SIZE:
+            _metadata_cache.popitem(last=False)
+    return value
+
+
+def get_total_row_count(conn, query: str, version_key: Optional[tuple] = None) -> int:
+    """Row count of a query result, cached per data version"""
+    cache_key = ('count', version_key, query) if version_key is not None else None
+    return _cached(cache_key, lambda: conn.execute(f"SELECT COUNT(*) FROM ({query}) AS subq").fetchone()[0])
+
+
+def get_table_schema(conn, table_name: str, version_key: Optional[tuple] = None) -> List[Tuple[str, str]]:
+    """(name, type) of the columns of a table or view, cached per data version"""
+    cache_key = ('schema', version_key, table_name) if version_key is not None else None
+    return _cached(cache_key, lambda: [(col[0], col[1]) for col in conn.execute(f"DESCRIBE {table_name}").fetchall()])
+
+
+def get_strata(conn, query: str, field: str, version_key: Optional[tuple] = None) -> List[Tuple[Any, int]]:
+    """(value, row count) of each distinct value of a field in a query result, cached per data version"""
+    cache_key = ('strata', version_key, query, field) if version_key is not None else None
+    return _cached(cache_key, lambda: conn.execute(
+        f"SELECT {quote_identifier(field)}, COUNT(*) FROM ({query}) AS subq GROUP BY ALL"
+    ).fetchall())
+
+
+def new_sample_seed() -> int:
+    """Seed of a random sample the client didn't pass one for: a new sample on every request
+    (the seed is returned with it, so the client can ask for the same sample again)"""
+    return random.randint(0, MAX_SAMPLE_SEED)
+
+
+def block_sample_clause(total_row_count: int, sample_size: int, seed: int) -> str:
+    """TABLESAMPLE clause to put after a large table's name, or '' if the table is small enough to
+    be sampled from entirely"""
+    if total_row_count <= BLOCK_SAMPLE_ROW_THRESHOLD:
+        return ""
+    percentage = min(100.0, 100.0 * sample_size * BLOCK_SAMPLE_OVERSAMPLING / total_row_count)
+    return f" TABLESAMPLE system({percentage:.6f}%) REPEATABLE ({int(seed)})"
+
+
+def random_sample_query(query: str, sample_size: int, seed: int) -> str:
+    """Uniform random sample of a query result with a seeded reservoir sample (a single pass, no sort)"""
+    return f"SELECT * FROM ({query}) AS subq USING SAMPLE reservoir({int(sample_size)} ROWS) REPEATABLE ({int(seed)})"
+
+
+def stratum_quotas(sizes: List[int], sample_size: int) -> List[int]:
+    """Rows to sample from strata of the given sizes: shares of `sample_size` proportional to their
+    sizes, rounded with the largest remainders so that they add up to `sample_size` (or all the rows),
+    each at least one row"""
+    total_row_count = sum(sizes)
+    if total_row_count <= sample_size:
+        return list(sizes)
+    shares = [sample_size * size / total_row_count for size in sizes]
+    quotas = [min(size, max(1, int(share))) for size, share in zip(sizes, shares)]
+    # strata raised to one row take rows from the largest ones
+    for i in sorted(range(len(sizes)), key=lambda i: -quotas[i]):
+        excess = sum(quotas) - sample_size
+        if excess <= 0:
+            break
+        quotas[i] -= min(excess, quotas[i] - 1)
+    # the rows left go to the largest remainders
+    missing = sample_size - sum(quotas)
+    for i in sorted(range(len(sizes)), key=lambda i: (quotas[i] - shares[i], -sizes[i])):
+        if missing <= 0:
+            break
+        if quotas[i] < sizes[i]:
+            quotas[i] += 1
+            missing -= 1
+    return quotas
+
+
+def stratified_sample_query(query: str, output_column_names: List[str], field: str,
+                            strata: List[Tuple[Any, int]], sample_size: int, seed: int) -> Tuple[str, list]:
+    """Sample of `sample_size` rows where each value of `field` gets a share proportional to its
+    row count, but at least one row, so rare categories still show up in charts (see stratum_quotas).
+
+    Rows are ranked within their stratum by a seeded hash of their values; only rows passing a
+    per-stratum hash threshold (about twice the quota) are ranked, so no full sort is needed.
+
+    Returns:
+        (query, parameters)
+    """
+    quotas = stratum_quotas([size for _, size in strata], sample_size)
+    strata_values = []
+    parameters = [int(seed)]
+    for (value, size), quota in zip(strata, quotas):
+        strata_values.append("(?, ?, ?)")
+        parameters.extend([value, quota, min(1.0, (2 * quota + 10) / size)])
+
+    hashed_columns = ", ".join(f"base.{quote_identifier(col)}" for col in output_column_names)
+    query = f"""
+        SELECT * EXCLUDE (__df_stratum, __df_quota, __df_probability, __df_hash) FROM (
+            SELECT base.*, strata.*, hash(?, {hashed_columns}) AS __df_hash
+            FROM ({query}) AS base
+            JOIN (VALUES {', '.join(strata_values)}) AS strata(__df_stratum, __df_quota, __df_probability)
+                ON base.{quote_identifier(field)} IS NOT DISTINCT FROM strata.__df_stratum
+        ) AS candidates
+        WHERE (__df_hash >> 11)::DOUBLE / 9007199254740992.0 < __df_probability
+        QUALIFY row_number() OVER (PARTITION BY __df_stratum ORDER BY __df_hash) <= __df_quota"""
+    return query, parameters
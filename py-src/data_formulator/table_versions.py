@@ -0,0 +1,51 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from data_formulator.db_manager import db_manager
+from data_formulator.result_cache import result_cache
+
+
+def get_table_version_key(conn, table_name: str):
+    """Get a key identifying the current version of a table or view, or None if it can't be cached.
+
+    The catalog fingerprint (oid, row count or view sql, columns) sees tables being replaced or
+    resized; changes that keep the row count (UPDATE, DELETE + INSERT) and changes of the tables
+    a view reads are seen through the session's version counters (see ResultCache.version_counters),
+    which the routes changing tables bump. Writes that don't go through them are not noticed.
+
+    In-memory databases (no file path), databases of no open session and qualified names are not cached.
+    """
+    return get_table_version_keys(conn, [table_name]).get(table_name)
+
+
+def get_table_version_keys(conn, table_names: list[str]) -> dict[str, tuple]:
+    """Version keys (see get_table_version_key) of several tables or views, with one catalog and one
+    registry query; the tables whose version can't be determined are left out"""
+    table_names = [table_name for table_name in table_names if '.' not in table_name]
+    if not table_names:
+        return {}
+    rows = conn.execute("""
+        SELECT o.name, d.path, o.oid, o.version, o.is_view, (
+            SELECT string_agg(c.column_name || ':' || c.data_type, ',' ORDER BY c.column_index)
+            FROM duckdb_columns() c
+            WHERE c.database_name = o.database_name AND c.schema_name = o.schema_name AND c.table_name = o.name
+        )
+        FROM (
+            SELECT database_name, schema_name, table_name as name, table_oid as oid, estimated_size::VARCHAR as version, false as is_view
+            FROM duckdb_tables()
+            WHERE list_contains($names, table_name) AND database_name = current_database() AND schema_name = current_schema()
+            UNION ALL
+            SELECT database_name, schema_name, view_name as name, view_oid as oid, sql as version, true as is_view
+            FROM duckdb_views()
+            WHERE list_contains($names, view_name) AND database_name = current_database() AND schema_name = current_schema()
+        ) o
+        JOIN duckdb_databases() d ON d.database_name = o.database_name
+    """, {"names": table_names}).fetchall()
+    # all rows are of the current database
+    if not rows or rows[0][1] is None:
+        return {}
+    session_id = db_manager.session_of_db_file(rows[0][1])
+    if session_id is None:
+        return {}
+    counters = result_cache.table_version_counters(session_id, {row[0]: row[4] for row in rows})
+    return {row[0]: (*row[1:], *counters[row[0]]) for row in rows}
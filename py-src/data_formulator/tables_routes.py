@@ -9,14 +9,30 @@ mimetypes.add_type('application/javascript', '.js')
 mimetypes.add_type('application/javascript', '.mjs')
 import json
 import traceback
-from flask import request, send_from_directory, session, jsonify, Blueprint
+from flask import request, session, jsonify, Blueprint, Response
 import pandas as pd
 import random
 import string
 from pathlib import Path
 import uuid
+import hashlib
+import shutil
+import duckdb
 
 from data_formulator.db_manager import db_manager
+from data_formulator.dataset_store import dataset_store
+from data_formulator.db_janitor import db_janitor
+from data_formulator.example_catalog import example_catalog
+from data_formulator.query_control import guarded_connection, query_watchdog
+from data_formulator.result_cache import result_cache
+from data_formulator.table_profiler import profile_table
+from data_formulator.upload_ingest import (SUPPORTED_UPLOAD_EXTENSIONS, spool_upload, ingest_file_to_duckdb, export_file_to_parquet,
+                                           export_df_to_parquet, report_progress, get_progress)
+from data_formulator.arrow_utils import PYARROW_AVAILABLE, ARROW_STREAM_MIMETYPE, fetch_arrow_table, serialize_arrow_stream
+from data_formulator.table_refs import get_table_version, get_table_versions
+from data_formulator.table_sampling import (new_sample_seed, get_data_version_key, get_total_row_count, get_strata, get_table_schema,
+                                            block_sample_clause, random_sample_query, stratified_sample_query)
+from data_formulator.table_pagination import InvalidCursorError, fetch_page
 from data_formulator.data_loader import DATA_LOADERS
 
 import re
@@ -30,53 +46,126 @@ import tempfile
 
 tables_bp = Blueprint('tables', __name__, url_prefix='/api/tables')
 
+
+def client_accepts_arrow() -> bool:
+    """Whether the client explicitly asked for an Arrow IPC stream in the Accept header"""
+    if not PYARROW_AVAILABLE:
+        return False
+    return any(mimetype == ARROW_STREAM_MIMETYPE and quality > 0 for mimetype, quality in request.accept_mimetypes)
+
+
+def arrow_response(arrow_table, metadata: dict) -> Response:
+    """Send query results as an Arrow IPC stream, the json metadata (status, row counts, paging)
+    is attached to the schema metadata under the 'data_formulator' key"""
+    return Response(serialize_arrow_stream(arrow_table, {"status": "success", **metadata}), mimetype=ARROW_STREAM_MIMETYPE)
+
+def is_stored_data_view(view_sql) -> bool:
+    """Whether a view only exposes data stored outside the session (a stored upload or an example dataset),
+    clients see these as plain tables and their data only changes with the view itself"""
+    return dataset_store.is_dataset_view(view_sql) or example_catalog.is_catalog_view(view_sql)
+
+
+def unique_table_name(db, base_name: str) -> str:
+    """`base_name`, or `base_name` with the first counter suffix no table or view of the session uses"""
+    table_name = base_name
+    counter = 1
+    while db.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT table_name AS name FROM duckdb_tables() WHERE database_name = current_database()
+                UNION ALL
+                SELECT view_name FROM duckdb_views() WHERE database_name = current_database()
+            ) WHERE name = ?""", [table_name]).fetchone()[0] > 0:
+        table_name = f"{base_name}_{counter}"
+        counter += 1
+    return table_name
+
+
+def list_table_metadata(db):
+    """Get name, type, columns and estimated row count of all tables and views in a single query.
+
+    Row counts of tables come from DuckDB's catalog estimate (exact for tables that were
+    created in one go); views have no stored count so `estimated_row_count` is None for them.
+    """
+    table_metadata_list = db.execute("""
+        WITH objects AS (
+            SELECT database_name, schema_name, table_name, schema_name==current_schema() as is_current_schema, 'table' as object_type,
+                estimated_size as estimated_row_count, NULL as view_source
+            FROM duckdb_tables() 
+            WHERE internal=False AND database_name == current_database()
+            UNION ALL 
+            SELECT database_name, schema_name, view_name as table_name, schema_name==current_schema() as is_current_schema, 'view' as object_type,
+                NULL as estimated_row_count, sql as view_source
+            FROM duckdb_views()
+            WHERE view_name NOT LIKE 'duckdb_%' AND view_name NOT LIKE 'sqlite_%' AND view_name NOT LIKE 'pragma_%' AND database_name == current_database()
+        )
+        SELECT o.database_name, o.schema_name, o.table_name, o.is_current_schema, o.object_type, o.estimated_row_count, o.view_source,
+            list(struct_pack(name := c.column_name, type := c.data_type) ORDER BY c.column_index) FILTER (WHERE c.column_name IS NOT NULL) as columns
+        FROM objects o
+        LEFT JOIN duckdb_columns() c 
+            ON c.database_name = o.database_name AND c.schema_name = o.schema_name AND c.table_name = o.table_name
+        GROUP BY ALL
+        ORDER BY o.object_type, o.table_name
+    """).fetchall()
+
+    result = []
+    for table_metadata in table_metadata_list:
+        [database_name, schema_name, table_name, is_current_schema, object_type, estimated_row_count, view_source, columns] = table_metadata
+        if database_name in ['system', 'temp']:
+            continue
+        if object_type == 'view' and is_stored_data_view(view_source):
+            object_type, view_source = 'table', None
+        result.append({
+            "name": table_name if is_current_schema else '.'.join([database_name, schema_name, table_name]),
+            "object_type": object_type,
+            "columns": columns or [],
+            "estimated_row_count": estimated_row_count,
+            "view_source": view_source
+        })
+    return result
+
+
 @tables_bp.route('/list-tables', methods=['GET'])
 def list_tables():
-    """List all tables in the current session"""
+    """List all tables in the current session
+
+    Query args:
+        include_sample_rows: whether to include up to 1000 sample rows per table (default false,
+            clients fetch rows lazily per table via /sample-table)
+        exact_row_count: whether to run COUNT(*) per table (default false, the catalog estimate
+            is returned, None for views)
+    """
     try:
+        include_sample_rows = request.args.get('include_sample_rows', 'false').lower() == 'true'
+        exact_row_count = request.args.get('exact_row_count', 'false').lower() == 'true'
+
         result = []
-        with db_manager.connection(session['session_id']) as db:
-            table_metadata_list = db.execute("""
-                SELECT database_name, schema_name, table_name, schema_name==current_schema() as is_current_schema, 'table' as object_type 
-                FROM duckdb_tables() 
-                WHERE internal=False AND database_name == current_database()
-                UNION ALL 
-                SELECT database_name, schema_name, view_name as table_name, schema_name==current_schema() as is_current_schema, 'view' as object_type 
-                FROM duckdb_views()
-                WHERE view_name NOT LIKE 'duckdb_%' AND view_name NOT LIKE 'sqlite_%' AND view_name NOT LIKE 'pragma_%' AND database_name == current_database()
-            """).fetchall()
-        
-            
-            for table_metadata in table_metadata_list:
-                [database_name, schema_name, table_name, is_current_schema, object_type] = table_metadata
-                table_name = table_name if is_current_schema else '.'.join([database_name, schema_name, table_name])
-                if database_name in ['system', 'temp']:
-                    continue
-                
+        with guarded_connection(session['session_id']) as db:
+            tables_metadata = list_table_metadata(db)
+            # passed along with the table names in the agents' table references
+            versions = get_table_versions(db, [table_metadata['name'] for table_metadata in tables_metadata])
+            for table_metadata in tables_metadata:
+                table_name = table_metadata['name']
                 try:
-                    # Get column information
-                    columns = db.execute(f"DESCRIBE {table_name}").fetchall()
-                    # Get row count
-                    row_count = db.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-                    sample_rows = db.execute(f"SELECT * FROM {table_name} LIMIT 1000").fetchdf() if row_count > 0 else pd.DataFrame()
-                    
-                    # Check if this is a view or a table
-                    try:
-                        # Get both view existence and source in one query
-                        view_info = db.execute(f"SELECT view_name, sql FROM duckdb_views() WHERE view_name = '{table_name}'").fetchone()
-                        view_source = view_info[1] if view_info else None
-                    except Exception as e:
-                        # If the query fails, assume it's a regular table
-                        view_source = None
-                    
+                    row_count = table_metadata['estimated_row_count']
+                    if exact_row_count:
+                        row_count = db.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+                    sample_rows = []
+                    if include_sample_rows and row_count != 0:
+                        sample_df = db.execute(f"SELECT * FROM {table_name} LIMIT 1000").fetchdf()
+                        sample_rows = json.loads(sample_df.to_json(orient='records', date_format='iso'))
+
                     result.append({
                         "name": table_name,
-                        "columns": [{"name": col[0], "type": col[1]} for col in columns],
+                        "columns": table_metadata['columns'],
                         "row_count": row_count,
-                        "sample_rows": json.loads(sample_rows.to_json(orient='records', date_format='iso')),
-                        "view_source": view_source
+                        "sample_rows": sample_rows,
+                        "view_source": table_metadata['view_source'],
+                        "version": versions[table_name]
                     })
                     
+                except duckdb.InterruptException:
+                    raise
                 except Exception as e:
                     logger.error(f"Error getting table metadata for {table_name}: {str(e)}")
                     continue
@@ -150,20 +239,31 @@ def assemble_query(aggregate_fields_and_functions, group_fields, columns, table_
 
 @tables_bp.route('/sample-table', methods=['POST'])
 def sample_table():
-    """Sample a table"""
+    """Sample a table
+
+    Random samples are seeded reservoir samples (`seed`, a new random one if not given, so that
+    resampling returns other rows; the seed used is returned), very large tables are pre-sampled by blocks. With `stratify_by`
+    the sample keeps every value of that field, in proportion to its frequency.
+
+    Responses are cached by query and table version (see result_cache), so toggling a chart
+    back to a previous encoding doesn't rerun its query; random samples only when seeded by the client.
+    """
     try:
         data = request.get_json()
         table_id = data.get('table')
-        sample_size = data.get('size', 1000)
+        sample_size = int(data.get('size', 1000))
         aggregate_fields_and_functions = data.get('aggregate_fields_and_functions', []) # each element is a tuple (field, function)
         select_fields = data.get('select_fields', []) # if empty, we want to include all fields
         method = data.get('method', 'random') # one of 'random', 'head', 'bottom'
         order_by_fields = data.get('order_by_fields', [])
+        seed = int(data['seed']) if data.get('seed') is not None else new_sample_seed()
+        stratify_by = data.get('stratify_by') # only used with the 'random' method
 
         
         total_row_count = 0
+        query_params = []
         # Validate field names against table columns to prevent SQL injection
-        with db_manager.connection(session['session_id']) as db:
+        with guarded_connection(session['session_id']) as db:
             # Get valid column names
             columns = [col[0] for col in db.execute(f"DESCRIBE {table_id}").fetchall()]
 
@@ -178,16 +278,21 @@ def sample_table():
 
             query, output_column_names = assemble_query(valid_aggregate_fields_and_functions, valid_select_fields, columns, table_id)
 
-
-            # Modify the original query to include the count:
-            count_query = f"SELECT *, COUNT(*) OVER () as total_count FROM ({query}) as subq LIMIT 1"
-            result = db.execute(count_query).fetchone()
-            total_row_count = result[-1] if result else 0
-
+            # the total count only changes with the data, reuse it across samples of the same table version
+            version_key = get_data_version_key(db, table_id)
+            total_row_count = get_total_row_count(db, query, version_key)
 
             # Add ordering and limit to the main query
             if method == 'random':
-                query += f" ORDER BY RANDOM() LIMIT {sample_size}"
+                strata = get_strata(db, query, stratify_by, version_key) if stratify_by in output_column_names else None
+                if strata and len(strata) <= sample_size:
+                    query, query_params = stratified_sample_query(query, output_column_names, stratify_by, strata, sample_size, seed)
+                else:
+                    if not valid_aggregate_fields_and_functions:
+                        # rows are sampled straight from the table, large ones by block first
+                        sampled_table = table_id + block_sample_clause(total_row_count, sample_size, seed)
+                        query, _ = assemble_query(valid_aggregate_fields_and_functions, valid_select_fields, columns, sampled_table)
+                    query = random_sample_query(query, sample_size, seed)
             elif method == 'head':
                 if valid_order_by_fields:
                     # Build ORDER BY clause with validated fields
@@ -204,14 +309,36 @@ def sample_table():
                     query += f" ORDER BY ROWID DESC LIMIT {sample_size}"
 
 
-            result = db.execute(query).fetchdf()
+            accepts_arrow = client_accepts_arrow()
+            mimetype = ARROW_STREAM_MIMETYPE if accepts_arrow else 'application/json'
+            cache_key = None
+            # a random sample without a seed from the client is a new sample on every request
+            cacheable = method != 'random' or data.get('seed') is not None
+            if cacheable and version_key is not None and result_cache.is_enabled():
+                view = db.execute("SELECT sql FROM duckdb_views() WHERE view_name = ? AND database_name = current_database()",
+                                  [table_id]).fetchone()
+                is_view = view is not None and not is_stored_data_view(view[0])
+                cache_key = result_cache.make_key(session['session_id'], table_id, is_view, query, query_params,
+                                                  mimetype, version_key, total_row_count)
+                body = result_cache.get(cache_key)
+                if body is not None:
+                    return Response(body, mimetype=mimetype)
+
+            if accepts_arrow:
+                body = serialize_arrow_stream(fetch_arrow_table(db.execute(query, query_params)),
+                                              {"status": "success", "total_row_count": total_row_count, "seed": seed})
+            else:
+                result = db.execute(query, query_params).fetchdf()
+                body = json.dumps({
+                    "status": "success",
+                    "rows": json.loads(result.to_json(orient='records', date_format='iso')),
+                    "total_row_count": total_row_count,
+                    "seed": seed
+                })
+            if cache_key is not None:
+                result_cache.put(cache_key, body, len(body))
 
-        
-        return jsonify({
-            "status": "success",
-            "rows": json.loads(result.to_json(orient='records', date_format='iso')),
-            "total_row_count": total_row_count
-        })
+        return Response(body, mimetype=mimetype)
     except Exception as e:
         logger.error(f"Error sampling table: {str(e)}")
         safe_msg, status_code = sanitize_db_error_message(e)
@@ -222,15 +349,25 @@ def sample_table():
 
 @tables_bp.route('/get-table', methods=['GET'])
 def get_table_data():
-    """Get data from a specific table"""
+    """Get data from a specific table
+
+    Query args:
+        page, page_size: offset based paging (default)
+        cursor: switches to keyset pagination, pass an empty cursor for the first page then the
+            `next_cursor` of the previous response; optional `sort_by` (repeated) keys the pages
+            on those columns instead of the table's row order
+        format: 'rows' (list of records, default) or 'columnar' (one list of values per column)
+    """
     try:
-        with db_manager.connection(session['session_id']) as db:
+        with guarded_connection(session['session_id']) as db:
 
             table_name = request.args.get('table_name')
             # Get pagination parameters
             page = int(request.args.get('page', 1))
             page_size = int(request.args.get('page_size', 100))
             offset = (page - 1) * page_size
+            cursor = request.args.get('cursor')
+            columnar = request.args.get('format', 'rows') == 'columnar'
             
             if not table_name:
                 return jsonify({
@@ -238,25 +375,62 @@ def get_table_data():
                     "message": "Table name is required"
                 }), 400
             
-            # Get total count
-            total_rows = db.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-            
-            # Get paginated data
-            result = db.execute(
-                f"SELECT * FROM {table_name} LIMIT {page_size} OFFSET {offset}"
-            ).fetchall()
-            
-            # Get column names
-            columns = [col[0] for col in db.execute(f"DESCRIBE {table_name}").fetchall()]
-            
-            # Convert to list of dictionaries
-            rows = [dict(zip(columns, row)) for row in result]
+            # count and schema only change with the table, they are cached per version
+            version_key = get_data_version_key(db, table_name)
+            total_rows = get_total_row_count(db, f"SELECT * FROM {table_name}", version_key)
+            schema = get_table_schema(db, table_name, version_key)
+            columns = [col_name for col_name, _ in schema]
+
+            if cursor is not None:
+                try:
+                    page_data, next_cursor = fetch_page(db, table_name, schema, page_size, cursor, request.args.getlist('sort_by'))
+                except InvalidCursorError as e:
+                    return jsonify({
+                        "status": "error",
+                        "message": str(e)
+                    }), 400
+                metadata = {
+                    "table_name": table_name,
+                    "columns": columns,
+                    "total_rows": total_rows,
+                    "page_size": page_size,
+                    "next_cursor": next_cursor
+                }
+                if client_accepts_arrow():
+                    return arrow_response(page_data, metadata)
+                page_df = page_data.to_pandas() if PYARROW_AVAILABLE else page_data
+                return jsonify({
+                    "status": "success",
+                    **metadata,
+                    **encode_page_rows(page_df, columnar)
+                })
+
+            if client_accepts_arrow():
+                arrow_table = fetch_arrow_table(db.execute(f"SELECT * FROM {table_name} LIMIT {page_size} OFFSET {offset}"))
+                return arrow_response(arrow_table, {
+                    "table_name": table_name,
+                    "columns": arrow_table.column_names,
+                    "total_rows": total_rows,
+                    "page": page,
+                    "page_size": page_size
+                })
+
+            if columnar:
+                page_rows = encode_page_rows(db.execute(f"SELECT * FROM {table_name} LIMIT {page_size} OFFSET {offset}").fetchdf(), columnar)
+            else:
+                # Get paginated data
+                result = db.execute(
+                    f"SELECT * FROM {table_name} LIMIT {page_size} OFFSET {offset}"
+                ).fetchall()
+                
+                # Convert to list of dictionaries
+                page_rows = {"rows": [dict(zip(columns, row)) for row in result]}
         
             return jsonify({
                 "status": "success",
                 "table_name": table_name,
                 "columns": columns,
-                "rows": rows,
+                **page_rows,
                 "total_rows": total_rows,
                 "page": page,
                 "page_size": page_size
@@ -270,10 +444,31 @@ def get_table_data():
             "message": safe_msg
         }), status_code
 
+
+def encode_page_rows(df: pd.DataFrame, columnar: bool) -> dict:
+    """Rows of a page for the json response: {"rows": [records]} or, in columnar form,
+    {"data": {column: [values]}} which avoids repeating the column names in every row"""
+    if columnar:
+        split = json.loads(df.to_json(orient='split', date_format='iso', index=False))
+        return {"data": {col: [row[i] for row in split['data']] for i, col in enumerate(split['columns'])}}
+    return {"rows": json.loads(df.to_json(orient='records', date_format='iso'))}
+
 @tables_bp.route('/create-table', methods=['POST'])
 def create_table():
-    """Create a new table from uploaded data"""
+    """Create a new table from uploaded data
+
+    Uploaded files are spooled to disk and loaded with DuckDB's native readers so memory stays
+    bounded; clients can pass an `upload_id` form field and poll /create-table-progress.
+
+    With the dataset store enabled, uploads are hashed while spooled and stored once as parquet:
+    the table is a read-only view of the stored file, and uploading the same data again (in
+    any session) only creates the view.
+    """
+    spooled_path = None
+    hasher = hashlib.sha256() if dataset_store.is_enabled() else None
     try:
+        db_janitor.check_session_quota(session['session_id'])
+
         if 'file' not in request.files and 'raw_data' not in request.form:
             return jsonify({"status": "error", "message": "No file or raw data provided"}), 400
         
@@ -281,59 +476,113 @@ def create_table():
         if not table_name:
             return jsonify({"status": "error", "message": "No table name provided"}), 400
         
+        upload_id = request.form.get('upload_id')
+
         df = None
+        file = None
         if 'file' in request.files:
             file = request.files['file']
-            # Read file based on extension
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file.filename.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(file)
-            elif file.filename.endswith('.json'):
-                df = pd.read_json(file)
-            else:
+            if not file.filename.lower().endswith(SUPPORTED_UPLOAD_EXTENSIONS):
                 return jsonify({"status": "error", "message": "Unsupported file format"}), 400
+            spooled_path = spool_upload(file, upload_id, hasher)
         else:
             raw_data = request.form.get('raw_data')
             try:
                 df = pd.DataFrame(json.loads(raw_data))
             except Exception as e:
                 return jsonify({"status": "error", "message": f"Invalid JSON data: {str(e)}, it must be in the format of a list of dictionaries"}), 400
+            if hasher is not None:
+                hasher.update(raw_data.encode('utf-8'))
 
-        if df is None:
+        if df is None and spooled_path is None:
             return jsonify({"status": "error", "message": "No data provided"}), 400
 
         sanitized_table_name = sanitize_table_name(table_name)
             
-        with db_manager.connection(session['session_id']) as db:
+        with guarded_connection(session['session_id'], timeout=None) as db:
             # Check if table exists and generate unique name if needed
             base_name = sanitized_table_name
-            counter = 1
-            while True:
-                # Check if table exists
-                exists = db.execute(f"SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = '{sanitized_table_name}'").fetchone()[0] > 0
-                if not exists:
-                    break
-                # If exists, append counter to base name
-                sanitized_table_name = f"{base_name}_{counter}"
-                counter += 1
+            sanitized_table_name = unique_table_name(db, base_name)
 
             # Create table
-            db.register('df_temp', df)
-            db.execute(f"CREATE TABLE {sanitized_table_name} AS SELECT * FROM df_temp")
-            db.execute("DROP VIEW df_temp")  # Drop the temporary view after creating the table
+            if hasher is not None:
+                if spooled_path is not None:
+                    dataset_key = dataset_store.dataset_key(hasher.hexdigest(), os.path.splitext(file.filename)[1].lower())
+                    write_dataset = lambda path: export_file_to_parquet(db, spooled_path, file.filename, path, upload_id)
+                else:
+                    dataset_key = dataset_store.dataset_key(hasher.hexdigest(), 'records')
+                    write_dataset = lambda path: export_df_to_parquet(db, df, path)
+                dataset_store.get_or_create(dataset_key, write_dataset)
+                dataset_store.create_view(db, session['session_id'], sanitized_table_name, dataset_key)
+                row_count = db.execute(f"SELECT COUNT(*) FROM {sanitized_table_name}").fetchone()[0]
+                columns = [col[0] for col in db.execute(f"DESCRIBE {sanitized_table_name}").fetchall()]
+                report_progress(upload_id, stage='done', rows_loaded=row_count)
+            elif spooled_path is not None:
+                row_count, columns = ingest_file_to_duckdb(db, spooled_path, file.filename, sanitized_table_name, upload_id)
+            else:
+                db.register('df_temp', df)
+                db.execute(f"CREATE TABLE {sanitized_table_name} AS SELECT * FROM df_temp")
+                db.execute("DROP VIEW df_temp")  # Drop the temporary view after creating the table
+                row_count, columns = len(df), list(df.columns)
+            result_cache.bump_table(session['session_id'], sanitized_table_name)
             
             return jsonify({
                 "status": "success",
                 "table_name": sanitized_table_name,
-                "row_count": len(df),
-                "columns": list(df.columns),
+                "row_count": row_count,
+                "columns": columns,
                 "original_name": base_name,  # Include the original name in response
                 "is_renamed": base_name != sanitized_table_name  # Flag indicating if name was changed
             })
     
     except Exception as e:
         logger.error(f"Error creating table: {str(e)}")
+        report_progress(request.form.get('upload_id'), stage='error')
+        safe_msg, status_code = sanitize_db_error_message(e)
+        return jsonify({
+            "status": "error",
+            "message": safe_msg
+        }), status_code
+    finally:
+        if spooled_path is not None and os.path.exists(spooled_path):
+            os.remove(spooled_path)
+
+
+@tables_bp.route('/load-example-table', methods=['POST'])
+def load_example_table():
+    """Add an example dataset table (the `catalog_table` listed by /api/example-datasets) to the session,
+    as a view of the shared example catalog: nothing is downloaded or copied into the session database.
+
+    Returns the table like /list-tables does (columns with their type, up to 1000 sample rows, version)."""
+    try:
+        data = request.get_json()
+        catalog_table = data.get('catalog_table')
+        if not example_catalog.has_table(catalog_table):
+            return jsonify({"status": "error", "message": "Unknown example table"}), 404
+
+        sanitized_table_name = sanitize_table_name(data.get('table_name') or catalog_table)
+        with guarded_connection(session['session_id']) as db:
+            base_name = sanitized_table_name
+            sanitized_table_name = unique_table_name(db, base_name)
+
+            example_catalog.create_view(db, sanitized_table_name, catalog_table)
+            result_cache.bump_table(session['session_id'], sanitized_table_name)
+            row_count = db.execute(f"SELECT COUNT(*) FROM {sanitized_table_name}").fetchone()[0]
+            columns = [{"name": col[0], "type": col[1]} for col in db.execute(f"DESCRIBE {sanitized_table_name}").fetchall()]
+            sample_df = db.execute(f"SELECT * FROM {sanitized_table_name} LIMIT 1000").fetchdf()
+
+            return jsonify({
+                "status": "success",
+                "table_name": sanitized_table_name,
+                "row_count": row_count,
+                "columns": columns,
+                "sample_rows": json.loads(sample_df.to_json(orient='records', date_format='iso')),
+                "version": get_table_version(db, sanitized_table_name),
+                "original_name": base_name,
+                "is_renamed": base_name != sanitized_table_name
+            })
+    except Exception as e:
+        logger.error(f"Error loading example table: {str(e)}")
         safe_msg, status_code = sanitize_db_error_message(e)
         return jsonify({
             "status": "error",
@@ -341,6 +590,15 @@ def create_table():
         }), status_code
 
 
+@tables_bp.route('/create-table-progress', methods=['GET'])
+def create_table_progress():
+    """Get the progress of a file upload started with an `upload_id`"""
+    upload_id = request.args.get('upload_id')
+    progress = get_progress(upload_id) if upload_id else None
+    if progress is None:
+        return jsonify({"status": "error", "message": "Unknown upload id"}), 404
+    return jsonify({"status": "success", "upload_id": upload_id, **progress})
+
 
 @tables_bp.route('/delete-table', methods=['POST'])
 def drop_table():
@@ -352,14 +610,15 @@ def drop_table():
         if not table_name:
             return jsonify({"status": "error", "message": "No table name provided"}), 400
             
-        with db_manager.connection(session['session_id']) as db:
+        with guarded_connection(session['session_id']) as db:
             # First check if it exists as a view
-            view_exists = db.execute(f"SELECT view_name FROM duckdb_views() WHERE view_name = '{table_name}'").fetchone() is not None
+            view_exists = db.execute(f"SELECT view_name FROM duckdb_views() WHERE view_name = '{table_name}' AND database_name = current_database()").fetchone() is not None
             if view_exists:
                 db.execute(f"DROP VIEW IF EXISTS {table_name}")
+                dataset_store.release(session['session_id'], table_name)
             
             # Then check if it exists as a table
-            table_exists = db.execute(f"SELECT table_name FROM duckdb_tables() WHERE table_name = '{table_name}'").fetchone() is not None
+            table_exists = db.execute(f"SELECT table_name FROM duckdb_tables() WHERE table_name = '{table_name}' AND database_name = current_database()").fetchone() is not None
             if table_exists:
                 db.execute(f"DROP TABLE IF EXISTS {table_name}")
 
@@ -368,6 +627,7 @@ def drop_table():
                     "status": "error",
                     "message": f"Table/view '{table_name}' does not exist"
                 }), 404
+            result_cache.bump_table(session['session_id'], table_name)
         
             return jsonify({
                 "status": "success",
@@ -415,14 +675,20 @@ def upload_db_file():
             conn = duckdb.connect(temp_db_path, read_only=True)
             # Try a simple query to verify it's a valid database
             conn.execute("SELECT 1").fetchall()
+            # views of datasets stored on this server, to keep referencing them
+            views = conn.execute("SELECT view_name, sql FROM duckdb_views() WHERE NOT internal").fetchall()
             conn.close()
             
             # If we get here, the file is valid - move it to final location
             db_file_path = os.path.join(temp_dir, f"df_{session_id}.db")
-            os.replace(temp_db_path, db_file_path)
-            
-            # Update the db_manager's file mapping
-            db_manager._db_files[session_id] = db_file_path
+            # Swap the file while no worker process has the session's previous db file open
+            with db_manager.exclusive_session(session_id):
+                os.replace(temp_db_path, db_file_path)
+
+                # Update the session's file mapping (shared by all worker processes)
+                db_manager.set_db_file(session_id, db_file_path)
+                dataset_store.adopt_views(session_id, views)
+            result_cache.invalidate_session(session_id)
             
         except Exception as db_error:
             # Clean up temp file
@@ -451,7 +717,7 @@ def upload_db_file():
 
 @tables_bp.route('/download-db-file', methods=['GET'])
 def download_db_file():
-    """Download the db file for a session"""
+    """Download a copy of the db file of a session, with the views of stored and example datasets turned into tables"""
     try:
         # Check if session exists
         if 'session_id' not in session:
@@ -462,14 +728,13 @@ def download_db_file():
         
         session_id = session['session_id']
         
-        # Get the database file path from db_manager
-        if session_id not in db_manager._db_files:
+        # Get the database file path from the session registry
+        db_file_path = db_manager.lookup_db_file(session_id)
+        if db_file_path is None:
             return jsonify({
                 "status": "error",
                 "message": "No database file found for this session"
             }), 404
-            
-        db_file_path = db_manager._db_files[session_id]
         
         # Check if file exists
         if not os.path.exists(db_file_path):
@@ -477,17 +742,49 @@ def download_db_file():
                 "status": "error",
                 "message": "Database file not found"
             }), 404
-            
+
+        # Flush the write-ahead log into the file (it may be open in another worker process) and copy it
+        export_file = f"{db_file_path}.{uuid.uuid4().hex}.export"
+        with db_manager.connection(session_id) as db:
+            db.execute("CHECKPOINT")
+            shutil.copyfile(db_file_path, export_file)
+
+        def remove_export_file():
+            for file_path in (export_file, export_file + ".wal"):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+        try:
+            # views of stored datasets and example datasets read data of this server, the copy holds their rows instead
+            export_conn = duckdb.connect(database=export_file)
+            try:
+                db_manager.materialize_views(export_conn, is_stored_data_view)
+                export_conn.execute("CHECKPOINT")
+            finally:
+                export_conn.close()
+        except Exception:
+            remove_export_file()
+            raise
+
         # Generate a filename for download
         download_name = f"data_formulator_{session_id}.db"
         
-        # Return the file as an attachment
-        return send_from_directory(
-            os.path.dirname(db_file_path),
-            os.path.basename(db_file_path),
-            as_attachment=True,
-            download_name=download_name,
-            mimetype='application/x-sqlite3'
+        def stream_export_file():
+            try:
+                with open(export_file, 'rb') as f:
+                    while chunk := f.read(1024 * 1024):
+                        yield chunk
+            finally:
+                remove_export_file()
+
+        # Return the file as an attachment, removed once it is sent
+        return Response(
+            stream_export_file(),
+            mimetype='application/x-sqlite3',
+            headers={
+                "Content-Disposition": f'attachment; filename="{download_name}"',
+                "Content-Length": str(os.path.getsize(export_file)),
+            }
         )
         
     except Exception as e:
@@ -512,17 +809,20 @@ def reset_db_file():
         session_id = session['session_id']
 
         logger.info(f"session_id: {session_id}")
-        
-        # First check if there's a reference in db_manager
-        if session_id in db_manager._db_files:
-            db_file_path = db_manager._db_files[session_id]
-            
+
+        # Close the session's connections (in all worker processes) before removing the file underneath them
+        with db_manager.exclusive_session(session_id):
+            db_file_path = db_manager.lookup_db_file(session_id)
+
             # Remove the file if it exists
             if db_file_path and os.path.exists(db_file_path):
                 os.remove(db_file_path)
-            
+                if os.path.exists(db_file_path + ".wal"):
+                    os.remove(db_file_path + ".wal")
+
             # Clear the reference
-            db_manager._db_files[session_id] = None
+            db_manager.forget_session(session_id)
+        result_cache.invalidate_session(session_id)
             
         # Also check for any temporary files
         temp_db_path = os.path.join(tempfile.gettempdir(), f"temp_{session_id}.db")
@@ -547,6 +847,88 @@ def reset_db_file():
             "message": safe_msg
         }), status_code
 
+@tables_bp.route('/disk-usage', methods=['GET'])
+def disk_usage():
+    """Disk usage of the current session's database, with the overall usage and quotas"""
+    try:
+        usage = db_janitor.disk_usage()
+        session_usage = usage['sessions'].get(session['session_id'], {})
+        return jsonify({
+            "status": "success",
+            "session_size_mb": session_usage.get('size_mb', 0),
+            "session_quota_mb": usage['session_quota_mb'],
+            "total_mb": usage['total_mb'],
+            "archive_mb": usage['archive_mb'],
+            "global_quota_mb": usage['global_quota_mb'],
+            "session_count": len(usage['sessions'])
+        })
+    except Exception as e:
+        logger.error(f"Error getting disk usage: {str(e)}")
+        safe_msg, status_code = sanitize_db_error_message(e)
+        return jsonify({
+            "status": "error",
+            "message": safe_msg
+        }), status_code
+
+
+@tables_bp.route('/resource-allocation', methods=['GET'])
+def resource_allocation():
+    """Threads, memory and spill directory currently allocated to the session's database, with the overall budget"""
+    try:
+        allocation = db_manager.resource_allocation()
+        session_allocation = allocation['sessions'].get(session['session_id']) or db_manager.session_allocation(session['session_id'])
+        return jsonify({
+            "status": "success",
+            "session": session_allocation,
+            "threads_budget": allocation['threads_budget'],
+            "memory_budget_mb": allocation['memory_budget_mb'],
+            "active_sessions": allocation['active_sessions'],
+            "pool": db_manager.pool_stats()
+        })
+    except Exception as e:
+        logger.error(f"Error getting resource allocation: {str(e)}")
+        safe_msg, status_code = sanitize_db_error_message(e)
+        return jsonify({
+            "status": "error",
+            "message": safe_msg
+        }), status_code
+
+
+@tables_bp.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Entries, size and hit rate of this worker's result cache (sample-table responses)"""
+    return jsonify({
+        "status": "success",
+        "cache": result_cache.stats()
+    })
+
+
+@tables_bp.route('/cancel', methods=['POST'])
+def cancel_request():
+    """Cancel the queries of a request of the current session, identified by the id the client sent
+    with it (X-Request-Id header or request_id argument); statements it starts later fail as well"""
+    try:
+        data = request.get_json(silent=True) or {}
+        request_id = data.get('request_id') or request.args.get('request_id')
+        if not request_id:
+            return jsonify({"status": "error", "message": "No request_id provided"}), 400
+
+        interrupted = query_watchdog.cancel(session['session_id'], str(request_id))
+        return jsonify({
+            "status": "success",
+            "request_id": request_id,
+            # statements interrupted by this worker process, the others stop theirs within a second
+            "interrupted": interrupted
+        })
+    except Exception as e:
+        logger.error(f"Error cancelling request: {str(e)}")
+        safe_msg, status_code = sanitize_db_error_message(e)
+        return jsonify({
+            "status": "error",
+            "message": safe_msg
+        }), status_code
+
+
 # Example of a more complex query endpoint
 @tables_bp.route('/analyze', methods=['POST'])
 def analyze_table():
@@ -558,60 +940,11 @@ def analyze_table():
         if not table_name:
             return jsonify({"status": "error", "message": "No table name provided"}), 400
         
-        with db_manager.connection(session['session_id']) as db:
-        
-            # Get column information
-            columns = db.execute(f"DESCRIBE {table_name}").fetchall()
-            
-            stats = []
-            for col in columns:
-                col_name = col[0]
-                col_type = col[1]
-                
-                # Properly quote column names to avoid SQL keywords issues
-                quoted_col_name = f'"{col_name}"'
-                
-                # Basic stats query
-                stats_query = f"""
-                SELECT 
-                    COUNT(*) as count,
-                    COUNT(DISTINCT {quoted_col_name}) as unique_count,
-                    COUNT(*) - COUNT({quoted_col_name}) as null_count
-                FROM {table_name}
-                """
-                
-                # Add numeric stats if applicable
-                if col_type in ['INTEGER', 'DOUBLE', 'DECIMAL']:
-                    stats_query = f"""
-                    SELECT 
-                        COUNT(*) as count,
-                        COUNT(DISTINCT {quoted_col_name}) as unique_count,
-                        COUNT(*) - COUNT({quoted_col_name}) as null_count,
-                        MIN({quoted_col_name}) as min_value,
-                        MAX({quoted_col_name}) as max_value,
-                        AVG({quoted_col_name}) as avg_value
-                    FROM {table_name}
-                    """
-                
-                col_stats = db.execute(stats_query).fetchone()
-                
-                # Create a dictionary with appropriate keys based on column type
-                if col_type in ['INTEGER', 'DOUBLE', 'DECIMAL']:
-                    stats_dict = dict(zip(
-                        ["count", "unique_count", "null_count", "min", "max", "avg"],
-                        col_stats
-                    ))
-                else:
-                    stats_dict = dict(zip(
-                        ["count", "unique_count", "null_count"],
-                        col_stats
-                    ))
-                
-                stats.append({
-                    "column": col_name,
-                    "type": col_type,
-                    "statistics": stats_dict
-                })
+        # None lets the profiler pick approximate distinct counts for large tables
+        approximate = data.get('approximate', None)
+
+        with guarded_connection(session['session_id']) as db:
+            stats = profile_table(db, table_name, approximate_distinct=approximate)
         
         return jsonify({
             "status": "success",
@@ -671,6 +1004,11 @@ def sanitize_db_error_message(error: Exception) -> Tuple[str, int]:
         
         # File errors
         r"No such file": (error_msg, 404),
+        r"over its \d+MB quota": (error_msg, 507),
+        r"busy (in another worker process|with other requests)": (error_msg, 503),
+        r"time limit and was stopped": (error_msg, 408),
+        # the client gave up on the request (nginx's "client closed request")
+        r"(query|request) was cancelled": (error_msg, 499),
         r"Permission denied": ("Access denied", 403),
 
         # Data loader errors
@@ -726,7 +1064,7 @@ def data_loader_list_tables():
         if data_loader_type not in DATA_LOADERS:
             return jsonify({"status": "error", "message": f"Invalid data loader type. Must be one of: {', '.join(DATA_LOADERS.keys())}"}), 400
 
-        with db_manager.connection(session['session_id']) as duck_db_conn:
+        with guarded_connection(session['session_id'], timeout=None) as duck_db_conn:
             data_loader = DATA_LOADERS[data_loader_type](data_loader_params, duck_db_conn)
             
             # Pass table_filter to list_tables if the data loader supports it
@@ -762,14 +1100,23 @@ def data_loader_ingest_data():
         if data_loader_type not in DATA_LOADERS:
             return jsonify({"status": "error", "message": f"Invalid data loader type. Must be one of: {', '.join(DATA_LOADERS.keys())}"}), 400
 
-        with db_manager.connection(session['session_id']) as duck_db_conn:
+        db_janitor.check_session_quota(session['session_id'])
+
+        with guarded_connection(session['session_id'], timeout=None) as duck_db_conn:
             data_loader = DATA_LOADERS[data_loader_type](data_loader_params, duck_db_conn)
-            data_loader.ingest_data(table_name)
+            # loaders that stream in batches report their progress, poll /create-table-progress with the upload_id
+            data_loader.progress_id = data.get('upload_id')
+            ingested = data_loader.ingest_data(table_name)
+            result_cache.invalidate_session(session['session_id'])
 
-            return jsonify({
+            response = {
                 "status": "success",
                 "message": "Successfully ingested data from data loader"
-            })
+            }
+            if isinstance(ingested, tuple):
+                # the table may have been renamed to avoid a clash with an existing one
+                response["table_name"], response["row_count"] = ingested
+            return jsonify(response)
 
     except Exception as e:
         logger.error(f"Error ingesting data from data loader: {str(e)}")
@@ -793,7 +1140,7 @@ def data_loader_view_query_sample():
         if data_loader_type not in DATA_LOADERS:
             return jsonify({"status": "error", "message": f"Invalid data loader type. Must be one of: {', '.join(DATA_LOADERS.keys())}"}), 400
         
-        with db_manager.connection(session['session_id']) as duck_db_conn:
+        with guarded_connection(session['session_id']) as duck_db_conn:
             data_loader = DATA_LOADERS[data_loader_type](data_loader_params, duck_db_conn)
             sample = data_loader.view_query_sample(query)
 
@@ -826,14 +1173,23 @@ def data_loader_ingest_data_from_query():
         if data_loader_type not in DATA_LOADERS:
             return jsonify({"status": "error", "message": f"Invalid data loader type. Must be one of: {', '.join(DATA_LOADERS.keys())}"}), 400
 
-        with db_manager.connection(session['session_id']) as duck_db_conn:
+        db_janitor.check_session_quota(session['session_id'])
+
+        with guarded_connection(session['session_id'], timeout=None) as duck_db_conn:
             data_loader = DATA_LOADERS[data_loader_type](data_loader_params, duck_db_conn)
-            data_loader.ingest_data_from_query(query, name_as)
+            # loaders that stream in batches report their progress, poll /create-table-progress with the upload_id
+            data_loader.progress_id = data.get('upload_id')
+            ingested = data_loader.ingest_data_from_query(query, name_as)
+            result_cache.invalidate_session(session['session_id'])
 
-            return jsonify({
+            response = {
                 "status": "success",
                 "message": "Successfully ingested data from data loader"
-            })
+            }
+            if isinstance(ingested, tuple):
+                # the table may have been renamed to avoid a clash with an existing one
+                response["table_name"], response["row_count"] = ingested
+            return jsonify(response)
 
     except Exception as e:
         logger.error(f"Error ingesting data from data loader: {str(e)}")
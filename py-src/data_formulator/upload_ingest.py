@@ -0,0 +1,199 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import pandas as pd
+
+from data_formulator.db_manager import quote_path
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_UPLOAD_EXTENSIONS = ('.csv', '.xlsx', '.xls', '.json')
+
+# rows per chunk when streaming excel sheets into duckdb
+EXCEL_CHUNK_SIZE = 50000
+
+# types DuckDB may infer for csv columns, matching what pandas.read_csv used to produce
+CSV_TYPE_CANDIDATES = ['BOOLEAN', 'BIGINT', 'DOUBLE', 'VARCHAR']
+
+_MAX_TRACKED_UPLOADS = 256
+_upload_progress: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_upload_progress_lock = threading.Lock()
+
+
+def report_progress(upload_id: Optional[str], **progress):
+    """Record the progress of an upload (stage, bytes_received, rows_loaded, ...)"""
+    if not upload_id:
+        return
+    with _upload_progress_lock:
+        entry = _upload_progress.setdefault(upload_id, {})
+        entry.update(progress, updated_at=time.time())
+        _upload_progress.move_to_end(upload_id)
+        while len(_upload_progress) > _MAX_TRACKED_UPLOADS:
+            _upload_progress.popitem(last=False)
+
+
+def get_progress(upload_id: str) -> Optional[Dict[str, Any]]:
+    """Get the last reported progress of an upload"""
+    with _upload_progress_lock:
+        entry = _upload_progress.get(upload_id)
+        return dict(entry) if entry is not None else None
+
+
+def spool_upload(file, upload_id: Optional[str] = None, hasher=None) -> str:
+    """Copy an uploaded file (werkzeug FileStorage) to a temporary file in chunks, feeding
+    them to `hasher` (a hashlib object) if given"""
+    suffix = os.path.splitext(file.filename)[1].lower()
+    fd, path = tempfile.mkstemp(prefix='df_upload_', suffix=suffix)
+    bytes_received = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(1024 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                bytes_received += len(chunk)
+                report_progress(upload_id, stage='spooling', bytes_received=bytes_received)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _is_json_array(path: str) -> bool:
+    """Whether a json file holds a top level array (records) rather than an object"""
+    with open(path, 'rb') as f:
+        head = f.read(4096).lstrip(b'\xef\xbb\xbf').lstrip()
+    return head.startswith(b'[')
+
+
+def _ingest_excel(conn, path: str, table_name: str, upload_id: Optional[str]) -> int:
+    """Stream the first sheet of an xlsx file into a new table in chunks of EXCEL_CHUNK_SIZE rows"""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("The uploaded excel file is empty")
+        columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+
+        rows_loaded = 0
+        created = False
+        while True:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= EXCEL_CHUNK_SIZE:
+                    break
+            if not chunk and created:
+                break
+
+            chunk_df = pd.DataFrame(chunk, columns=columns).infer_objects()
+            conn.register('df_temp', chunk_df)
+            try:
+                if not created:
+                    conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM df_temp")
+                    created = True
+                else:
+                    conn.execute(f"INSERT INTO {table_name} SELECT * FROM df_temp")
+            finally:
+                conn.unregister('df_temp')
+
+            rows_loaded += len(chunk)
+            report_progress(upload_id, stage='loading', rows_loaded=rows_loaded)
+            if len(chunk) < EXCEL_CHUNK_SIZE:
+                break
+        return rows_loaded
+    finally:
+        workbook.close()
+
+
+def ingest_file_to_duckdb(conn, path: str, file_name: str, table_name: str,
+                          upload_id: Optional[str] = None) -> Tuple[int, List[str]]:
+    """Load a spooled upload into a new DuckDB table.
+
+    Returns:
+        (row_count, column_names) of the created table
+    """
+    file_name = file_name.lower()
+    report_progress(upload_id, stage='loading', rows_loaded=0)
+
+    native_query = _native_read_query(path, file_name)
+    if native_query is not None:
+        conn.execute(f"CREATE TABLE {table_name} AS {native_query}", [path])
+    elif file_name.endswith('.xlsx'):
+        try:
+            _ingest_excel(conn, path, table_name, upload_id)
+        except Exception as e:
+            # later chunks may not fit the column types inferred from the first one,
+            # retry by loading the whole sheet with pandas
+            logger.warning(f"Chunked excel ingestion failed, falling back to pandas: {e}")
+            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+            _ingest_df(conn, pd.read_excel(path), table_name)
+    elif file_name.endswith('.xls'):
+        _ingest_df(conn, pd.read_excel(path), table_name)
+    else:
+        # json objects in other orientations (e.g. columns -> values)
+        _ingest_df(conn, pd.read_json(path), table_name)
+
+    row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    columns = [col[0] for col in conn.execute(f"DESCRIBE {table_name}").fetchall()]
+    report_progress(upload_id, stage='done', rows_loaded=row_count)
+    return row_count, columns
+
+
+def export_file_to_parquet(conn, path: str, file_name: str, parquet_path: str, upload_id: Optional[str] = None):
+    """Convert a spooled upload to a parquet file, with the same columns and types ingest_file_to_duckdb
+    would create. CSV and json arrays are streamed through `conn`, other formats are staged in an in-memory database."""
+    copy_options = "(FORMAT PARQUET, COMPRESSION ZSTD)"
+    native_query = _native_read_query(path, file_name.lower())
+    if native_query is not None:
+        report_progress(upload_id, stage='loading', rows_loaded=0)
+        conn.execute(f"COPY ({native_query}) TO {quote_path(parquet_path)} {copy_options}", [path])
+        return
+
+    staging_conn = duckdb.connect(database=":memory:")
+    try:
+        ingest_file_to_duckdb(staging_conn, path, file_name, "df_upload", upload_id)
+        staging_conn.execute(f"COPY df_upload TO {quote_path(parquet_path)} {copy_options}")
+    finally:
+        staging_conn.close()
+
+
+def export_df_to_parquet(conn, df: pd.DataFrame, parquet_path: str):
+    """Write a DataFrame to a parquet file, with the column types a table created from it would have"""
+    conn.register('df_temp', df)
+    try:
+        conn.execute(f"COPY (SELECT * FROM df_temp) TO {quote_path(parquet_path)} (FORMAT PARQUET, COMPRESSION ZSTD)")
+    finally:
+        conn.unregister('df_temp')
+
+
+def _native_read_query(path: str, file_name: str) -> Optional[str]:
+    """SELECT reading the file at parameter $1 with DuckDB's own readers, None for formats loaded through pandas"""
+    if file_name.endswith('.csv'):
+        return f"SELECT * FROM read_csv($1, auto_type_candidates = {CSV_TYPE_CANDIDATES})"
+    if file_name.endswith('.json') and _is_json_array(path):
+        return "SELECT * FROM read_json($1, format = 'array')"
+    return None
+
+
+def _ingest_df(conn, df: pd.DataFrame, table_name: str):
+    conn.register('df_temp', df)
+    try:
+        conn.execute(f"CREATE TABLE {table_name} AS SELECT * FROM df_temp")
+    finally:
+        conn.unregister('df_temp')
@@ -13,7 +13,7 @@ from data_formulator.agents.agent_sql_data_rec import SQLDataRecAgent
 from data_formulator.agents.client_utils import Client
 from data_formulator.db_manager import db_manager
 from data_formulator.workflows.create_vl_plots import assemble_vegailte_chart, spec_to_base64, detect_field_type
-from data_formulator.agents.agent_utils import extract_json_objects
+from data_formulator.agents.agent_utils import extract_json_objects, get_input_table_sample_rows
 
 logger = logging.getLogger(__name__)
 
@@ -75,7 +75,7 @@ def run_exploration_flow_streaming(
     
     Args:
         model_config: Dictionary with endpoint, model, api_key, api_base, api_version
-        input_tables: List of input table dictionaries with 'name' 'rows' and 'attached_metadata'
+        input_tables: List of input table dictionaries with 'name' 'rows' (or a resolved table reference 'df') and 'attached_metadata'
         plan: List of steps to continue exploring
         language: "python" or "sql" for data transformation
         session_id: Database session ID for SQL connections
@@ -140,7 +140,7 @@ def run_exploration_flow_streaming(
     # Track initial plan if provided
     if len(initial_plan) > 1:
         exploration_plan_list.append({
-            "ref_tables": [{"name": table['name'], "rows": table['rows'][:5] if 'rows' in table else []} for table in input_tables],
+            "ref_tables": [{"name": table['name'], "rows": get_input_table_sample_rows(table, 5, db_conn)} for table in input_tables],
             "plan": initial_plan[1:]
         })
 
@@ -296,7 +296,7 @@ def run_exploration_flow_streaming(
                 "rows": last_step_data.get('rows', [])[:5]
             }]
         else:
-            last_step_table = [{"name": table['name'], "rows": table['rows'][:5] if 'rows' in table else []} for table in input_tables]
+            last_step_table = [{"name": table['name'], "rows": get_input_table_sample_rows(table, 5, db_conn)} for table in input_tables]
         
         exploration_plan_list.append({
             "ref_tables": last_step_table,
@@ -109,9 +109,10 @@ interface DBTable {
         name: string;
         type: string;
     }[];
-    row_count: number;
+    row_count: number | null; // catalog estimate (null for views) until the sample rows are loaded
     sample_rows: any[];
     view_source: string | null;
+    sample_loaded?: boolean; // list-tables sends no rows, they are fetched when the table is shown
 }
 
 interface ColumnStatistics {
@@ -503,7 +504,35 @@ export const DBTableSelectionDialog: React.FC<{
         }
     };
 
-    const handleAddTableToDF = (dbTable: DBTable) => {
+    // fetch the first rows and the exact row count of a table listed without them
+    const loadTableSample = async (dbTable: DBTable): Promise<DBTable> => {
+        if (dbTable.sample_loaded) return dbTable;
+        try {
+            const response = await fetch(getUrls().SAMPLE_TABLE, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ table: dbTable.name, size: 1000, method: 'head' }),
+            });
+            const data = await response.json();
+            if (data.status !== 'success') return dbTable;
+            const loadedTable = { ...dbTable, sample_rows: data.rows, row_count: data.total_row_count, sample_loaded: true };
+            setDbTables(tables => tables.map(t => t.name === dbTable.name ? loadedTable : t));
+            return loadedTable;
+        } catch (error) {
+            setSystemMessage(`Failed to fetch rows of table ${dbTable.name}`, "error");
+            return dbTable;
+        }
+    };
+
+    useEffect(() => {
+        const selectedTable = dbTables.find(t => t.name === selectedTabKey);
+        if (selectedTable && !selectedTable.sample_loaded) {
+            loadTableSample(selectedTable);
+        }
+    }, [selectedTabKey, dbTables]);
+
+    const handleAddTableToDF = async (tableToAdd: DBTable) => {
+        const dbTable = await loadTableSample(tableToAdd);
         const convertSqlTypeToAppType = (sqlType: string): Type => {
             // Convert SQL types to application types
             sqlType = sqlType.toUpperCase();
@@ -535,7 +564,7 @@ export const DBTableSelectionDialog: React.FC<{
             rows: dbTable.sample_rows,
             virtual: {
                 tableId: dbTable.name,
-                rowCount: dbTable.row_count,
+                rowCount: dbTable.row_count ?? dbTable.sample_rows.length,
             },
             anchored: true, // by default, db tables are anchored
             createdBy: 'user',
@@ -855,7 +884,7 @@ export const DBTableSelectionDialog: React.FC<{
                                     {currentTable.name}
                                 </Typography>
                                 <Typography component="span" sx={{ml: 1, fontSize: 10, color: "text.secondary"}}>
-                                    ({currentTable.columns.length} columns × {currentTable.row_count} rows)
+                                    ({currentTable.columns.length} columns × {currentTable.row_count ?? "?"} rows)
                                 </Typography>
                             </Typography>
                             <Box sx={{ marginLeft: 'auto', display: 'flex', gap: 1 }}>
@@ -897,7 +926,7 @@ export const DBTableSelectionDialog: React.FC<{
                                 }))}
                                 rowsPerPageNum={-1}
                                 compact={false}
-                                isIncompleteTable={currentTable.row_count > 10}
+                                isIncompleteTable={(currentTable.row_count ?? 0) > 10}
                             />
                         )}
                     </Paper>
@@ -1184,7 +1213,9 @@ export const DataLoaderForm: React.FC<{
                             const errors = results.filter(r => r.status !== "success");
                             if (errors.length === 0) {
                                 setSelectedTables(new Set());
-                                onFinish("success", `Successfully imported ${tablesToImport.length} table(s)`, tablesToImport);
+                                // the server reports the name each table was created under, which may differ from the source name
+                                onFinish("success", `Successfully imported ${tablesToImport.length} table(s)`,
+                                    results.map((r, i) => r.table_name ?? tablesToImport[i]));
                             } else {
                                 onFinish("error", `Failed to import some tables: ${errors.map(e => e.error).join(", ")}`);
                             }
@@ -1346,7 +1377,7 @@ export const DataQueryForm: React.FC<{
     availableTables: {name: string, fields: string[]}[],
     dataLoaderParams: Record<string, string>,
     onImport: () => void,
-    onFinish: (status: "success" | "error", message: string) => void
+    onFinish: (status: "success" | "error", message: string, importedTables?: string[]) => void
 }> = ({dataLoaderType, availableTables, dataLoaderParams, onImport, onFinish}) => {
 
     let activeModel = useSelector(dfSelectors.getActiveModel);
@@ -1463,7 +1494,7 @@ export const DataQueryForm: React.FC<{
         .then(data => {
             setWaiting(false);
             if (data.status === "success") {
-                onFinish("success", "Data imported successfully");
+                onFinish("success", "Data imported successfully", data.table_name ? [data.table_name] : undefined);
             } else {
                 onFinish("error", data.reasoning);
             }
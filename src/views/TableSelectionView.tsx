@@ -71,6 +71,7 @@ export interface DatasetMetadata {
         url: string;
         format: string;
         sample: any[];
+        catalog_table?: string | null; // table of the server's example catalog, null if it isn't loaded there
     }[];
 }
 
@@ -218,6 +219,7 @@ export const DatasetSelectionDialog: React.FC<{ buttonElement: any }> = function
                                 url: table["url"],
                                 format: table["format"],
                                 sample: table["sample"],
+                                catalog_table: table["catalog_table"],
                             }
                         }
                         else if (table["format"] == "csv" || table["format"] == "tsv") {
@@ -243,6 +245,7 @@ export const DatasetSelectionDialog: React.FC<{ buttonElement: any }> = function
                                     url: table["url"],
                                     format: table["format"],
                                     sample: sampleData,
+                                    catalog_table: table["catalog_table"],
                                 };
                             }
                             
@@ -251,6 +254,7 @@ export const DatasetSelectionDialog: React.FC<{ buttonElement: any }> = function
                                 url: table["url"],
                                 format: table["format"],
                                 sample: [],
+                                catalog_table: table["catalog_table"],
                             };
                         }
                     })
@@ -261,6 +265,50 @@ export const DatasetSelectionDialog: React.FC<{ buttonElement: any }> = function
       }, []);
 
     let dispatch = useDispatch<AppDispatch>();
+    const serverConfig = useSelector((state: DataFormulatorState) => state.serverConfig);
+
+    // download the example file and load it in the browser
+    const loadTableFromUrl = (table: DatasetMetadata["tables"][number]) => {
+        fetch(table.url)
+        .then(res => res.text())
+        .then(textData => {
+            let tableName = table.url.split("/").pop()?.split(".")[0] || 'table-' + Date.now().toString().substring(0, 8);
+            let dictTable;
+            if (table.format == "csv") {
+                dictTable = createTableFromText(tableName, textData);
+            } else if (table.format == "json") {
+                dictTable = createTableFromFromObjectArray(tableName, JSON.parse(textData), true);
+            } 
+            if (dictTable) {
+                dispatch(dfActions.loadTable(dictTable));
+                dispatch(fetchFieldSemanticType(dictTable));
+            }
+            
+        });
+    }
+
+    // add the example table to the session database as a view of the server's example catalog,
+    // only its sample rows are sent to the browser
+    const loadCatalogTable = (table: DatasetMetadata["tables"][number]) => {
+        let tableName = table.url.split("/").pop()?.split(".")[0] || table.catalog_table;
+        fetch(getUrls().LOAD_EXAMPLE_TABLE, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ catalog_table: table.catalog_table, table_name: tableName }),
+        })
+        .then(res => res.json())
+        .then(result => {
+            if (result.status !== "success" || result.sample_rows.length == 0) {
+                loadTableFromUrl(table);
+                return;
+            }
+            let dictTable = createTableFromFromObjectArray(result.table_name, result.sample_rows, true);
+            dictTable.virtual = { tableId: result.table_name, rowCount: result.row_count };
+            dispatch(dfActions.loadTable(dictTable));
+            dispatch(fetchFieldSemanticType(dictTable));
+        })
+        .catch(() => loadTableFromUrl(table));
+    }
 
     return <>
         <Button sx={{fontSize: "inherit"}} onClick={() => {
@@ -289,22 +337,11 @@ export const DatasetSelectionDialog: React.FC<{ buttonElement: any }> = function
                         handleSelectDataset={(dataset) => {
                             setTableDialogOpen(false);
                             for (let table of dataset.tables) { 
-                                fetch(table.url)
-                                .then(res => res.text())
-                                .then(textData => {
-                                    let tableName = table.url.split("/").pop()?.split(".")[0] || 'table-' + Date.now().toString().substring(0, 8);
-                                    let dictTable;
-                                    if (table.format == "csv") {
-                                        dictTable = createTableFromText(tableName, textData);
-                                    } else if (table.format == "json") {
-                                        dictTable = createTableFromFromObjectArray(tableName, JSON.parse(textData), true);
-                                    } 
-                                    if (dictTable) {
-                                        dispatch(dfActions.loadTable(dictTable));
-                                        dispatch(fetchFieldSemanticType(dictTable));
-                                    }
-                                    
-                                });
+                                if (table.catalog_table && !serverConfig.DISABLE_DATABASE) {
+                                    loadCatalogTable(table);
+                                } else {
+                                    loadTableFromUrl(table);
+                                }
                             } 
                         }}/>
                 </DialogContent>